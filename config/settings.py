@@ -176,6 +176,115 @@ GPU_SERVER_URL = 'http://localhost:8000'
 
 # Timeout per richieste OCR (in secondi)
 OCR_REQUEST_TIMEOUT = 300  # 5 minuti
+OCR_CONNECT_TIMEOUT = 10
+
+# Client HTTP del server GPU: connessioni persistenti, retry con backoff
+# esponenziale e jitter sugli errori temporanei (rete, 502/503/504)
+# Il client è condiviso dai thread del worker OCR: almeno pari alla sua --concurrency
+OCR_HTTP_POOL_SIZE = 16
+OCR_HTTP_MAX_RETRIES = 3
+OCR_HTTP_BACKOFF_BASE = 1.0  # secondi
+OCR_HTTP_BACKOFF_MAX = 30.0
+
+# Circuit breaker: dopo N richieste fallite consecutive l'invio OCR viene
+# sospeso per OCR_CIRCUIT_RESET_TIMEOUT secondi; i documenti restano in coda
+# e vengono reinviati fino a OCR_DISPATCH_MAX_DEFERRALS volte
+OCR_CIRCUIT_FAILURE_THRESHOLD = 5
+OCR_CIRCUIT_RESET_TIMEOUT = 60
+OCR_DISPATCH_MAX_DEFERRALS = 60
+
+# Invio batch: i documenti in coda vengono raccolti per OCR_BATCH_WINDOW secondi
+# e inviati in richieste multi-file, raggruppati per dimensione; lo stato dei
+# task viene interrogato con una richiesta ogni OCR_STATUS_BATCH_SIZE task.
+# Per provarlo senza GPU: python manage.py ocr_standin_server --port 8000
+OCR_BATCH_ENABLED = True
+OCR_BATCH_WINDOW = 10
+OCR_BATCH_MAX_FILES = 16
+OCR_BATCH_MAX_BYTES = 64 * 1024 * 1024
+OCR_STATUS_BATCH_SIZE = 100
+# Durante un invio i documenti presi in carico ricevono un heartbeat (updated_at)
+# ogni OCR_CLAIM_HEARTBEAT secondi: lo sweeper rilascia solo i claim senza
+# heartbeat da OCR_STALE_AFTER secondi (worker terminato), non gli invii lenti
+OCR_CLAIM_HEARTBEAT = 60
+
+# Indicizzazione incrementale: le pagine OCR inviate dal server GPU con i
+# progressi ("pages" nel payload) diventano ricercabili prima della fine dell'OCR
+OCR_INCREMENTAL_INDEXING = True
+
+# I PDF da almeno OCR_UPLOAD_CHUNKED_MIN_BYTES vengono caricati a blocchi di
+# OCR_UPLOAD_CHUNK_SIZE byte con checksum: un invio interrotto riprende
+# dall'ultimo blocco ricevuto invece di ricominciare da zero
+OCR_UPLOAD_CHUNKED_MIN_BYTES = 16 * 1024 * 1024
+OCR_UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+
+# Callback di completamento/progresso OCR: URL raggiungibile dal server GPU
+# (ad es. tramite tunnel inverso: ssh -N -R 8001:localhost:8000 ubuntu@163.192.12.203)
+# e segreto condiviso con cui il server firma le richieste (HMAC-SHA256)
+OCR_CALLBACK_URL = ''  # es. 'http://localhost:8001/documents/ocr/callback/'
+OCR_CALLBACK_SECRET = ''
+OCR_CALLBACK_MAX_SKEW = 300  # secondi di tolleranza sul timestamp firmato
+# Il callback 'completed' contiene l'intero testo OCR: limite proprio invece di
+# DATA_UPLOAD_MAX_MEMORY_SIZE (2.5 MB), che vale per tutte le altre richieste
+OCR_CALLBACK_MAX_BYTES = 100 * 1024 * 1024
+
+# Sweeper di fallback: ricontrolla i task OCR senza aggiornamenti da OCR_STALE_AFTER
+# secondi e marca come falliti quelli fermi da OCR_MAX_IDLE secondi
+OCR_STALE_AFTER = 300
+OCR_MAX_IDLE = 3600
+
+# ==================== BULK INGEST ====================
+
+# Numero massimo di file in un singolo caricamento multiplo dal browser
+DATA_UPLOAD_MAX_NUMBER_FILES = 1000
+
+# I documenti vengono inseriti con bulk_create a blocchi di BULK_CREATE_BATCH_SIZE;
+# i file più grandi di BULK_MAX_FILE_BYTES vengono scartati
+BULK_CREATE_BATCH_SIZE = 500
+BULK_MAX_FILE_BYTES = 200 * 1024 * 1024
+
+# Al più BULK_INGEST_MAX_CONCURRENCY documenti di un job in elaborazione alla volta;
+# i successivi partono ogni BULK_INGEST_DISPATCH_INTERVAL secondi man mano che si liberano posti
+BULK_INGEST_MAX_CONCURRENCY = 16
+BULK_INGEST_DISPATCH_INTERVAL = 15
+
+# ==================== CODE DI INDICIZZAZIONE ====================
+
+# L'indicizzazione parte su una coda per classe di dimensione (rag_small,
+# rag_medium, rag_large): 'small' fino a INGEST_SMALL_MAX_PAGES pagine, 'large'
+# da INGEST_LARGE_MIN_PAGES. Se il numero di pagine non è noto decide la
+# dimensione del file.
+INGEST_SMALL_MAX_PAGES = 20
+INGEST_LARGE_MIN_PAGES = 200
+INGEST_SMALL_MAX_BYTES = 2 * 1024 * 1024
+INGEST_LARGE_MIN_BYTES = 50 * 1024 * 1024
+
+# Documenti in corso per classe (in esecuzione o già nel broker): circa la
+# concurrency dei worker che consumano la coda. I posti liberi vanno a turno
+# agli utenti con meno documenti in corso; INGEST_MAX_PER_UPLOADER > 0 limita
+# i documenti in corso di un singolo utente per classe.
+INGEST_QUEUE_SLOTS = {'small': 4, 'medium': 2, 'large': 1}
+INGEST_MAX_PER_UPLOADER = 0
+# Un documento rimasto in 'rag_processing' oltre TASK_LEASE_TTL (task terminato)
+# torna in coda; dopo questo numero di interruzioni viene marcato 'failed'
+INDEXING_MAX_INTERRUPTIONS = 1
+
+# ==================== LEASE DEI TASK ====================
+
+# Lease Redis per documento su index_document_rag e process_scanned_document:
+# le copie duplicate dello stesso task vengono scartate. Vuoto = Redis del broker.
+TASK_LEASE_REDIS_URL = ''
+# Un lease non rilasciato (worker terminato) scade dopo TASK_LEASE_TTL secondi
+TASK_LEASE_TTL = 3660  # CELERY_TASK_TIME_LIMIT + 1 minuto
+
+# ==================== AVANZAMENTO IN TEMPO REALE ====================
+
+# I task pubblicano gli stati dei documenti su Redis pub/sub (stesso Redis dei
+# lease) e la dashboard li riceve con uno stream SSE servito dall'app ASGI
+PROGRESS_STREAM_HEARTBEAT = 15  # secondi tra i commenti keepalive
+PROGRESS_STREAM_MAX_SECONDS = 300  # poi il browser si ricollega da solo
+PROGRESS_STREAM_RETRY_MS = 3000
+# Intervallo minimo tra due eventi di avanzamento dell'indicizzazione
+PROGRESS_MIN_INTERVAL = 1.0
 
 # ==================== CELERY TASK ROUTES ====================
 
@@ -184,11 +293,41 @@ CELERY_TASK_ROUTES = {
     # Task OCR (comunicazione con Lambda.ai)
     'doc_manager.tasks.process_scanned_document': {'queue': 'ocr'},
     'doc_manager.tasks.check_ocr_status': {'queue': 'ocr'},
+    'doc_manager.tasks.sweep_ocr_documents': {'queue': 'ocr'},
+    'doc_manager.tasks.submit_ocr_batch': {'queue': 'ocr'},
+
+    # Caricamento in blocco
+    'doc_manager.tasks.ingest_bulk_job': {'queue': 'default'},
+    'doc_manager.tasks.dispatch_bulk_job': {'queue': 'celery'},
     
-    # Task RAG (elaborazione locale)
-    'doc_manager.tasks.index_document_rag': {'queue': 'default'},
+    # Task RAG (elaborazione locale). index_document_rag viene inviato da
+    # schedule_indexing sulla coda della classe di dimensione del documento
+    'doc_manager.tasks.index_document_rag': {'queue': 'rag_medium'},
+    'doc_manager.tasks.index_ocr_pages': {'queue': 'rag_small'},
+    'doc_manager.tasks.schedule_indexing': {'queue': 'celery'},
 }
 
+# Task periodici (celery -A config beat)
+CELERY_BEAT_SCHEDULE = {
+    'sweep-ocr-documents': {
+        'task': 'doc_manager.tasks.sweep_ocr_documents',
+        'schedule': 60.0,
+    },
+    'schedule-indexing': {
+        'task': 'doc_manager.tasks.schedule_indexing',
+        'schedule': 30.0,
+    },
+}
+
+# Carica converter Docling, modello di embedding e tokenizer nel processo
+# principale dei worker che consumano la coda 'default' (worker_init): i figli
+# del pool prefork li condividono copy-on-write
+DOCLING_PRELOAD_CONVERTERS = True
+
+# Thread di torch per ogni processo figlio del worker RAG (0 = default di torch,
+# cioè tutti i core): con N figli conviene circa core / N
+RAG_WORKER_TORCH_THREADS = 0
+
 # Task limits
 CELERY_TASK_TIME_LIMIT = 3600  # 1 ora max
 CELERY_TASK_SOFT_TIME_LIMIT = 3000  # 50 minuti
\ No newline at end of file
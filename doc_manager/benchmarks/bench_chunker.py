@@ -0,0 +1,121 @@
+"""
+Micro-benchmark del Chunker incrementale rispetto all'implementazione
+precedente (ricalcolo di len("\\n".join(buffer)) ad ogni elemento).
+
+Uso:
+    python doc_manager/benchmarks/bench_chunker.py --pages 500
+    python doc_manager/benchmarks/bench_chunker.py --pdf manuale.pdf
+"""
+import argparse
+import time
+
+from fixtures import make_docling_document, best_time, setup_django
+
+setup_django()
+
+from doc_manager.rag_pipeline.processing import (
+    Chunker, convert_table_to_markdown, convert_pdf_to_doc,
+    MAX_TEXT_CHUNK_SIZE, CHUNK_OVERLAP_SIZE
+)
+
+
+def legacy_create_chunks(doc, max_chunk_size=MAX_TEXT_CHUNK_SIZE, overlap=CHUNK_OVERLAP_SIZE):
+    """Copia dell'algoritmo originale, usata come riferimento (senza rimozione del boilerplate)."""
+    all_chunks, text_buffer, current_page = [], [], 1
+    last = [""]
+
+    def flush(page_num):
+        if text_buffer:
+            content = "\n".join(text_buffer)
+            all_chunks.append({"content": content, "metadata": {"page": page_num, "type": "text"}})
+            last[0] = content
+        text_buffer.clear()
+
+    item_map = {item.self_ref: item for item in (doc.texts + doc.tables + doc.pictures)}
+
+    for ref_item in doc.body.children:
+        if ref_item.cref not in item_map:
+            continue
+        item = item_map[ref_item.cref]
+        if item.prov:
+            current_page = item.prov[0].page_no
+        item_type = item.label.name
+
+        if item_type in ['TEXT', 'SECTION_HEADER', 'LIST']:
+            current_buffer_length = len("\n".join(text_buffer)) if text_buffer else 0
+            if current_buffer_length + len(item.text) + 1 > max_chunk_size:
+                flush(current_page)
+                if last[0]:
+                    text_buffer.append(last[0][-overlap:])
+            text_buffer.append(item.text)
+        elif item_type == 'TABLE':
+            flush(current_page)
+            last[0] = ""
+            all_chunks.append({
+                "content": convert_table_to_markdown(item.data, current_page),
+                "metadata": {"page": current_page, "type": "table"}
+            })
+        elif item_type == 'PICTURE':
+            flush(current_page)
+            last[0] = ""
+            captions = [item_map[ref.cref].text for ref in item.captions if ref.cref in item_map]
+            desc = "\n".join(captions) if captions else "Immagine rilevata (nessuna didascalia trovata)"
+            all_chunks.append({
+                "content": f"Riferimento a immagine (Pagina {current_page}). Didascalia: '{desc}'",
+                "metadata": {"page": current_page, "type": "image"}
+            })
+
+    flush(current_page)
+    return all_chunks
+
+
+def run_benchmark(doc, max_chunk_size, repeat):
+    legacy_time, legacy_chunks = best_time(lambda: legacy_create_chunks(doc, max_chunk_size), repeat)
+    new_time, new_chunks = best_time(
+        lambda: list(Chunker(max_chunk_size=max_chunk_size, strip_boilerplate=False, max_tokens=0).iter_chunks(doc)), repeat
+    )
+    full_time, _ = best_time(lambda: list(Chunker(max_chunk_size=max_chunk_size, max_tokens=0).iter_chunks(doc)), repeat)
+
+    if new_chunks != legacy_chunks:
+        print("ATTENZIONE: l'output del Chunker differisce da quello legacy")
+
+    # Tempo al primo chunk: con il generatore l'embedding può iniziare subito
+    start = time.perf_counter()
+    next(iter(Chunker(max_chunk_size=max_chunk_size, strip_boilerplate=False, max_tokens=0).iter_chunks(doc)))
+    first_chunk_time = time.perf_counter() - start
+
+    print(f"Elementi nel documento: {len(doc.body.children)}")
+    print(f"Dimensione chunk:       {max_chunk_size} caratteri")
+    print("-"*60)
+    print(f"Legacy:   {legacy_time*1000:9.1f} ms  ({len(legacy_chunks)} chunk)")
+    print(f"Chunker:  {new_time*1000:9.1f} ms  ({len(new_chunks)} chunk)")
+    print(f"Speedup:  {legacy_time / new_time:9.2f}x")
+    print(f"Chunker + rimozione boilerplate: {full_time*1000:.1f} ms")
+    print(f"Primo chunk disponibile dopo {first_chunk_time*1000:.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del Chunker incrementale")
+    parser.add_argument('--pages', type=int, default=300, help="Pagine del documento sintetico")
+    parser.add_argument('--items-per-page', type=int, default=12)
+    parser.add_argument('--chunk-size', type=int, nargs='+', default=[MAX_TEXT_CHUNK_SIZE, 8000])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--pdf', help="PDF reale da convertire con Docling al posto del documento sintetico")
+    args = parser.parse_args()
+
+    print("\n" + "="*60)
+    print("BENCHMARK CHUNKER")
+    print("="*60)
+
+    if args.pdf:
+        doc = convert_pdf_to_doc(args.pdf)
+    else:
+        doc = make_docling_document(pages=args.pages, items_per_page=args.items_per_page)
+
+    for chunk_size in args.chunk_size:
+        print()
+        run_benchmark(doc, chunk_size, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Benchmark della pulizia del Markdown OCR (_clean_markdown) rispetto alle
+14 passate re.sub originali, con verifica che l'output sia identico
+byte per byte su un corpus di riferimento.
+
+Uso:
+    python doc_manager/benchmarks/bench_markdown_cleaner.py --pages 500
+    python doc_manager/benchmarks/bench_markdown_cleaner.py --ocr-file output_ocr.md
+"""
+import argparse
+import re
+
+from fixtures import make_ocr_text, best_time, setup_django
+
+setup_django()
+
+from doc_manager.rag_pipeline.processing import _clean_markdown, iter_ocr_segments, split_ocr_pages, SEGMENT_TEXT
+
+# Casi limite in cui l'ordine delle passate cambia il risultato
+EDGE_CASES = [
+    "", "   ", "# Titolo", "###### h6", "####### h7", "#senza spazio",
+    "**grassetto** e *corsivo* e ***entrambi***", "__sottolineato__ _corsivo_ ___tre___",
+    "a * b * c", "snake_case_name e altro_nome", "`codice` e ```blocco\nmulti riga```",
+    "```non chiuso", "[link](http://x.y) e ![img](a.png) e ![](vuoto.png)",
+    "---\n***\n___\n-_*\n--", "> citazione\n>senza spazio", "- punto\n* stella\n+ più\n-attaccato",
+    "a\n\n\n\nb\n\n\nc", "molti    spazi   qui", "**non chiuso", "*\n*", "_a\nb_",
+    "riga # non titolo", "  # titolo indentato", "| a | b |", "\t\tcon tab\t",
+]
+
+
+def legacy_clean_markdown(text):
+    """Copia dell'implementazione originale, usata come riferimento."""
+    text = re.sub(r'^#{1,6}\s+', '', text, flags=re.MULTILINE)
+    text = re.sub(r'\*\*(.+?)\*\*', r'\1', text)
+    text = re.sub(r'__(.+?)__', r'\1', text)
+    text = re.sub(r'\*(.+?)\*', r'\1', text)
+    text = re.sub(r'_(.+?)_', r'\1', text)
+    text = re.sub(r'`(.+?)`', r'\1', text)
+    text = re.sub(r'\[(.+?)\]\(.+?\)', r'\1', text)
+    text = re.sub(r'!\[.*?\]\(.+?\)', '', text)
+    text = re.sub(r'```[\s\S]*?```', '', text)
+    text = re.sub(r'^[\-_\*]{3,}$', '', text, flags=re.MULTILINE)
+    text = re.sub(r'^>\s+', '', text, flags=re.MULTILINE)
+    text = re.sub(r'^[\-\*\+]\s+', '', text, flags=re.MULTILINE)
+    text = re.sub(r'\n{3,}', '\n\n', text)
+    text = re.sub(r' {2,}', ' ', text)
+    return text.strip()
+
+
+def build_corpus(text):
+    """Sezioni di testo OCR così come arrivano a _clean_markdown durante il chunking."""
+    return [content for _, kind, content in iter_ocr_segments(split_ocr_pages(text)) if kind == SEGMENT_TEXT]
+
+
+def check_golden(corpus):
+    mismatches = [section for section in corpus if _clean_markdown(section) != legacy_clean_markdown(section)]
+    if mismatches:
+        print(f"ATTENZIONE: {len(mismatches)} sezioni con output diverso, ad esempio: {mismatches[0][:80]!r}")
+    else:
+        print(f"Output identico su {len(corpus)} sezioni")
+    return not mismatches
+
+
+def run_benchmark(corpus, repeat):
+    size_mb = sum(len(section) for section in corpus) / 1024 / 1024
+    check_golden(corpus + EDGE_CASES)
+
+    legacy_time, _ = best_time(lambda: [legacy_clean_markdown(section) for section in corpus], repeat)
+    new_time, _ = best_time(lambda: [_clean_markdown(section) for section in corpus], repeat)
+
+    print(f"Sezioni:  {len(corpus)} ({size_mb:.1f} MB)")
+    print("-"*60)
+    print(f"Legacy:   {legacy_time*1000:9.1f} ms  ({size_mb / legacy_time:.1f} MB/s)")
+    print(f"Nuovo:    {new_time*1000:9.1f} ms  ({size_mb / new_time:.1f} MB/s)")
+    print(f"Speedup:  {legacy_time / new_time:9.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark della pulizia del Markdown OCR")
+    parser.add_argument('--pages', type=int, default=500)
+    parser.add_argument('--paragraphs-per-page', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--ocr-file', nargs='+', help="File di testo OCR reali da usare come corpus")
+    args = parser.parse_args()
+
+    print("\n" + "="*60)
+    print("BENCHMARK PULIZIA MARKDOWN")
+    print("="*60)
+
+    if args.ocr_file:
+        corpus = []
+        for path in args.ocr_file:
+            with open(path, encoding='utf-8') as f:
+                corpus += build_corpus(f.read())
+    else:
+        corpus = build_corpus(make_ocr_text(pages=args.pages, paragraphs_per_page=args.paragraphs_per_page))
+
+    run_benchmark(corpus, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+Benchmark dello scanner a passata singola del markdown OCR rispetto
+all'implementazione precedente (_find_tables ricalcolava l'offset di ogni
+tabella sommando le lunghezze di tutte le righe precedenti).
+
+Uso:
+    python doc_manager/benchmarks/bench_ocr_tokenizer.py --pages 500
+    python doc_manager/benchmarks/bench_ocr_tokenizer.py --ocr-file output_ocr.md
+"""
+import argparse
+
+from fixtures import make_ocr_text, best_time, setup_django
+
+setup_django()
+
+from doc_manager.rag_pipeline.processing import (
+    iter_ocr_page_chunks, iter_ocr_segments, split_ocr_pages,
+    _clean_markdown, _split_long_text, split_markdown_table, HEADING_PATTERN,
+    MAX_TEXT_CHUNK_SIZE, CHUNK_OVERLAP_SIZE
+)
+
+
+def legacy_find_tables(text):
+    """Copia dell'implementazione originale, usata come riferimento."""
+    tables = []
+    lines = text.split('\n')
+    in_table = False
+    table_start_line = 0
+    table_lines = []
+
+    for i, line in enumerate(lines):
+        if '|' in line:
+            if not in_table:
+                in_table = True
+                table_start_line = i
+                table_lines = [line]
+            else:
+                table_lines.append(line)
+        elif in_table:
+            table_content = '\n'.join(table_lines)
+            start_pos = sum(len(l) + 1 for l in lines[:table_start_line])
+            tables.append((start_pos, start_pos + len(table_content), table_content))
+            in_table = False
+            table_lines = []
+
+    if in_table and table_lines:
+        table_content = '\n'.join(table_lines)
+        start_pos = sum(len(l) + 1 for l in lines[:table_start_line])
+        tables.append((start_pos, start_pos + len(table_content), table_content))
+
+    return tables
+
+
+def legacy_ocr_chunks(pages, title, chunk_size=MAX_TEXT_CHUNK_SIZE, overlap=CHUNK_OVERLAP_SIZE):
+    """Copia del ciclo originale di iter_ocr_page_chunks."""
+    chunks = []
+
+    def text_chunks(section, page_num, heading):
+        cleaned_text = _clean_markdown(section)
+        if len(cleaned_text) <= chunk_size:
+            chunks.append({"content": cleaned_text, "metadata": {
+                "page": page_num, "type": "text", "chunk_type": "text",
+                "source_title": title, "heading": heading}})
+        else:
+            for i, chunk_text in enumerate(_split_long_text(cleaned_text, chunk_size, overlap)):
+                chunks.append({"content": chunk_text, "metadata": {
+                    "page": page_num, "type": "text", "chunk_type": "text",
+                    "source_title": title, "heading": heading,
+                    "chunk_index": i, "is_continuation": i > 0}})
+
+    for page_num, page_content in pages.items():
+        last_pos = 0
+        current_heading = None
+        for table_start, table_end, table_content in legacy_find_tables(page_content):
+            if last_pos < table_start:
+                section = page_content[last_pos:table_start].strip()
+                if section:
+                    match = HEADING_PATTERN.search(section)
+                    if match:
+                        current_heading = match.group(1)
+                    text_chunks(section, page_num, current_heading)
+            # Le tabelle grandi vengono divise per righe anche nel riferimento
+            for table_md, row_range in split_markdown_table(table_content, chunk_size, 0):
+                chunks.append({"content": table_md, "metadata": {
+                    "page": page_num, "type": "table", "chunk_type": "table",
+                    "source_title": title, "context_heading": current_heading, **row_range}})
+            last_pos = table_end
+
+        if last_pos < len(page_content):
+            section = page_content[last_pos:].strip()
+            if section:
+                match = HEADING_PATTERN.search(section)
+                if match:
+                    current_heading = match.group(1)
+                text_chunks(section, page_num, current_heading)
+
+    return chunks
+
+
+def legacy_segments(pages):
+    """Solo la parte di scansione dell'implementazione originale (tabelle, sezioni, titoli)."""
+    segments = 0
+    for page_content in pages.values():
+        last_pos = 0
+        for table_start, table_end, _ in legacy_find_tables(page_content):
+            section = page_content[last_pos:table_start].strip()
+            if section:
+                HEADING_PATTERN.search(section)
+                segments += 1
+            segments += 1
+            last_pos = table_end
+        section = page_content[last_pos:].strip()
+        if section:
+            HEADING_PATTERN.search(section)
+            segments += 1
+    return segments
+
+
+def run_benchmark(text, repeat):
+    pages = split_ocr_pages(text)
+
+    legacy_scan, _ = best_time(lambda: legacy_segments(pages), repeat)
+    new_scan, segments = best_time(lambda: sum(1 for _ in iter_ocr_segments(pages)), repeat)
+    legacy_time, legacy_chunks = best_time(lambda: legacy_ocr_chunks(pages, "bench"), repeat)
+    new_time, new_chunks = best_time(lambda: list(iter_ocr_page_chunks(pages, "bench", max_tokens=0)), repeat)
+
+    if new_chunks != legacy_chunks:
+        print("ATTENZIONE: i chunk differiscono da quelli dell'implementazione legacy")
+
+    longest = max(len(p) for p in pages.values()) if pages else 0
+    print(f"Pagine:            {len(pages)} ({len(text) / 1024 / 1024:.1f} MB, pagina più lunga {longest} caratteri)")
+    print(f"Segmenti:          {segments}")
+    print("-"*60)
+    print(f"Scansione legacy:  {legacy_scan*1000:9.1f} ms")
+    print(f"Scansione nuova:   {new_scan*1000:9.1f} ms  ({legacy_scan / new_scan:.2f}x)")
+    print(f"Chunking legacy:   {legacy_time*1000:9.1f} ms  ({len(legacy_chunks)} chunk)")
+    print(f"Chunking nuovo:    {new_time*1000:9.1f} ms  ({legacy_time / new_time:.2f}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dello scanner del markdown OCR")
+    parser.add_argument('--pages', type=int, nargs='+', default=[300, 800])
+    parser.add_argument('--paragraphs-per-page', type=int, nargs='+', default=[10, 80],
+                        help="Paragrafi per pagina: valori alti simulano pagine OCR molto lunghe")
+    parser.add_argument('--tables-per-page', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--ocr-file', help="Testo OCR reale (output del server GPU) al posto di quello sintetico")
+    args = parser.parse_args()
+
+    print("\n" + "="*60)
+    print("BENCHMARK SCANNER MARKDOWN OCR")
+    print("="*60)
+
+    if args.ocr_file:
+        with open(args.ocr_file, encoding='utf-8') as f:
+            print()
+            run_benchmark(f.read(), args.repeat)
+        return
+
+    for pages in args.pages:
+        for paragraphs in args.paragraphs_per_page:
+            print()
+            text = make_ocr_text(pages=pages, paragraphs_per_page=paragraphs,
+                                 table_every=1, tables_per_page=args.tables_per_page)
+            run_benchmark(text, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Confronto dei profili di elaborazione Docling (processing_profiles in rag_config.yaml).
+
+Ogni profilo viene misurato in un processo figlio nuovo, così tempo di
+caricamento dei modelli e picco di memoria non sono falsati dai profili
+misurati in precedenza.
+
+Uso:
+    python doc_manager/benchmarks/bench_profiles.py campioni/
+    python doc_manager/benchmarks/bench_profiles.py campioni/ --profiles fast full --output results/profili.json
+"""
+import sys
+import os
+import argparse
+import glob
+import json
+import multiprocessing
+import time
+
+from fixtures import setup_django
+
+
+def _peak_rss_mb():
+    """Picco di memoria residente del processo corrente in MB."""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss è in KB su Linux e in byte su macOS
+        return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+    except ImportError:
+        import psutil
+        return round(psutil.Process().memory_info().peak_wset / (1024 * 1024), 1)
+
+
+def _measure_profile(profile, pdf_files, result_queue):
+    """Eseguita nel processo figlio: carica il converter e converte tutti i campioni."""
+    setup_django()
+    from doc_manager.rag_pipeline.processing import get_converter, get_pdf_page_count
+
+    _, load_time = get_converter(profile)
+    documents = []
+    for pdf_file in pdf_files:
+        converter, _ = get_converter(profile)
+        start = time.perf_counter()
+        doc = converter.convert(pdf_file).document
+        elapsed = time.perf_counter() - start
+        pages = get_pdf_page_count(pdf_file)
+        documents.append({
+            'file': os.path.basename(pdf_file),
+            'pages': pages,
+            'seconds': round(elapsed, 3),
+            'seconds_per_page': round(elapsed / pages, 3) if pages else None,
+            'tables': len(doc.tables),
+            'pictures': len(doc.pictures),
+        })
+        del doc
+
+    total_pages = sum(d['pages'] for d in documents)
+    total_seconds = sum(d['seconds'] for d in documents)
+    result_queue.put({
+        'profile': profile,
+        'model_load_seconds': round(load_time, 3),
+        'conversion_seconds': round(total_seconds, 3),
+        'seconds_per_page': round(total_seconds / total_pages, 3) if total_pages else None,
+        'peak_rss_mb': _peak_rss_mb(),
+        'documents': documents,
+    })
+
+
+def run_profile(profile, pdf_files):
+    ctx = multiprocessing.get_context('spawn')
+    result_queue = ctx.Queue()
+    process = ctx.Process(target=_measure_profile, args=(profile, pdf_files, result_queue))
+    process.start()
+    result = result_queue.get()
+    process.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dei profili di elaborazione Docling")
+    parser.add_argument('samples', help="Cartella con i PDF campione")
+    parser.add_argument('--profiles', nargs='+', help="Profili da misurare (default: tutti)")
+    parser.add_argument('--output', default='results/bench_profiles.json')
+    args = parser.parse_args()
+
+    setup_django()
+    from doc_manager.rag_pipeline.config import get_processing_profiles
+
+    pdf_files = sorted(glob.glob(os.path.join(args.samples, '*.pdf')))
+    if not pdf_files:
+        parser.error(f"Nessun PDF in {args.samples}")
+    profiles = args.profiles or list(get_processing_profiles())
+
+    print("\n" + "="*60)
+    print("BENCHMARK PROFILI DI ELABORAZIONE")
+    print("="*60)
+    print(f"Campioni: {len(pdf_files)} PDF in {args.samples}")
+
+    results = []
+    for profile in profiles:
+        print(f"\n[{profile}] conversione in corso...")
+        result = run_profile(profile, pdf_files)
+        results.append(result)
+        print(f"  Caricamento modelli: {result['model_load_seconds']:.2f}s")
+        print(f"  Conversione:         {result['conversion_seconds']:.2f}s ({result['seconds_per_page']} s/pagina)")
+        print(f"  Picco memoria:       {result['peak_rss_mb']} MB")
+
+    print("\n" + "-"*60)
+    print(f"{'Profilo':<12}{'Modelli (s)':>12}{'s/pagina':>12}{'RSS (MB)':>12}")
+    for result in results:
+        print(f"{result['profile']:<12}{result['model_load_seconds']:>12}{str(result['seconds_per_page']):>12}{result['peak_rss_mb']:>12}")
+
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump({'samples': [os.path.basename(p) for p in pdf_files], 'results': results}, f, indent=2)
+    print(f"\nRisultati salvati in {args.output}")
+
+
+if __name__ == "__main__":
+    main()
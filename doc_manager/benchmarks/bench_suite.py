@@ -0,0 +1,206 @@
+"""
+Suite di benchmark del chunking: create_chunks, create_chunks_scannedpdf,
+_split_long_text e _clean_markdown su documenti sintetici di dimensione
+configurabile (nessuna GPU, nessuna rete).
+
+Per ogni caso misura chunk/s, caratteri/s, picco di memoria Python
+(tracemalloc) e statistiche sui chunk prodotti, e salva i risultati in JSON
+per confrontarli tra commit diversi.
+
+Uso:
+    python doc_manager/benchmarks/bench_suite.py
+    python doc_manager/benchmarks/bench_suite.py --pages 100 1000 --repeat 5
+    python doc_manager/benchmarks/bench_suite.py --pdf manuale.pdf --ocr-file scansione_ocr.md
+    python doc_manager/benchmarks/bench_suite.py --compare results/bench_suite-abc1234.json
+"""
+import os
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime
+
+from fixtures import make_docling_document, make_ocr_text, setup_django
+
+setup_django()
+
+from doc_manager.rag_pipeline.processing import (
+    get_default_profile, create_chunks, create_chunks_scannedpdf, _split_long_text, _clean_markdown,
+    iter_ocr_segments, split_ocr_pages, SEGMENT_TEXT, MAX_TEXT_CHUNK_SIZE, CHUNK_OVERLAP_SIZE
+)
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def _docling_chars(doc):
+    return sum(len(item.text) for item in doc.texts)
+
+
+def _output_stats(output):
+    """Statistiche sui chunk (dizionari) o sulle stringhe prodotte da un caso."""
+    contents = [c["content"] if isinstance(c, dict) else c for c in output]
+    lengths = [len(c) for c in contents]
+    stats = {
+        'count': len(contents),
+        'chars_out': sum(lengths),
+        'min_length': min(lengths, default=0),
+        'mean_length': round(statistics.mean(lengths), 1) if lengths else 0,
+        'max_length': max(lengths, default=0),
+    }
+    chunks = [c for c in output if isinstance(c, dict)]
+    if chunks:
+        types = {}
+        for chunk in chunks:
+            chunk_type = chunk["metadata"].get("type", "text")
+            types[chunk_type] = types.get(chunk_type, 0) + 1
+        stats['types'] = types
+        token_counts = [c["metadata"]["token_count"] for c in chunks if "token_count" in c["metadata"]]
+        if token_counts:
+            stats['max_tokens'] = max(token_counts)
+            stats['mean_tokens'] = round(statistics.mean(token_counts), 1)
+    return stats
+
+
+def run_case(name, fn, chars_in, repeat):
+    """Esegue `fn` `repeat` volte (miglior tempo) più una volta sotto tracemalloc."""
+    best = float('inf')
+    output = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = fn()
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    out = _output_stats(output)
+    result = {
+        'case': name,
+        'seconds': round(best, 4),
+        'chars_in': chars_in,
+        'chars_per_second': round(chars_in / best) if best else None,
+        'chunks_per_second': round(out['count'] / best, 1) if best else None,
+        'peak_memory_mb': round(peak / (1024 * 1024), 2),
+        'output': out,
+    }
+    print(f"{name:<42}{best*1000:>10.1f} ms{result['chunks_per_second'] or 0:>12.0f} ch/s"
+          f"{(result['chars_per_second'] or 0) / 1e6:>9.2f} MB/s{result['peak_memory_mb']:>9.1f} MB")
+    return result
+
+
+def build_cases(args):
+    """Coppie (nome, funzione, caratteri in ingresso) da misurare."""
+    cases = []
+    for pages in args.pages:
+        doc = make_docling_document(pages=pages, items_per_page=args.items_per_page, seed=args.seed)
+        cases.append((f"create_chunks[{pages}p]",
+                      lambda doc=doc: create_chunks(doc, max_tokens=args.max_tokens),
+                      _docling_chars(doc)))
+
+        ocr_text = make_ocr_text(pages=pages, paragraphs_per_page=args.paragraphs_per_page, seed=args.seed)
+        cases.append((f"create_chunks_scannedpdf[{pages}p]",
+                      lambda text=ocr_text: create_chunks_scannedpdf(text, "bench", max_tokens=args.max_tokens),
+                      len(ocr_text)))
+
+        sections = [content for _, kind, content in iter_ocr_segments(split_ocr_pages(ocr_text)) if kind == SEGMENT_TEXT]
+        cases.append((f"_clean_markdown[{pages}p]",
+                      lambda sections=sections: [_clean_markdown(section) for section in sections],
+                      sum(len(section) for section in sections)))
+
+        long_text = _clean_markdown("\n\n".join(sections))
+        cases.append((f"_split_long_text[{pages}p]",
+                      lambda text=long_text: _split_long_text(text, MAX_TEXT_CHUNK_SIZE, CHUNK_OVERLAP_SIZE, args.max_tokens),
+                      len(long_text)))
+
+    # Documenti reali: i PDF passano da Docling (o dalla cache dei documenti convertiti)
+    for pdf_file in args.pdf or []:
+        from doc_manager.rag_pipeline.parse_cache import cached_pdf_docs
+        docs = list(cached_pdf_docs(pdf_file, get_default_profile()))
+        cases.append((f"create_chunks[{os.path.basename(pdf_file)}]",
+                      lambda docs=docs: create_chunks(docs, max_tokens=args.max_tokens),
+                      sum(_docling_chars(doc) for doc in docs)))
+
+    for ocr_file in args.ocr_file or []:
+        with open(ocr_file, encoding='utf-8') as f:
+            ocr_text = f.read()
+        cases.append((f"create_chunks_scannedpdf[{os.path.basename(ocr_file)}]",
+                      lambda text=ocr_text: create_chunks_scannedpdf(text, "bench", max_tokens=args.max_tokens),
+                      len(ocr_text)))
+    return cases
+
+
+def compare(results, baseline_path):
+    """Stampa la variazione di tempo rispetto a un file di risultati precedente."""
+    with open(baseline_path) as f:
+        baseline = {r['case']: r for r in json.load(f)['results']}
+
+    print("\n" + "-"*60)
+    print(f"Confronto con {baseline_path}")
+    for result in results:
+        previous = baseline.get(result['case'])
+        if previous is None:
+            continue
+        change = (result['seconds'] - previous['seconds']) / previous['seconds'] * 100 if previous['seconds'] else 0
+        flag = "  <-- più lento" if change > 10 else ""
+        print(f"{result['case']:<42}{previous['seconds']*1000:>10.1f} -> {result['seconds']*1000:.1f} ms ({change:+.1f}%){flag}")
+        if previous['output']['count'] != result['output']['count']:
+            print(f"{'':<42}chunk: {previous['output']['count']} -> {result['output']['count']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Suite di benchmark del chunking")
+    parser.add_argument('--pages', type=int, nargs='+', default=[100, 500])
+    parser.add_argument('--items-per-page', type=int, default=12)
+    parser.add_argument('--paragraphs-per-page', type=int, default=10)
+    parser.add_argument('--pdf', nargs='+', help="PDF reali da includere (richiede Docling)")
+    parser.add_argument('--ocr-file', nargs='+', help="Testi OCR reali (output del server GPU) da includere")
+    parser.add_argument('--max-tokens', type=int, default=0,
+                        help="Budget in token (richiede il tokenizer del modello in cache locale); 0 = caratteri")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="File JSON dei risultati (default: results/bench_suite-<commit>.json)")
+    parser.add_argument('--compare', help="File JSON di un'esecuzione precedente da confrontare")
+    args = parser.parse_args()
+
+    commit = _git_commit()
+
+    print("\n" + "="*60)
+    print("SUITE DI BENCHMARK DEL CHUNKING")
+    print("="*60)
+    print(f"Commit {commit}, Python {platform.python_version()}, budget "
+          f"{f'{args.max_tokens} token' if args.max_tokens else f'{MAX_TEXT_CHUNK_SIZE} caratteri'}\n")
+
+    results = [run_case(name, fn, chars_in, args.repeat) for name, fn, chars_in in build_cases(args)]
+
+    output = args.output or os.path.join('results', f"bench_suite-{commit}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({
+            'commit': commit,
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'parameters': vars(args),
+            'results': results,
+        }, f, indent=2)
+    print(f"\nRisultati salvati in {output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
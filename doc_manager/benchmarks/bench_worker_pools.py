@@ -0,0 +1,186 @@
+"""
+Memoria e throughput del worker RAG con il pool prefork, con e senza il
+preload dei modelli nel processo principale (preload_worker_models).
+
+Per ogni numero di figli e per ogni modalità viene avviato un processo
+"principale" nuovo che, come il worker Celery, fa il fork dei figli:
+  - preload:   il principale carica i modelli (preload_models) prima del fork,
+               i figli li condividono copy-on-write;
+  - per-child: ogni figlio carica i propri modelli al primo documento.
+I figli si dividono i PDF campione (conversione Docling + embedding del
+testo) e, a lavoro finito, misurano la propria memoria tutti nello stesso
+momento: RSS, USS (memoria solo del processo) e PSS (memoria condivisa
+ripartita tra i processi). La somma dei PSS è la memoria reale del worker.
+
+Uso:
+    python doc_manager/benchmarks/bench_worker_pools.py campioni/
+    python doc_manager/benchmarks/bench_worker_pools.py campioni/ --workers 1 2 4 --output results/worker_pools.json
+"""
+import sys
+import os
+import argparse
+import glob
+import json
+import multiprocessing
+import time
+
+from fixtures import setup_django
+
+MODES = ['preload', 'per-child']
+
+
+def _memory_mb():
+    """RSS, USS e PSS (dove disponibile) del processo corrente in MB."""
+    import psutil
+    info = psutil.Process().memory_full_info()
+    to_mb = lambda value: round(value / (1024 * 1024), 1)
+    return {
+        'rss_mb': to_mb(info.rss),
+        'uss_mb': to_mb(info.uss),
+        'pss_mb': to_mb(getattr(info, 'pss', info.uss)),
+    }
+
+
+def _process_document(pdf_file):
+    """Il lavoro di index_document_rag che usa i modelli: conversione ed embedding."""
+    from doc_manager.rag_pipeline.processing import convert_pdf_to_doc, get_pdf_page_count
+    from doc_manager.rag_pipeline.embedding import embed_texts
+
+    doc = convert_pdf_to_doc(pdf_file)
+    paragraphs = [p for p in doc.export_to_markdown().split('\n\n') if p.strip()]
+    if paragraphs:
+        embed_texts(paragraphs)
+    return get_pdf_page_count(pdf_file)
+
+
+def _child(index, pdf_files, started, barrier, result_queue):
+    """Processo figlio del pool: elabora i suoi PDF, poi misura la memoria insieme agli altri."""
+    first_result = None
+    pages = 0
+    for pdf_file in pdf_files:
+        pages += _process_document(pdf_file)
+        if first_result is None:
+            first_result = time.perf_counter() - started
+    finished = time.perf_counter() - started
+
+    # Tutti i processi ancora vivi, così il PSS ripartisce la memoria condivisa tra tutti
+    barrier.wait()
+    result_queue.put({
+        'child': index,
+        'documents': len(pdf_files),
+        'pages': pages,
+        'first_result_seconds': round(first_result or 0.0, 3),
+        'finished_seconds': round(finished, 3),
+        **_memory_mb(),
+    })
+    barrier.wait()
+
+
+def _run_master(mode, workers, pdf_files, output_queue):
+    """Eseguita nel processo principale: preload opzionale e fork dei figli."""
+    setup_django()
+    from doc_manager.tasks import preload_models
+
+    load_times = {}
+    start = time.perf_counter()
+    if mode == 'preload':
+        load_times = preload_models()
+    preload_seconds = time.perf_counter() - start
+    master_before_fork = _memory_mb()
+
+    ctx = multiprocessing.get_context('fork')
+    barrier = ctx.Barrier(workers + 1)
+    result_queue = ctx.Queue()
+    started = time.perf_counter()
+    children = [
+        ctx.Process(target=_child, args=(index, pdf_files[index::workers], started, barrier, result_queue))
+        for index in range(workers)
+    ]
+    for child in children:
+        child.start()
+
+    barrier.wait()
+    master = _memory_mb()
+    barrier.wait()
+    results = sorted((result_queue.get() for _ in children), key=lambda r: r['child'])
+    for child in children:
+        child.join()
+
+    wall = max(r['finished_seconds'] for r in results)
+    pages = sum(r['pages'] for r in results)
+    output_queue.put({
+        'mode': mode,
+        'workers': workers,
+        'preload_seconds': round(preload_seconds, 3),
+        'load_times': load_times,
+        'master_before_fork': master_before_fork,
+        'master': master,
+        'children': results,
+        'total_pss_mb': round(master['pss_mb'] + sum(r['pss_mb'] for r in results), 1),
+        'total_rss_mb': round(master['rss_mb'] + sum(r['rss_mb'] for r in results), 1),
+        'first_result_seconds': min(r['first_result_seconds'] for r in results),
+        'wall_seconds': round(wall, 3),
+        'pages_per_second': round(pages / wall, 3) if wall else None,
+    })
+
+
+def run_mode(mode, workers, pdf_files):
+    # Processo principale nuovo per ogni misura: nessun modello già in memoria
+    ctx = multiprocessing.get_context('spawn')
+    output_queue = ctx.Queue()
+    process = ctx.Process(target=_run_master, args=(mode, workers, pdf_files, output_queue))
+    process.start()
+    result = output_queue.get()
+    process.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del pool prefork del worker RAG")
+    parser.add_argument('samples', help="Cartella con i PDF campione")
+    parser.add_argument('--workers', nargs='+', type=int, default=[1, 2, 4], help="Numero di processi figli")
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=MODES)
+    parser.add_argument('--output', default='results/bench_worker_pools.json')
+    args = parser.parse_args()
+
+    if sys.platform == 'win32':
+        parser.error("Il pool prefork richiede fork(): benchmark non disponibile su Windows")
+
+    pdf_files = sorted(glob.glob(os.path.join(args.samples, '*.pdf')))
+    if not pdf_files:
+        parser.error(f"Nessun PDF in {args.samples}")
+
+    print("\n" + "="*60)
+    print("BENCHMARK POOL PREFORK DEL WORKER RAG")
+    print("="*60)
+    print(f"Campioni: {len(pdf_files)} PDF in {args.samples}")
+
+    results = []
+    for workers in args.workers:
+        for mode in args.modes:
+            print(f"\n[{mode}, {workers} figli] elaborazione in corso...")
+            result = run_mode(mode, workers, pdf_files)
+            results.append(result)
+            print(f"  Primo documento:  {result['first_result_seconds']:.2f}s")
+            print(f"  Throughput:       {result['pages_per_second']} pagine/s")
+            print(f"  Principale:       {result['master']['rss_mb']} MB RSS")
+            for child in result['children']:
+                print(f"  Figlio {child['child']}:         {child['rss_mb']} MB RSS, "
+                      f"{child['uss_mb']} MB USS, {child['pss_mb']} MB PSS")
+            print(f"  Totale:           {result['total_pss_mb']} MB PSS ({result['total_rss_mb']} MB sommando gli RSS)")
+
+    print("\n" + "-"*60)
+    print(f"{'Modalità':<12}{'Figli':>6}{'PSS tot (MB)':>14}{'USS/figlio':>12}{'pagine/s':>10}{'1° doc (s)':>12}")
+    for result in results:
+        uss = round(sum(c['uss_mb'] for c in result['children']) / len(result['children']), 1)
+        print(f"{result['mode']:<12}{result['workers']:>6}{result['total_pss_mb']:>14}{uss:>12}"
+              f"{str(result['pages_per_second']):>10}{result['first_result_seconds']:>12}")
+
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump({'samples': [os.path.basename(p) for p in pdf_files], 'results': results}, f, indent=2)
+    print(f"\nRisultati salvati in {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+Generatori di documenti sintetici per i benchmark della pipeline RAG e
+utilità comuni agli script (setup di Django, misura dei tempi).
+I documenti riproducono la struttura minima di un DoclingDocument letta dai chunker
+(texts/tables/pictures, body.children, prov, label) senza richiedere
+modelli, GPU o rete.
+"""
+import os
+import random
+import sys
+import time
+from types import SimpleNamespace
+
+# Radice del progetto (la cartella di manage.py)
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '../..'))
+
+WORDS = (
+    "documento analisi sistema processo dati rete modello risultato valore "
+    "controllo gestione servizio sezione tabella pagina contratto cliente "
+    "fornitore norma requisito verifica sicurezza qualità manutenzione"
+).split()
+
+
+def _sentence(rng, min_words=8, max_words=30):
+    words = [rng.choice(WORDS) for _ in range(rng.randint(min_words, max_words))]
+    return " ".join(words).capitalize() + "."
+
+
+def _paragraph(rng, sentences=(1, 6)):
+    return " ".join(_sentence(rng) for _ in range(rng.randint(*sentences)))
+
+
+def _item(self_ref, label, page_no, **extra):
+    return SimpleNamespace(
+        self_ref=self_ref,
+        label=SimpleNamespace(name=label),
+        prov=[SimpleNamespace(page_no=page_no)],
+        **extra
+    )
+
+
+def make_docling_document(pages=100, items_per_page=12, table_every=4, picture_every=6, seed=0):
+    """
+    Crea un documento in stile Docling con `pages` pagine.
+    Ogni `table_every` pagine viene inserita una tabella e ogni
+    `picture_every` pagine un'immagine con didascalia.
+    """
+    rng = random.Random(seed)
+    texts, tables, pictures, children = [], [], [], []
+
+    def add_text(label, text, page_no):
+        ref = f"#/texts/{len(texts)}"
+        texts.append(_item(ref, label, page_no, text=text))
+        return ref
+
+    for page_no in range(1, pages + 1):
+        children.append(SimpleNamespace(cref=add_text('SECTION_HEADER', f"Sezione {page_no}", page_no)))
+
+        for _ in range(items_per_page):
+            label = 'LIST' if rng.random() < 0.15 else 'TEXT'
+            children.append(SimpleNamespace(cref=add_text(label, _paragraph(rng), page_no)))
+
+        if table_every and page_no % table_every == 0:
+            rows = rng.randint(3, 15)
+            cols = rng.randint(2, 6)
+            grid = [
+                [SimpleNamespace(text=rng.choice(WORDS) if r else f"Colonna {c}") for c in range(cols)]
+                for r in range(rows)
+            ]
+            ref = f"#/tables/{len(tables)}"
+            tables.append(_item(ref, 'TABLE', page_no, data=SimpleNamespace(grid=grid)))
+            children.append(SimpleNamespace(cref=ref))
+
+        if picture_every and page_no % picture_every == 0:
+            caption_ref = add_text('CAPTION', f"Figura {page_no}: {_sentence(rng, 4, 10)}", page_no)
+            ref = f"#/pictures/{len(pictures)}"
+            pictures.append(_item(ref, 'PICTURE', page_no, captions=[SimpleNamespace(cref=caption_ref)]))
+            children.append(SimpleNamespace(cref=ref))
+
+    return SimpleNamespace(
+        texts=texts,
+        tables=tables,
+        pictures=pictures,
+        body=SimpleNamespace(children=children)
+    )
+
+
+def _markdown_paragraph(rng):
+    """Paragrafo con la formattazione tipica dell'output OCR (grassetto, corsivo, liste, link)."""
+    sentences = []
+    for _ in range(rng.randint(1, 6)):
+        sentence = _sentence(rng)
+        roll = rng.random()
+        if roll < 0.15:
+            sentence = f"**{sentence}**"
+        elif roll < 0.25:
+            sentence = f"*{sentence}*"
+        elif roll < 0.3:
+            sentence = f"[{sentence}](https://example.com/{rng.randint(1, 999)})"
+        sentences.append(sentence)
+    paragraph = " ".join(sentences)
+    if rng.random() < 0.15:
+        paragraph = "- " + paragraph
+    return paragraph
+
+
+def make_ocr_text(pages=300, paragraphs_per_page=10, table_every=2, tables_per_page=1, seed=0):
+    """
+    Crea un testo OCR in markdown nel formato restituito dal server GPU,
+    con le pagine delimitate dai separatori "PAGINA n". Ogni `table_every`
+    pagine vengono inserite `tables_per_page` tabelle distribuite nel testo.
+    """
+    rng = random.Random(seed)
+    parts = []
+
+    for page_no in range(1, pages + 1):
+        lines = [f"# Capitolo {page_no}", ""]
+        for index in range(paragraphs_per_page):
+            if index and rng.random() < 0.2:
+                lines += [f"## Paragrafo {page_no}.{index}", ""]
+            lines += [_markdown_paragraph(rng), ""]
+
+            if table_every and page_no % table_every == 0 and index % max(1, paragraphs_per_page // tables_per_page) == 0:
+                cols = rng.randint(2, 6)
+                lines.append("| " + " | ".join(f"Colonna {c}" for c in range(cols)) + " |")
+                lines.append("|" + "---|" * cols)
+                for _ in range(rng.randint(3, 20)):
+                    lines.append("| " + " | ".join(rng.choice(WORDS) for _ in range(cols)) + " |")
+                lines.append("")
+
+        parts.append(f"{'=' * 60}\nPAGINA {page_no}\n{'=' * 60}\n" + "\n".join(lines))
+
+    return "\n\n".join(parts)
+
+
+def setup_django():
+    """
+    Prepara un benchmark eseguito come script: radice del progetto nel
+    sys.path e Django inizializzato. Va chiamata prima di importare doc_manager.
+    """
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+    import django
+    django.setup()
+
+
+def best_time(fn, repeat):
+    """Tempo migliore su `repeat` esecuzioni di fn() e risultato dell'ultima esecuzione."""
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
@@ -0,0 +1,187 @@
+import os
+import shutil
+import zipfile
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db.models import Count
+from django.db.models.functions import Lower
+from django.utils import timezone
+from .models import Document
+from .rag_pipeline.preflight import inspect_pdf, classify_text_layer
+
+BULK_CREATE_BATCH_SIZE = getattr(settings, 'BULK_CREATE_BATCH_SIZE', 500)
+BULK_MAX_FILE_BYTES = getattr(settings, 'BULK_MAX_FILE_BYTES', 200 * 1024 * 1024)
+
+# Stati finali di un documento, ai fini dell'avanzamento del job
+COMPLETED_STATES = ['completed']
+FAILED_STATES = ['failed', 'ocr_failed']
+
+
+def staging_dir(job_pk) -> str:
+    """Cartella in cui vengono parcheggiati i file caricati dal browser prima della creazione dei documenti."""
+    return os.path.join(settings.MEDIA_ROOT, 'bulk_staging', str(job_pk))
+
+
+def _is_pdf(name: str) -> bool:
+    basename = os.path.basename(name)
+    return basename.lower().endswith('.pdf') and not basename.startswith('.')
+
+
+def iter_source_files(job):
+    """
+    PDF della sorgente del job, come (nome, dimensione, funzione che apre il
+    file in binario). Le cartelle vengono visitate ricorsivamente in ordine
+    alfabetico; negli archivi ZIP vengono ignorati i metadati di macOS.
+    """
+    if job.source == 'zip':
+        with zipfile.ZipFile(job.source_path) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or info.filename.startswith('__MACOSX/') or not _is_pdf(info.filename):
+                    continue
+                yield info.filename, info.file_size, lambda info=info: archive.open(info)
+        return
+
+    for root, dirs, files in os.walk(job.source_path):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+        for filename in sorted(files):
+            if _is_pdf(filename):
+                path = os.path.join(root, filename)
+                yield os.path.relpath(path, job.source_path), os.path.getsize(path), lambda path=path: open(path, 'rb')
+
+
+def _title_from_name(name: str) -> str:
+    title = os.path.splitext(os.path.basename(name))[0].replace('_', ' ').strip()
+    return (title or 'Document')[:100]
+
+
+def _assign_titles(documents, taken):
+    """
+    Rende univoci i titoli (senza distinzione di maiuscole, come in
+    DocumentUploadForm) aggiungendo " (2)", " (3)", ... sia rispetto ai
+    documenti esistenti sia tra quelli del job.
+    """
+    def existing_titles(titles):
+        return set(
+            Document.objects.annotate(lower_title=Lower('title'))
+            .filter(lower_title__in=[title.lower() for title in titles])
+            .values_list('lower_title', flat=True)
+        )
+
+    pending = [(doc_instance, doc_instance.title) for doc_instance in documents]
+    taken |= existing_titles(base for _, base in pending)
+    while pending:
+        for doc_instance, base in pending:
+            title, n = base, 2
+            while title.lower() in taken:
+                suffix = f" ({n})"
+                title = base[:100 - len(suffix)] + suffix
+                n += 1
+            doc_instance.title = title
+            taken.add(title.lower())
+
+        # I titoli con suffisso potrebbero a loro volta esistere già
+        existing = existing_titles(doc_instance.title for doc_instance, _ in pending)
+        taken |= existing
+        pending = [(doc_instance, base) for doc_instance, base in pending if doc_instance.title.lower() in existing]
+
+
+def _detect(path, document_type):
+    """
+    Tipo del documento, pagine da sottoporre a OCR e numero di pagine. Il
+    preflight viene eseguito anche con un tipo forzato, per scartare i file
+    che non sono PDF validi.
+    """
+    report = inspect_pdf(path)
+    detected_type, ocr_pages = classify_text_layer(report)
+    if document_type in ['native', 'scanned']:
+        return document_type, [], report['page_count']
+    return detected_type, ocr_pages, report['page_count']
+
+
+def create_documents(job):
+    """
+    Crea i Document del job dai PDF della sorgente: ogni file viene copiato
+    nello storage dei media e analizzato con il preflight, poi i documenti
+    vengono inseriti con bulk_create a blocchi di BULK_CREATE_BATCH_SIZE.
+    I file scartati vengono registrati in job.errors.
+    Ritorna il numero di documenti creati.
+    """
+    file_field = Document._meta.get_field('file')
+    taken = set()
+    batch, created = [], 0
+
+    def insert():
+        nonlocal batch, created
+        _assign_titles(batch, taken)
+        Document.objects.bulk_create(batch)
+        created += len(batch)
+        batch = []
+        job.total_count = created
+        job.save(update_fields=['total_count', 'errors', 'updated_at'])
+
+    for name, size, open_file in iter_source_files(job):
+        if size > BULK_MAX_FILE_BYTES:
+            job.errors.append({'file': name, 'error': f"File too large ({size // (1024 * 1024)} MB)"})
+            continue
+
+        stored = None
+        try:
+            with open_file() as f:
+                stored = default_storage.save(file_field.generate_filename(None, os.path.basename(name)), File(f))
+            document_type, ocr_pages, page_count = _detect(default_storage.path(stored), job.document_type)
+        except Exception as e:
+            job.errors.append({'file': name, 'error': f"Not a readable PDF: {e}"})
+            if stored:
+                default_storage.delete(stored)
+            continue
+
+        batch.append(Document(
+            uploader=job.uploader,
+            bulk_job=job,
+            file=stored,
+            title=_title_from_name(name),
+            document_type=document_type,
+            ocr_pages=ocr_pages,
+            page_count=page_count,
+            file_size=size,
+            processing_profile=job.processing_profile,
+            processing_state='pending',
+        ))
+        if len(batch) >= BULK_CREATE_BATCH_SIZE:
+            insert()
+
+    if batch:
+        insert()
+    job.total_count = created
+    job.save(update_fields=['total_count', 'errors', 'updated_at'])
+    return created
+
+
+def cleanup_staging(job):
+    """Rimuove i file parcheggiati dal browser; le cartelle sul server non vengono toccate."""
+    if job.source != 'directory':
+        shutil.rmtree(staging_dir(job.pk), ignore_errors=True)
+
+
+def refresh_job_progress(job):
+    """
+    Ricalcola l'avanzamento aggregato del job dagli stati dei suoi documenti.
+    Un job in elaborazione senza documenti in attesa o in corso è completato.
+    """
+    counts = dict(job.documents.values_list('processing_state').annotate(n=Count('pk')))
+    total = sum(counts.values())
+    completed = sum(counts.get(state, 0) for state in COMPLETED_STATES)
+    failed = sum(counts.get(state, 0) for state in FAILED_STATES)
+    pending = counts.get('pending', 0)
+
+    job.total_count = total
+    job.completed_count = completed
+    job.failed_count = failed
+    job.in_progress_count = total - completed - failed - pending
+    if job.state == 'processing' and not pending and not job.in_progress_count:
+        job.state = 'completed'
+        job.finished_at = timezone.now()
+    job.save(update_fields=['total_count', 'completed_count', 'failed_count', 'in_progress_count',
+                            'state', 'finished_at', 'updated_at'])
+    return job
@@ -1,15 +1,31 @@
+import zipfile
 from django import forms
 from .models import Document
 from django.core.exceptions import ValidationError
+from .rag_pipeline.preflight import detect_document_type
+from .rag_pipeline.config import get_processing_profiles
 
 # Form per l'upload del documento con selezione del tipo
 class DocumentUploadForm(forms.ModelForm):
+    # 'auto' non è un tipo del modello: viene risolto in clean() analizzando il text layer
+    document_type = forms.ChoiceField(
+        choices=[('auto', 'Automatic detection')] + [t for t in Document.DOCUMENT_TYPES if t[0] != 'mixed'],
+        initial='auto',
+        widget=forms.RadioSelect(attrs={'class': 'form-check-input'}),
+    )
+
     class Meta:
         model = Document
-        fields = ['title', 'file', 'document_type']
-        widgets = {
-            'document_type': forms.RadioSelect(attrs={'class': 'form-check-input'}),
-        }
+        fields = ['title', 'file', 'document_type', 'processing_profile']
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Vuoto = profilo scelto automaticamente in base al numero di pagine
+        self.fields['processing_profile'] = forms.ChoiceField(
+            choices=[('', 'Automatic (by document size)')] + [(name, name.capitalize()) for name in get_processing_profiles()],
+            required=False,
+            widget=forms.Select(attrs={'class': 'form-select'}),
+        )
 
     # Controllo di validità del titolo
     def clean_title(self):
@@ -21,6 +37,35 @@ class DocumentUploadForm(forms.ModelForm):
             )
         
         return title
+
+    def clean(self):
+        """
+        Con il rilevamento automatico il tipo viene deciso pagina per pagina:
+        le sole pagine senza text layer verranno inviate all'OCR.
+        Numero di pagine e dimensione del file vengono sempre registrati, perché
+        decidono la coda di indicizzazione del documento.
+        """
+        cleaned_data = super().clean()
+        uploaded_file = cleaned_data.get('file')
+        if not uploaded_file:
+            return cleaned_data
+
+        auto = cleaned_data.get('document_type') == 'auto'
+        try:
+            document_type, ocr_pages, report = detect_document_type(uploaded_file)
+        except Exception:
+            if auto:
+                raise forms.ValidationError("Impossibile leggere il PDF caricato. Verifica che il file sia un PDF valido.")
+            # Con un tipo scelto dall'utente il file viene accettato come prima
+            report = None
+
+        if auto:
+            cleaned_data['document_type'] = document_type
+            self.instance.ocr_pages = ocr_pages
+        self.instance.page_count = report['page_count'] if report else 0
+        self.instance.file_size = uploaded_file.size
+
+        return cleaned_data
     
     
 # Form per rinominare un documento esistente
@@ -59,4 +104,73 @@ class DocumentRenameForm(forms.ModelForm):
                 f"Another document already has the title: '{title}'. Please choose a different name."
             )
         
-        return title
\ No newline at end of file
+        return title
+
+
+# Input che accetta più file nello stesso campo
+class MultipleFileInput(forms.ClearableFileInput):
+    allow_multiple_selected = True
+
+
+class MultipleFileField(forms.FileField):
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('widget', MultipleFileInput(attrs={'accept': '.pdf', 'class': 'form-control'}))
+        super().__init__(*args, **kwargs)
+
+    def clean(self, data, initial=None):
+        single_file_clean = super().clean
+        if isinstance(data, (list, tuple)):
+            return [single_file_clean(d, initial) for d in data]
+        return [single_file_clean(data, initial)] if data else []
+
+
+# Form per il caricamento in blocco: più PDF oppure un archivio ZIP
+class BulkUploadForm(forms.Form):
+    files = MultipleFileField(required=False, label='PDF files')
+    archive = forms.FileField(
+        required=False,
+        label='ZIP archive',
+        widget=forms.ClearableFileInput(attrs={'accept': '.zip', 'class': 'form-control'}),
+    )
+    document_type = forms.ChoiceField(
+        choices=[('auto', 'Automatic detection')] + [t for t in Document.DOCUMENT_TYPES if t[0] != 'mixed'],
+        initial='auto',
+        widget=forms.RadioSelect(attrs={'class': 'form-check-input'}),
+    )
+    process_now = forms.BooleanField(
+        required=False,
+        initial=True,
+        label='Start processing as soon as the documents are created',
+    )
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['processing_profile'] = forms.ChoiceField(
+            choices=[('', 'Automatic (by document size)')] + [(name, name.capitalize()) for name in get_processing_profiles()],
+            required=False,
+            widget=forms.Select(attrs={'class': 'form-select'}),
+        )
+
+    def clean_files(self):
+        files = self.cleaned_data.get('files') or []
+        for uploaded_file in files:
+            if not uploaded_file.name.lower().endswith('.pdf'):
+                raise forms.ValidationError(f"'{uploaded_file.name}' non è un PDF.")
+        return files
+
+    def clean_archive(self):
+        archive = self.cleaned_data.get('archive')
+        if archive and not zipfile.is_zipfile(archive):
+            raise forms.ValidationError("Il file caricato non è un archivio ZIP valido.")
+        if archive:
+            archive.seek(0)
+        return archive
+
+    def clean(self):
+        """Va scelta una sola sorgente: i file PDF oppure l'archivio ZIP."""
+        cleaned_data = super().clean()
+        has_files = bool(cleaned_data.get('files'))
+        has_archive = bool(cleaned_data.get('archive'))
+        if has_files == has_archive and not self.errors:
+            raise forms.ValidationError("Seleziona dei file PDF oppure un archivio ZIP (non entrambi).")
+        return cleaned_data
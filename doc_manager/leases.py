@@ -0,0 +1,94 @@
+import uuid
+import redis
+from celery import current_app
+from django.conf import settings
+
+# Oltre il time limit dei task il lease non protegge più nulla: scade da solo
+TASK_LEASE_TTL = getattr(settings, 'TASK_LEASE_TTL', getattr(settings, 'CELERY_TASK_TIME_LIMIT', 3600) + 60)
+KEY_PREFIX = 'docseek:lease'
+
+# Il lease viene cancellato solo da chi lo possiede (il valore contiene un token casuale)
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+_client = None
+
+
+def redis_url():
+    """URL Redis di lease e notifiche: TASK_LEASE_REDIS_URL o, se vuoto, il broker di Celery."""
+    return getattr(settings, 'TASK_LEASE_REDIS_URL', '') or current_app.conf.broker_url
+
+
+def get_redis():
+    """Client Redis condiviso dei lease."""
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(redis_url(), socket_timeout=5, socket_connect_timeout=5)
+    return _client
+
+
+class DocumentLease:
+    """
+    Lease Redis su (tipo di task, documento): impedisce che due copie dello
+    stesso task lavorino contemporaneamente sullo stesso documento.
+    Il lease è associato all'impronta del contenuto (`fingerprint`): un
+    duplicato con la stessa impronta viene scartato; con `coalesce` un
+    duplicato con contenuto diverso viene fuso in un'unica nuova esecuzione,
+    segnalata da release() a chi possiede il lease.
+    Se Redis non è raggiungibile il task viene eseguito comunque.
+    """
+
+    def __init__(self, kind, document_pk, fingerprint, coalesce=False, ttl=None):
+        self.key = f"{KEY_PREFIX}:{kind}:{document_pk}"
+        self.rerun_key = f"{self.key}:rerun"
+        self.fingerprint = fingerprint
+        self.coalesce = coalesce
+        self.ttl = ttl or TASK_LEASE_TTL
+        self.token = f"{fingerprint}:{uuid.uuid4().hex}"
+        self.acquired = False
+        # Impronta del lease esistente quando acquire() fallisce
+        self.holder = None
+
+    def acquire(self):
+        """True se il task può procedere (lease ottenuto o Redis non disponibile)."""
+        try:
+            client = get_redis()
+            for _ in range(3):
+                if client.set(self.key, self.token, nx=True, ex=self.ttl):
+                    self.acquired = True
+                    return True
+                current = client.get(self.key)
+                if current is not None:
+                    break
+                # Il lease è scaduto tra SET e GET: si riprova
+            else:
+                return False
+
+            self.holder = current.decode().rsplit(':', 1)[0]
+            if self.coalesce and self.holder != self.fingerprint:
+                client.set(self.rerun_key, self.fingerprint, ex=self.ttl)
+            return False
+        except redis.RedisError as e:
+            print(f"[RAG] Redis non disponibile per il lease {self.key}, esecuzione senza lease: {e}")
+            return True
+
+    def release(self):
+        """
+        Rilascia il lease. Ritorna True se nel frattempo un duplicato con
+        contenuto diverso ha chiesto una nuova esecuzione.
+        """
+        if not self.acquired:
+            return False
+        self.acquired = False
+        try:
+            client = get_redis()
+            client.eval(_RELEASE_SCRIPT, 1, self.key, self.token)
+            return self.coalesce and client.getdel(self.rerun_key) is not None
+        except redis.RedisError as e:
+            # Il lease scadrà da solo dopo TASK_LEASE_TTL secondi
+            print(f"[RAG] Impossibile rilasciare il lease {self.key}: {e}")
+            return False
@@ -0,0 +1,58 @@
+import os
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from doc_manager.models import BulkIngestJob
+from doc_manager.tasks import ingest_bulk_job
+from doc_manager.rag_pipeline.config import get_processing_profiles
+
+
+class Command(BaseCommand):
+    help = (
+        "Carica in blocco tutti i PDF di una cartella del server (sottocartelle "
+        "comprese) come documenti dell'utente indicato, e ne avvia l'elaborazione "
+        "sui worker Celery con i limiti di concorrenza dei caricamenti in blocco."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help="Cartella da cui leggere i PDF")
+        parser.add_argument('--uploader', required=True, help="Username del proprietario dei documenti")
+        parser.add_argument('--type', dest='document_type', default='auto', choices=['auto', 'native', 'scanned'],
+                            help="Tipo dei documenti (default: rilevamento automatico pagina per pagina)")
+        parser.add_argument('--profile', default='', choices=[''] + list(get_processing_profiles()),
+                            help="Profilo di elaborazione (default: scelto in base al numero di pagine)")
+        parser.add_argument('--no-process', action='store_true',
+                            help="Crea solo i documenti, senza avviare OCR e indicizzazione")
+        parser.add_argument('--async', action='store_true', dest='use_celery',
+                            help="Crea i documenti su un worker Celery invece che qui")
+
+    def handle(self, *args, **options):
+        directory = os.path.abspath(options['directory'])
+        if not os.path.isdir(directory):
+            raise CommandError(f"Cartella non trovata: {directory}")
+        try:
+            uploader = User.objects.get(username=options['uploader'])
+        except User.DoesNotExist:
+            raise CommandError(f"Utente non trovato: {options['uploader']}")
+
+        job = BulkIngestJob.objects.create(
+            uploader=uploader,
+            name=os.path.basename(directory) or directory,
+            source='directory',
+            source_path=directory,
+            document_type=options['document_type'],
+            processing_profile=options['profile'],
+            auto_process=not options['no_process'],
+        )
+
+        if options['use_celery']:
+            ingest_bulk_job.delay(job.pk)
+            self.stdout.write(self.style.SUCCESS(f"Job {job.pk} accodato"))
+            return
+
+        ingest_bulk_job(job.pk)
+        job.refresh_from_db()
+        for error in job.errors:
+            self.stdout.write(self.style.WARNING(f"{error['file']}: {error['error']}"))
+        self.stdout.write(self.style.SUCCESS(
+            f"Job {job.pk}: {job.total_count} documenti creati, {len(job.errors)} file scartati ({job.get_state_display()})"
+        ))
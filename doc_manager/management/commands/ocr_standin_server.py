@@ -0,0 +1,324 @@
+import hashlib
+import hmac
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import uuid
+from collections import deque
+from email import policy
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pypdfium2 as pdfium
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+def _page_texts(pdf_bytes):
+    """Text layer di ogni pagina; le pagine senza testo ricevono un testo segnaposto."""
+    pdf = pdfium.PdfDocument(pdf_bytes)
+    try:
+        texts = []
+        for index in range(len(pdf)):
+            page = pdf[index]
+            try:
+                textpage = page.get_textpage()
+                try:
+                    text = textpage.get_text_bounded().strip()
+                finally:
+                    textpage.close()
+            finally:
+                page.close()
+            texts.append(text or f"Testo OCR simulato della pagina {index + 1}.")
+        return texts
+    finally:
+        pdf.close()
+
+
+class StandinOcr:
+    """
+    Simula il server GPU: i task vengono elaborati da un thread in batch di
+    `gpu_batch` documenti, una pagina ogni `seconds_per_page` secondi per
+    tutti i documenti del batch, con progressi e risultato notificati al
+    callback_url se presente.
+    """
+
+    def __init__(self, seconds_per_page, gpu_batch, callback_secret):
+        self.seconds_per_page = seconds_per_page
+        self.gpu_batch = gpu_batch
+        self.callback_secret = callback_secret
+        self.tasks = {}
+        self.uploads = {}
+        self.queue = deque()
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+
+    def submit(self, document_id, title, pdf_bytes, callback_url=None):
+        task_id = uuid.uuid4().hex
+        task = {'task_id': task_id, 'document_id': document_id, 'title': title,
+                'status': 'queued', 'progress': 0, 'callback_url': callback_url}
+        try:
+            task['pages'] = _page_texts(pdf_bytes)
+        except Exception as e:
+            task.update(status='failed', error=f"Invalid PDF: {e}")
+        with self.lock:
+            self.tasks[task_id] = task
+            if task['status'] == 'queued':
+                self.queue.append(task)
+        self.wakeup.set()
+        return task_id
+
+    # ---- caricamento a blocchi ----
+
+    def create_upload(self, metadata):
+        fd, path = tempfile.mkstemp(prefix='ocr-upload-', suffix='.pdf')
+        os.close(fd)
+        upload_id = uuid.uuid4().hex
+        with self.lock:
+            self.uploads[upload_id] = {'upload_id': upload_id, 'offset': 0, 'path': path, 'task_id': None,
+                                       'size': int(metadata['size']), 'sha256': metadata['sha256'], 'metadata': metadata}
+        return self.upload_status(upload_id)
+
+    def upload_status(self, upload_id):
+        upload = self.uploads.get(upload_id)
+        if upload is None:
+            return None
+        return {key: upload[key] for key in ['upload_id', 'offset', 'size', 'sha256', 'task_id']}
+
+    def write_chunk(self, upload_id, offset, data, checksum):
+        """Aggiunge un blocco; ritorna (status HTTP, payload)."""
+        with self.lock:
+            upload = self.uploads.get(upload_id)
+            if upload is None:
+                return 404, {'error': 'unknown upload'}
+            if offset != upload['offset']:
+                return 409, {'error': 'offset mismatch', 'offset': upload['offset']}
+            if hashlib.sha256(data).hexdigest() != checksum:
+                return 422, {'error': 'checksum mismatch', 'offset': upload['offset']}
+            if upload['offset'] + len(data) > upload['size']:
+                return 400, {'error': 'chunk exceeds declared size'}
+            with open(upload['path'], 'ab') as f:
+                f.write(data)
+            upload['offset'] += len(data)
+            return 200, {'offset': upload['offset']}
+
+    def complete_upload(self, upload_id):
+        """Avvia l'OCR del file caricato; ripetere la chiamata restituisce lo stesso task."""
+        upload = self.uploads.get(upload_id)
+        if upload is None:
+            return 404, {'error': 'unknown upload'}
+        if upload['task_id']:
+            return 200, {'task_id': upload['task_id']}
+        if upload['offset'] != upload['size']:
+            return 409, {'error': 'upload incomplete', 'offset': upload['offset']}
+        with open(upload['path'], 'rb') as f:
+            pdf_bytes = f.read()
+        if hashlib.sha256(pdf_bytes).hexdigest() != upload['sha256']:
+            return 422, {'error': 'file checksum mismatch'}
+        os.remove(upload['path'])
+        metadata = upload['metadata']
+        upload['task_id'] = self.submit(metadata.get('document_id'), metadata.get('title', ''), pdf_bytes, metadata.get('callback_url'))
+        return 200, {'task_id': upload['task_id']}
+
+    def status(self, task_id):
+        with self.lock:
+            task = self.tasks.get(task_id)
+            return self._payload(task) if task else None
+
+    def _payload(self, task):
+        payload = {'task_id': task['task_id'], 'status': task['status'], 'progress': task['progress']}
+        if task['status'] == 'completed':
+            payload.update(text=task['text'], char_count=len(task['text']), page_count=len(task['pages']))
+        elif task['status'] == 'failed':
+            payload['error'] = task['error']
+        return payload
+
+    def _notify(self, task, pages=None):
+        if not task['callback_url']:
+            return
+        payload = self._payload(task)
+        payload['document_id'] = task['document_id']
+        if pages:
+            # Pagine appena riconosciute, per l'indicizzazione incrementale
+            payload['pages'] = pages
+        body = json.dumps(payload).encode('utf-8')
+        timestamp = str(int(time.time()))
+        headers = {'Content-Type': 'application/json', 'X-OCR-Timestamp': timestamp}
+        if self.callback_secret:
+            signature = hmac.new(self.callback_secret.encode('utf-8'), f"{timestamp}.".encode('utf-8') + body, hashlib.sha256)
+            headers['X-OCR-Signature'] = f"sha256={signature.hexdigest()}"
+        try:
+            requests.post(task['callback_url'], data=body, headers=headers, timeout=10)
+        except requests.RequestException as e:
+            print(f"[OCR] Callback fallito per task {task['task_id']}: {e}")
+
+    def run(self):
+        while True:
+            self.wakeup.wait()
+            with self.lock:
+                batch = [self.queue.popleft() for _ in range(min(self.gpu_batch, len(self.queue)))]
+                if not self.queue:
+                    self.wakeup.clear()
+            if not batch:
+                continue
+
+            print(f"[OCR] Batch GPU simulato di {len(batch)} documenti")
+            for task in batch:
+                task['status'] = 'processing'
+            for page_no in range(1, max(len(task['pages']) for task in batch) + 1):
+                time.sleep(self.seconds_per_page)
+                for task in batch:
+                    if page_no <= len(task['pages']):
+                        task['progress'] = round(100 * page_no / len(task['pages']), 1)
+                        self._notify(task, pages=[{'page': page_no, 'text': task['pages'][page_no - 1]}])
+            for task in batch:
+                task['text'] = "\n\n".join(
+                    f"{'=' * 60}\nPAGINA {page_no}\n{'=' * 60}\n{text}" for page_no, text in enumerate(task['pages'], start=1)
+                )
+                task['status'] = 'completed'
+                task['progress'] = 100
+                self._notify(task)
+
+
+def _multipart(content_type, body):
+    """Campi e file di una richiesta multipart/form-data: ({nome: valore}, [(nome, filename, bytes)])."""
+    message = BytesParser(policy=policy.HTTP).parsebytes(
+        b'Content-Type: ' + content_type.encode('latin-1') + b'\r\n\r\n' + body
+    )
+    fields, files = {}, []
+    for part in message.iter_parts():
+        name = part.get_param('name', header='content-disposition')
+        payload = part.get_payload(decode=True) or b''
+        if part.get_filename() is not None:
+            files.append((name, part.get_filename(), payload))
+        else:
+            fields[name] = payload.decode('utf-8')
+    return fields, files
+
+
+UPLOADS_PATH = '/api/ocr/uploads/'
+
+
+def make_handler(ocr, fail_rate):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def _send(self, status, payload):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _body(self):
+            return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+        def _unavailable(self):
+            # Errori temporanei simulati, per provare retry e circuit breaker del client
+            return fail_rate and random.random() < fail_rate
+
+        def do_GET(self):
+            if self._unavailable():
+                return self._send(503, {'error': 'simulated outage'})
+            if self.path.startswith(UPLOADS_PATH):
+                payload = ocr.upload_status(self.path[len(UPLOADS_PATH):])
+                return self._send(200, payload) if payload else self._send(404, {'error': 'unknown upload'})
+            prefix = '/api/ocr/status/'
+            if not self.path.startswith(prefix):
+                return self._send(404, {'error': 'not found'})
+            payload = ocr.status(self.path[len(prefix):])
+            if payload is None:
+                return self._send(404, {'error': 'unknown task'})
+            self._send(200, payload)
+
+        def do_PUT(self):
+            body = self._body()
+            if self._unavailable():
+                return self._send(503, {'error': 'simulated outage'})
+            if not self.path.startswith(UPLOADS_PATH):
+                return self._send(404, {'error': 'not found'})
+            status, payload = ocr.write_chunk(
+                self.path[len(UPLOADS_PATH):], int(self.headers.get('Upload-Offset', -1)),
+                body, self.headers.get('X-Chunk-SHA256', '')
+            )
+            self._send(status, payload)
+
+        def do_POST(self):
+            body = self._body()
+            if self._unavailable():
+                return self._send(503, {'error': 'simulated outage'})
+
+            if self.path == '/api/ocr/uploads':
+                return self._send(200, ocr.create_upload(json.loads(body)))
+
+            if self.path.startswith(UPLOADS_PATH) and self.path.endswith('/complete'):
+                return self._send(*ocr.complete_upload(self.path[len(UPLOADS_PATH):-len('/complete')]))
+
+            if self.path == '/api/ocr/process':
+                fields, files = _multipart(self.headers['Content-Type'], body)
+                if not files:
+                    return self._send(400, {'error': 'missing file'})
+                task_id = ocr.submit(fields.get('document_id'), fields.get('title', ''), files[0][2], fields.get('callback_url'))
+                return self._send(200, {'task_id': task_id, 'status': 'queued'})
+
+            if self.path == '/api/ocr/process_batch':
+                fields, files = _multipart(self.headers['Content-Type'], body)
+                documents = json.loads(fields.get('documents', '[]'))
+                if len(documents) != len(files):
+                    return self._send(400, {'error': f"{len(documents)} documents for {len(files)} files"})
+                tasks = []
+                for document, (_, _, pdf_bytes) in zip(documents, files):
+                    task_id = ocr.submit(document['document_id'], document.get('title', ''), pdf_bytes, fields.get('callback_url'))
+                    tasks.append({'document_id': document['document_id'], 'task_id': task_id})
+                return self._send(200, {'tasks': tasks})
+
+            if self.path == '/api/ocr/status_batch':
+                task_ids = json.loads(body or b'{}').get('task_ids', [])
+                statuses = {task_id: ocr.status(task_id) for task_id in task_ids}
+                return self._send(200, {'statuses': {task_id: payload for task_id, payload in statuses.items() if payload}})
+
+            self._send(404, {'error': 'not found'})
+
+        def log_message(self, format, *args):
+            print(f"[OCR] {self.address_string()} {format % args}")
+
+    return Handler
+
+
+class Command(BaseCommand):
+    help = (
+        "Avvia un server locale che sostituisce il server GPU OCR, con la stessa API "
+        "(process, status, process_batch, status_batch, caricamento a blocchi e callback firmati). "
+        "Il testo restituito è il text layer del PDF, o un segnaposto per le pagine scansionate."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8000)
+        parser.add_argument('--seconds-per-page', type=float, default=0.5,
+                            help="Tempo simulato di OCR per pagina (per tutto il batch GPU)")
+        parser.add_argument('--gpu-batch', type=int, default=8, help="Documenti elaborati insieme")
+        parser.add_argument('--fail-rate', type=float, default=0.0,
+                            help="Frazione di richieste a cui rispondere 503")
+        parser.add_argument('--callback-secret', default=getattr(settings, 'OCR_CALLBACK_SECRET', ''),
+                            help="Segreto per firmare i callback (default: OCR_CALLBACK_SECRET)")
+
+    def handle(self, *args, **options):
+        ocr = StandinOcr(options['seconds_per_page'], options['gpu_batch'], options['callback_secret'])
+        threading.Thread(target=ocr.run, name="standin-gpu", daemon=True).start()
+
+        server = ThreadingHTTPServer((options['host'], options['port']), make_handler(ocr, options['fail_rate']))
+        self.stdout.write(self.style.SUCCESS(
+            f"Server OCR sostitutivo in ascolto su http://{options['host']}:{server.server_port}"
+        ))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,70 @@
+import os
+from django.core.management.base import BaseCommand
+from doc_manager.models import Document
+from doc_manager.tasks import index_document_rag, queue_indexing
+from doc_manager.rag_pipeline.parse_cache import has_cached_parse
+from doc_manager.rag_pipeline.preflight import inspect_pdf, choose_route, ROUTE_DOCLING
+from doc_manager.rag_pipeline.processing import select_profile
+
+
+class Command(BaseCommand):
+    help = (
+        "Ricalcola chunk e indice dei documenti già indicizzati partendo dai dati "
+        "già estratti: documento Docling in cache, testo OCR salvato o text layer. "
+        "Da usare dopo modifiche ai parametri di chunking."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('document_ids', nargs='*', type=int, help="ID dei documenti (default: tutti quelli indicizzati)")
+        parser.add_argument('--allow-convert', action='store_true',
+                            help="Riconverte con Docling i documenti senza cache invece di saltarli")
+        parser.add_argument('--async', action='store_true', dest='use_celery',
+                            help="Accoda l'indicizzazione ai worker Celery invece di eseguirla qui")
+
+    def _needs_conversion(self, doc):
+        """
+        True se il ricalcolo richiederebbe di rieseguire la conversione Docling.
+        I documenti indicizzati prima dell'instradamento hanno processing_route
+        vuoto: il percorso viene deciso dal preflight, come farebbe l'indicizzazione.
+        """
+        if doc.document_type == 'scanned' or doc.processing_route not in (ROUTE_DOCLING, ''):
+            return False
+        if not os.path.exists(doc.file.path):
+            return True
+        preflight = inspect_pdf(doc.file.path)
+        if not doc.processing_route and choose_route(preflight)[0] != ROUTE_DOCLING:
+            return False
+        profile = doc.processing_profile or select_profile(preflight['page_count'])
+        skip_pages = doc.ocr_pages if doc.document_type == 'mixed' else ()
+        return not has_cached_parse(doc.file.path, profile, skip_pages)
+
+    def handle(self, *args, **options):
+        documents = Document.objects.filter(is_processed=True)
+        if options['document_ids']:
+            documents = documents.filter(pk__in=options['document_ids'])
+
+        rechunked = skipped = 0
+
+        for doc in documents.order_by('pk'):
+            if doc.document_type in ['scanned', 'mixed'] and not doc.ocr_text:
+                self.stdout.write(self.style.WARNING(f"[{doc.pk}] {doc.title}: testo OCR mancante, saltato"))
+                skipped += 1
+                continue
+            if self._needs_conversion(doc) and not options['allow_convert']:
+                self.stdout.write(self.style.WARNING(f"[{doc.pk}] {doc.title}: nessuna cache Docling, saltato"))
+                skipped += 1
+                continue
+
+            # I chunk attuali restano ricercabili: l'indicizzazione sovrascrive quelli con lo
+            # stesso ID e rimuove gli altri solo a lavoro concluso
+            if options['use_celery']:
+                queue_indexing(doc.pk)
+                self.stdout.write(f"[{doc.pk}] {doc.title}: accodato")
+            else:
+                index_document_rag(doc.pk)
+                doc.refresh_from_db()
+                self.stdout.write(f"[{doc.pk}] {doc.title}: {doc.processing_state}, "
+                                  f"{doc.processing_stats.get('chunk_count', 0)} chunk")
+            rechunked += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Documenti ricalcolati: {rechunked}, saltati: {skipped}"))
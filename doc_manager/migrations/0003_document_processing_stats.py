@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-19 13:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('doc_manager', '0002_document_document_type_document_ocr_completed_at_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='processing_stats',
+            field=models.JSONField(blank=True, default=dict, help_text="Metriche raccolte durante l'indicizzazione"),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-19 14:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('doc_manager', '0003_document_processing_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='processing_route',
+            field=models.CharField(blank=True, choices=[('docling', 'Docling'), ('text_layer', 'Text layer'), ('ocr', 'OCR')], max_length=20),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-19 14:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('doc_manager', '0004_document_processing_route'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='ocr_pages',
+            field=models.JSONField(blank=True, default=list, help_text='Pages without a text layer that require OCR'),
+        ),
+        migrations.AlterField(
+            model_name='document',
+            name='document_type',
+            field=models.CharField(choices=[('native', 'Native PDF'), ('scanned', 'Scanned PDF'), ('mixed', 'Mixed PDF')], default='native', max_length=20),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-19 14:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('doc_manager', '0005_document_ocr_pages_mixed_type'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='processing_profile',
+            field=models.CharField(blank=True, help_text='Docling processing profile (see processing_profiles in rag_config.yaml)', max_length=20),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-19 16:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('doc_manager', '0007_document_ocr_task_tracking'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='document',
+            name='processing_state',
+            field=models.CharField(choices=[('pending', 'Pending'), ('ocr_queued', 'OCR Queued'), ('ocr_processing', 'OCR Processing'), ('ocr_completed', 'OCR Completed'), ('ocr_failed', 'OCR Failed'), ('partially_indexed', 'Partially Indexed'), ('rag_processing', 'RAG Processing'), ('completed', 'Completed'), ('failed', 'Failed')], default='pending', max_length=20),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-19 17:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('doc_manager', '0008_document_partially_indexed_state'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='ocr_upload_id',
+            field=models.CharField(blank=True, help_text='Resumable upload in progress on the GPU OCR server', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='ocr_upload_offset',
+            field=models.BigIntegerField(default=0, help_text='Bytes already received by the GPU OCR server'),
+        ),
+    ]
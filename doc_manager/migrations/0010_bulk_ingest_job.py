@@ -0,0 +1,46 @@
+# Generated by Django 5.2.7 on 2026-10-19 18:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('doc_manager', '0009_document_ocr_upload'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BulkIngestJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('source', models.CharField(choices=[('upload', 'Multiple files'), ('zip', 'ZIP archive'), ('directory', 'Server directory')], max_length=20)),
+                ('source_path', models.CharField(help_text='Staging directory, ZIP archive or server directory to ingest', max_length=1024)),
+                ('document_type', models.CharField(default='auto', help_text="'auto' or a Document type applied to every file", max_length=20)),
+                ('processing_profile', models.CharField(blank=True, max_length=20)),
+                ('auto_process', models.BooleanField(default=True, help_text='Start OCR/indexing as soon as the documents are created')),
+                ('state', models.CharField(choices=[('staging', 'Staging'), ('processing', 'Processing'), ('completed', 'Completed'), ('failed', 'Failed')], default='staging', max_length=20)),
+                ('total_count', models.PositiveIntegerField(default=0)),
+                ('in_progress_count', models.PositiveIntegerField(default=0)),
+                ('completed_count', models.PositiveIntegerField(default=0)),
+                ('failed_count', models.PositiveIntegerField(default=0)),
+                ('errors', models.JSONField(blank=True, default=list)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('uploader', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='bulk_job',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='documents', to='doc_manager.bulkingestjob'),
+        ),
+    ]
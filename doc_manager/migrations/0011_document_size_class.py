@@ -0,0 +1,28 @@
+# Generated by Django 5.2.7 on 2026-10-19 14:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('doc_manager', '0010_bulk_ingest_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='file_size',
+            field=models.PositiveBigIntegerField(default=0, help_text='File size in bytes'),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='page_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='document',
+            name='processing_state',
+            field=models.CharField(choices=[('pending', 'Pending'), ('ocr_queued', 'OCR Queued'), ('ocr_processing', 'OCR Processing'), ('ocr_completed', 'OCR Completed'), ('ocr_failed', 'OCR Failed'), ('partially_indexed', 'Partially Indexed'), ('rag_queued', 'RAG Queued'), ('rag_processing', 'RAG Processing'), ('completed', 'Completed'), ('failed', 'Failed')], default='pending', max_length=20),
+        ),
+    ]
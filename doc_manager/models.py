@@ -1,10 +1,54 @@
 from django.db import models
 from django.contrib.auth.models import User
 
+class BulkIngestJob(models.Model):
+    """Caricamento in blocco (più file, archivio ZIP o cartella sul server) e avanzamento aggregato."""
+
+    SOURCES = [
+        ('upload', 'Multiple files'),
+        ('zip', 'ZIP archive'),
+        ('directory', 'Server directory'),
+    ]
+
+    STATES = [
+        ('staging', 'Staging'),
+        ('processing', 'Processing'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+
+    uploader = models.ForeignKey(User, on_delete=models.CASCADE)
+    name = models.CharField(max_length=255)
+    source = models.CharField(max_length=20, choices=SOURCES)
+    source_path = models.CharField(max_length=1024, help_text="Staging directory, ZIP archive or server directory to ingest")
+    document_type = models.CharField(max_length=20, default='auto', help_text="'auto' or a Document type applied to every file")
+    processing_profile = models.CharField(max_length=20, blank=True)
+    auto_process = models.BooleanField(default=True, help_text="Start OCR/indexing as soon as the documents are created")
+
+    state = models.CharField(max_length=20, choices=STATES, default='staging')
+    total_count = models.PositiveIntegerField(default=0)
+    in_progress_count = models.PositiveIntegerField(default=0)
+    completed_count = models.PositiveIntegerField(default=0)
+    failed_count = models.PositiveIntegerField(default=0)
+    # File scartati durante la creazione dei documenti: [{"file": ..., "error": ...}]
+    errors = models.JSONField(default=list, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return self.name
+
+    class Meta:
+        ordering = ['-created_at']
+
+
 class Document(models.Model):
     DOCUMENT_TYPES = [
         ('native', 'Native PDF'),
         ('scanned', 'Scanned PDF'),
+        ('mixed', 'Mixed PDF'),
     ]
     
     # Stati di processamento
@@ -14,11 +58,20 @@ class Document(models.Model):
         ('ocr_processing', 'OCR Processing'),
         ('ocr_completed', 'OCR Completed'),
         ('ocr_failed', 'OCR Failed'),
+        ('partially_indexed', 'Partially Indexed'),
+        ('rag_queued', 'RAG Queued'),
         ('rag_processing', 'RAG Processing'),
         ('completed', 'Completed'),
         ('failed', 'Failed'),
     ]
     
+    # Percorso effettivamente usato per l'estrazione del contenuto
+    PROCESSING_ROUTES = [
+        ('docling', 'Docling'),
+        ('text_layer', 'Text layer'),
+        ('ocr', 'OCR'),
+    ]
+    
     uploader = models.ForeignKey(User, on_delete=models.CASCADE)    
     file = models.FileField(upload_to='documents/%Y/%m/%d/')
     title = models.CharField(max_length=100)
@@ -35,12 +88,45 @@ class Document(models.Model):
         default='pending'
     )
     
+    processing_route = models.CharField(
+        max_length=20,
+        choices=PROCESSING_ROUTES,
+        blank=True
+    )
+    processing_profile = models.CharField(
+        max_length=20,
+        blank=True,
+        help_text="Docling processing profile (see processing_profiles in rag_config.yaml)"
+    )
+    
+    # Rilevati dal preflight al caricamento: decidono la coda di indicizzazione
+    page_count = models.PositiveIntegerField(default=0)
+    file_size = models.PositiveBigIntegerField(default=0, help_text="File size in bytes")
+    
     is_processed = models.BooleanField(default=False)
     processing_output = models.TextField(blank=True, null=True)
+    processing_stats = models.JSONField(default=dict, blank=True, help_text="Metriche raccolte durante l'indicizzazione")
     
     ocr_text = models.TextField(blank=True, null=True, help_text="Extracted text from OCR")
     ocr_completed_at = models.DateTimeField(null=True, blank=True)
     ocr_error = models.TextField(blank=True, null=True)
+    ocr_pages = models.JSONField(default=list, blank=True, help_text="Pages without a text layer that require OCR")
+    ocr_task_id = models.CharField(max_length=100, blank=True, help_text="Task ID assigned by the GPU OCR server")
+    ocr_progress = models.PositiveSmallIntegerField(default=0)
+    # Caricamento a blocchi dei PDF grandi verso il server GPU, ripreso dall'ultimo offset confermato
+    ocr_upload_id = models.CharField(max_length=100, blank=True, help_text="Resumable upload in progress on the GPU OCR server")
+    ocr_upload_offset = models.BigIntegerField(default=0, help_text="Bytes already received by the GPU OCR server")
+    
+    # Aggiornato ad ogni cambio di stato o progresso: lo sweeper OCR lo usa per trovare i task fermi
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    bulk_job = models.ForeignKey(
+        BulkIngestJob,
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name='documents'
+    )
     
     processed_file = models.FileField(
         upload_to='documents/processed/%Y/%m/%d/',
@@ -0,0 +1,367 @@
+import hashlib
+import os
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+from django.conf import settings
+
+# Risposte del server GPU (o del tunnel SSH) che indicano un problema temporaneo
+RETRY_STATUS_CODES = (502, 503, 504)
+
+# Nuovi caricamenti a blocchi tentati quando il server dimentica quello in corso (404)
+MAX_UPLOAD_RESTARTS = 1
+
+
+class OcrServerUnavailable(Exception):
+    """Il server GPU non è raggiungibile o il circuit breaker è aperto."""
+
+    def __init__(self, message, retry_after=0.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class OcrUploadError(Exception):
+    """Il server GPU ha rifiutato il caricamento a blocchi."""
+
+
+def request_not_sent(error) -> bool:
+    """
+    True se la richiesta sicuramente non è arrivata al server GPU: circuito
+    aperto, timeout di connessione o connessione rifiutata. Un reset della
+    connessione o un timeout di lettura possono arrivare dopo l'invio del
+    corpo, quando il server ha già creato il task: una richiesta non
+    idempotente non va ripetuta.
+    """
+    if isinstance(error, (OcrServerUnavailable, requests.ConnectTimeout)):
+        return True
+    if not isinstance(error, requests.ConnectionError) or not error.args:
+        return False
+    # requests incapsula l'errore di urllib3 (MaxRetryError) che ne riporta la causa in .reason
+    reason = getattr(error.args[0], 'reason', error.args[0])
+    return isinstance(reason, (NewConnectionError, ConnectionRefusedError))
+
+
+def _file_digest(file_obj):
+    """(dimensione, SHA-256) di un file binario aperto, letto a blocchi."""
+    digest = hashlib.sha256()
+    size = 0
+    file_obj.seek(0)
+    for block in iter(lambda: file_obj.read(1024 * 1024), b''):
+        digest.update(block)
+        size += len(block)
+    return size, digest.hexdigest()
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker del processo worker: dopo `failure_threshold` richieste
+    fallite consecutive si apre e per `reset_timeout` secondi le richieste al
+    server GPU non vengono nemmeno tentate. Trascorso il timeout lascia
+    passare una sola richiesta di prova: se riesce si richiude, altrimenti
+    resta aperto per un altro periodo.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def retry_after(self) -> float:
+        """Secondi mancanti alla prossima richiesta di prova (0 se il circuito è chiuso)."""
+        if self.state == self.CLOSED:
+            return 0.0
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.retry_after() == 0:
+                # Richiesta di prova; se non riporta un esito entro reset_timeout se ne concede un'altra
+                self.state = self.HALF_OPEN
+                self.opened_at = time.monotonic()
+                return True
+            # Circuito aperto, oppure richiesta di prova in corso
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                print("[OCR] Server GPU di nuovo raggiungibile, circuit breaker chiuso")
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    print(f"[OCR] Server GPU non raggiungibile ({self.failures} errori consecutivi), "
+                          f"invio sospeso per {self.reset_timeout}s")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+class EndpointMetrics:
+    """Contatori di latenza ed errori di un endpoint del server GPU."""
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.rejected = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.status_codes = {}
+
+    def observe(self, seconds, status_code=None, error=False):
+        self.requests += 1
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        if status_code is not None:
+            self.status_codes[status_code] = self.status_codes.get(status_code, 0) + 1
+        if error:
+            self.errors += 1
+
+    def report(self):
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'retries': self.retries,
+            'rejected': self.rejected,
+            'avg_seconds': round(self.total_seconds / self.requests, 3) if self.requests else None,
+            'max_seconds': round(self.max_seconds, 3),
+            'status_codes': dict(self.status_codes),
+        }
+
+
+class OcrClient:
+    """
+    Client HTTP del server GPU OCR. Usa una sessione con connessioni
+    persistenti (il tunnel SSH verso GPU_SERVER_URL non viene riaperto ad ogni
+    richiesta), ripete gli errori temporanei con backoff esponenziale e
+    jitter, e passa dal circuit breaker prima di ogni richiesta.
+    """
+
+    def __init__(self, base_url=None):
+        self.base_url = (base_url or getattr(settings, 'GPU_SERVER_URL', 'http://localhost:8000')).rstrip('/')
+        self.connect_timeout = getattr(settings, 'OCR_CONNECT_TIMEOUT', 10)
+        self.read_timeout = getattr(settings, 'OCR_REQUEST_TIMEOUT', 300)
+        self.max_retries = getattr(settings, 'OCR_HTTP_MAX_RETRIES', 3)
+        self.backoff_base = getattr(settings, 'OCR_HTTP_BACKOFF_BASE', 1.0)
+        self.backoff_max = getattr(settings, 'OCR_HTTP_BACKOFF_MAX', 30.0)
+        self.upload_chunk_size = getattr(settings, 'OCR_UPLOAD_CHUNK_SIZE', 4 * 1024 * 1024)
+        self.breaker = CircuitBreaker(
+            failure_threshold=getattr(settings, 'OCR_CIRCUIT_FAILURE_THRESHOLD', 5),
+            reset_timeout=getattr(settings, 'OCR_CIRCUIT_RESET_TIMEOUT', 60),
+        )
+        self.metrics = {}
+
+        pool_size = getattr(settings, 'OCR_HTTP_POOL_SIZE', 4)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def _backoff(self, attempt) -> float:
+        """Backoff esponenziale con full jitter: uniforme in [0, base * 2^attempt]."""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _retryable(self, error, idempotent) -> bool:
+        # Una richiesta non idempotente (l'invio di un PDF) viene ripetuta solo
+        # se non è mai arrivata al server, per non creare task OCR duplicati
+        if idempotent:
+            return isinstance(error, (requests.ConnectionError, requests.Timeout))
+        return request_not_sent(error)
+
+    def request(self, endpoint, method, path, idempotent=True, files=None, **kwargs):
+        """
+        Esegue la richiesta con retry; `endpoint` è il nome sotto cui vengono
+        raccolte le metriche. Solleva OcrServerUnavailable se il circuito è
+        aperto, altrimenti l'ultimo errore di rete dopo i tentativi.
+        Le risposte HTTP (anche 4xx/5xx) vengono restituite al chiamante.
+        """
+        metrics = self.metrics.setdefault(endpoint, EndpointMetrics())
+        if not self.breaker.allow():
+            metrics.rejected += 1
+            retry_after = self.breaker.retry_after()
+            raise OcrServerUnavailable(
+                f"Server GPU non disponibile, nuovo tentativo tra {retry_after:.0f}s", retry_after
+            )
+
+        kwargs.setdefault('timeout', (self.connect_timeout, self.read_timeout))
+        url = f"{self.base_url}{path}"
+        attempt = 0
+        while True:
+            if files:
+                # I file vanno riletti dall'inizio ad ogni tentativo
+                parts = files.values() if isinstance(files, dict) else (part for _, part in files)
+                for _, file_obj, *_ in parts:
+                    file_obj.seek(0)
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, url, files=files, **kwargs)
+            except requests.RequestException as e:
+                metrics.observe(time.perf_counter() - start, error=True)
+                if attempt < self.max_retries and self._retryable(e, idempotent):
+                    delay = self._backoff(attempt)
+                    print(f"[OCR] {endpoint}: {type(e).__name__}, nuovo tentativo tra {delay:.1f}s")
+                    metrics.retries += 1
+                    attempt += 1
+                    time.sleep(delay)
+                    continue
+                self.breaker.record_failure()
+                raise
+
+            retry_status = response.status_code in RETRY_STATUS_CODES
+            metrics.observe(time.perf_counter() - start, response.status_code, error=response.status_code >= 500)
+            if retry_status and attempt < self.max_retries:
+                delay = self._backoff(attempt)
+                print(f"[OCR] {endpoint}: HTTP {response.status_code}, nuovo tentativo tra {delay:.1f}s")
+                metrics.retries += 1
+                attempt += 1
+                time.sleep(delay)
+                continue
+
+            if retry_status:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            return response
+
+    def submit(self, files, data):
+        """POST /api/ocr/process: invia il PDF al server GPU."""
+        return self.request('process', 'POST', '/api/ocr/process', idempotent=False, files=files, data=data)
+
+    def status(self, task_id):
+        """GET /api/ocr/status/{task_id}"""
+        return self.request('status', 'GET', f'/api/ocr/status/{task_id}', timeout=(self.connect_timeout, 30))
+
+    def submit_batch(self, files, data):
+        """
+        POST /api/ocr/process_batch: più PDF in una richiesta multipart, tutti
+        nel campo 'files'; data['documents'] è la lista JSON, nello stesso
+        ordine, di {document_id, title}. La risposta è
+        {"tasks": [{"document_id", "task_id"} | {"document_id", "error"}]}.
+        """
+        return self.request('process_batch', 'POST', '/api/ocr/process_batch', idempotent=False, files=files, data=data)
+
+    def status_batch(self, task_ids):
+        """
+        POST /api/ocr/status_batch con {"task_ids": [...]}: risponde
+        {"statuses": {task_id: <payload di /api/ocr/status>}}.
+        """
+        return self.request('status_batch', 'POST', '/api/ocr/status_batch',
+                            json={'task_ids': list(task_ids)}, timeout=(self.connect_timeout, 60))
+
+    def _check(self, response, action):
+        if response.status_code in RETRY_STATUS_CODES:
+            # Errore temporaneo anche dopo i retry: il chiamante può riprovare più tardi
+            raise OcrServerUnavailable(f"{action}: GPU server returned status {response.status_code}")
+        if response.status_code != 200:
+            raise OcrUploadError(f"{action}: GPU server returned status {response.status_code}: {response.text}")
+        return response.json()
+
+    def upload_resumable(self, file_obj, metadata, upload_id=None, on_progress=None, restarts=0):
+        """
+        Carica il file con il protocollo a blocchi del server GPU e avvia l'OCR:
+
+            POST /api/ocr/uploads                  {size, sha256, ...metadata} -> {upload_id, offset}
+            GET  /api/ocr/uploads/{id}             -> {upload_id, offset, size, sha256}
+            PUT  /api/ocr/uploads/{id}             blocco con Upload-Offset e X-Chunk-SHA256 -> {offset}
+            POST /api/ocr/uploads/{id}/complete    -> {task_id} (idempotente)
+
+        Ogni blocco è una richiesta breve e idempotente, quindi può essere
+        ripetuta dal retry del client. Con `upload_id` di un tentativo
+        precedente il caricamento riprende dall'offset confermato dal server,
+        se il file è lo stesso. `on_progress(upload_id, offset)` viene
+        chiamata dopo ogni blocco. Ritorna il task ID dell'OCR.
+        Un caricamento scaduto (404) viene ricominciato al più
+        MAX_UPLOAD_RESTARTS volte e l'offset viene riallineato (409) al più
+        max_retries volte di seguito: oltre, OcrUploadError.
+        """
+        size, digest = _file_digest(file_obj)
+        upload = None
+        if upload_id:
+            response = self.request('upload_status', 'GET', f'/api/ocr/uploads/{upload_id}')
+            if response.status_code == 200 and response.json().get('sha256') == digest:
+                upload = response.json()
+                print(f"[OCR] Ripresa del caricamento {upload_id} da {upload['offset']}/{size} byte")
+        if upload is None:
+            upload = self._check(
+                self.request('upload_create', 'POST', '/api/ocr/uploads', json={**metadata, 'size': size, 'sha256': digest}),
+                "Creazione caricamento"
+            )
+        upload_id, offset = upload['upload_id'], upload['offset']
+        if on_progress:
+            on_progress(upload_id, offset)
+
+        checksum_errors = realignments = 0
+        while offset < size:
+            file_obj.seek(offset)
+            data = file_obj.read(self.upload_chunk_size)
+            response = self.request('upload_chunk', 'PUT', f'/api/ocr/uploads/{upload_id}', data=data, headers={
+                'Content-Type': 'application/octet-stream',
+                'Upload-Offset': str(offset),
+                'X-Chunk-SHA256': hashlib.sha256(data).hexdigest(),
+            })
+            if response.status_code == 404:
+                # Caricamento scaduto sul server: si ricomincia da zero
+                if restarts >= MAX_UPLOAD_RESTARTS:
+                    raise OcrUploadError(f"Caricamento {upload_id} non disponibile sul server dopo {restarts} nuovi caricamenti")
+                print(f"[OCR] Caricamento {upload_id} non più disponibile, nuovo caricamento")
+                return self.upload_resumable(file_obj, metadata, None, on_progress, restarts + 1)
+            if response.status_code == 409:
+                # Offset disallineato (blocco già ricevuto in un tentativo precedente)
+                realignments += 1
+                if realignments > self.max_retries:
+                    raise OcrUploadError(f"Blocco a offset {offset}: offset disallineato dopo {self.max_retries} riallineamenti")
+                offset = response.json()['offset']
+                continue
+            if response.status_code == 422 and checksum_errors < self.max_retries:
+                # Blocco arrivato corrotto: viene reinviato
+                checksum_errors += 1
+                continue
+            offset = self._check(response, f"Blocco a offset {offset}")['offset']
+            realignments = 0
+            if on_progress:
+                on_progress(upload_id, offset)
+
+        result = self._check(
+            self.request('upload_complete', 'POST', f'/api/ocr/uploads/{upload_id}/complete'),
+            "Completamento caricamento"
+        )
+        return result['task_id']
+
+    def report(self):
+        return {
+            'circuit': self.breaker.state,
+            'consecutive_failures': self.breaker.failures,
+            'endpoints': {name: metrics.report() for name, metrics in self.metrics.items()},
+        }
+
+
+# Un client per processo: la sessione non va condivisa tra processi dopo il fork
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_ocr_client() -> OcrClient:
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        with _client_lock:
+            if _client is None or _client_pid != os.getpid():
+                _client = OcrClient()
+                _client_pid = os.getpid()
+    return _client
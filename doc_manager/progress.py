@@ -0,0 +1,122 @@
+import json
+import time
+from datetime import datetime, timezone as dt_timezone
+import redis
+import redis.asyncio as aioredis
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Q
+from .models import Document
+from .leases import get_redis, redis_url
+
+CHANNEL_PREFIX = 'docseek:progress'
+# Un commento SSE periodico tiene aperta la connessione attraverso i proxy
+PROGRESS_STREAM_HEARTBEAT = getattr(settings, 'PROGRESS_STREAM_HEARTBEAT', 15)
+# Dopo PROGRESS_STREAM_MAX_SECONDS lo stream si chiude e il browser si ricollega da solo
+PROGRESS_STREAM_MAX_SECONDS = getattr(settings, 'PROGRESS_STREAM_MAX_SECONDS', 300)
+PROGRESS_STREAM_RETRY_MS = getattr(settings, 'PROGRESS_STREAM_RETRY_MS', 3000)
+
+# Campi del documento inviati alla dashboard
+EVENT_FIELDS = ['pk', 'uploader_id', 'processing_state', 'processing_output', 'ocr_progress', 'is_processed']
+
+
+def channel(user_id) -> str:
+    """Canale pub/sub con gli eventi dei documenti di un uploader."""
+    return f"{CHANNEL_PREFIX}:{user_id}"
+
+
+def _event(row, **extra):
+    return {
+        'document': row['pk'],
+        'state': row['processing_state'],
+        'output': row['processing_output'] or '',
+        'ocr_progress': row['ocr_progress'],
+        'is_processed': row['is_processed'],
+        'ts': int(time.time() * 1000),
+        **extra,
+    }
+
+
+def _publish(user_id, event):
+    try:
+        get_redis().publish(channel(user_id), json.dumps(event))
+    except redis.RedisError as e:
+        # La dashboard recupera lo stato alla prossima connessione allo stream
+        print(f"[RAG] Impossibile pubblicare l'avanzamento del documento {event['document']}: {e}")
+
+
+def publish_documents(*document_pks, **extra):
+    """
+    Pubblica lo stato corrente dei documenti indicati sul canale del loro
+    uploader. Va chiamata dopo ogni cambio di stato, anche quando il
+    documento è stato aggiornato con QuerySet.update().
+    """
+    rows = Document.objects.filter(pk__in=document_pks).values(*EVENT_FIELDS)
+    for row in rows:
+        _publish(row['uploader_id'], _event(row, **extra))
+
+
+def publish_stage(doc_instance, stage, output, progress=None):
+    """
+    Pubblica una fase intermedia dell'elaborazione (es. chunk già indicizzati)
+    senza scrivere sul database.
+    """
+    event = _event({
+        'pk': doc_instance.pk,
+        'processing_state': doc_instance.processing_state,
+        'processing_output': output,
+        'ocr_progress': doc_instance.ocr_progress,
+        'is_processed': doc_instance.is_processed,
+    }, stage=stage, progress=progress)
+    _publish(doc_instance.uploader_id, event)
+
+
+def _format_event(event):
+    return f"id: {event['ts']}\nevent: document\ndata: {json.dumps(event)}\n\n"
+
+
+def _snapshot(user_id, since_ms):
+    """
+    Stato dei documenti ancora da elaborare e di quelli modificati dopo
+    `since_ms`, per non perdere gli eventi pubblicati mentre il browser era
+    scollegato.
+    """
+    changed = Q(is_processed=False)
+    if since_ms:
+        changed |= Q(updated_at__gte=datetime.fromtimestamp(since_ms / 1000, tz=dt_timezone.utc))
+    rows = Document.objects.filter(changed, uploader_id=user_id).values(*EVENT_FIELDS)
+    return [_event(row) for row in rows]
+
+
+async def stream_events(user_id, since_ms=None):
+    """
+    Generatore asincrono dello stream SSE di un uploader: prima lo stato
+    corrente dei suoi documenti, poi gli eventi pubblicati dai task.
+    """
+    client = aioredis.Redis.from_url(redis_url())
+    pubsub = client.pubsub()
+    try:
+        # Iscrizione prima dello snapshot: nessun evento va perso tra i due
+        await pubsub.subscribe(channel(user_id))
+        yield f"retry: {PROGRESS_STREAM_RETRY_MS}\n\n"
+        for event in await sync_to_async(_snapshot)(user_id, since_ms):
+            yield _format_event(event)
+
+        deadline = time.monotonic() + PROGRESS_STREAM_MAX_SECONDS
+        while time.monotonic() < deadline:
+            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=PROGRESS_STREAM_HEARTBEAT)
+            if message is None:
+                yield ": keepalive\n\n"
+                continue
+            yield _format_event(json.loads(message['data']))
+
+    except redis.RedisError as e:
+        print(f"[RAG] Stream di avanzamento non disponibile per l'utente {user_id}: {e}")
+        yield "event: unavailable\ndata: {}\n\n"
+
+    finally:
+        try:
+            await pubsub.aclose()
+            await client.aclose()
+        except redis.RedisError:
+            pass
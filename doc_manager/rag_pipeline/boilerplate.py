@@ -0,0 +1,154 @@
+import hashlib
+import re
+from collections import defaultdict
+from typing import Dict, List, Set, Tuple
+from .config import is_boilerplate_enabled, get_boilerplate_min_ratio, get_boilerplate_min_pages, get_boilerplate_max_line_length
+
+# Numero di righe in testa e in coda alla pagina in cui cercare numeri di pagina
+EDGE_LINES = 2
+
+_DIGITS_PATTERN = re.compile(r'\d+')
+_SPACES_PATTERN = re.compile(r'\s+')
+
+
+def _line_keys(line: str, fuzzy_digits: bool, max_length: int) -> List[bytes]:
+    """
+    Calcola gli hash della riga normalizzata (minuscolo, spazi compattati).
+    Se `fuzzy_digits` è attivo aggiunge un secondo hash con le cifre mascherate,
+    così "Pagina 3 di 120" e "Pagina 4 di 120" risultano uguali.
+    Ritorna una lista vuota per le righe che non possono essere boilerplate.
+    """
+    normalized = line.strip()
+    if not normalized or len(normalized) > max_length:
+        return []
+    # Le righe di tabella Markdown (OCR) non vanno mai rimosse: l'header si ripete legittimamente
+    if '|' in normalized:
+        return []
+
+    normalized = _SPACES_PATTERN.sub(' ', normalized.lower())
+    keys = [hashlib.blake2b(normalized.encode('utf-8'), digest_size=8).digest()]
+    if fuzzy_digits and _DIGITS_PATTERN.search(normalized):
+        masked = 'd:' + _DIGITS_PATTERN.sub('#', normalized)
+        keys.append(hashlib.blake2b(masked.encode('utf-8'), digest_size=8).digest())
+    return keys
+
+
+def _page_keys(lines: List[Tuple[str, bool]]) -> List[List[bytes]]:
+    """
+    Calcola gli hash per tutte le righe di una pagina.
+    Ogni riga è una coppia (testo, is_heading): il mascheramento delle cifre
+    vale solo per le righe di bordo pagina che non sono titoli, per non
+    confondere "Capitolo 1" con "Capitolo 2".
+    """
+    last = len(lines) - EDGE_LINES
+    max_length = get_boilerplate_max_line_length()
+    return [
+        _line_keys(text, not is_heading and (i < EDGE_LINES or i >= last), max_length)
+        for i, (text, is_heading) in enumerate(lines)
+    ]
+
+
+class BoilerplateDetector:
+    """
+    Conteggi delle righe per pagina accumulati sulle unità successive di uno
+    stesso documento (intervalli o finestre di pagine): un'intestazione
+    riconosciuta nelle prime pagine continua ad essere rimossa anche nelle
+    unità in cui, da sola, non supererebbe la soglia. Ogni unità viene
+    valutata con i conteggi di tutte le pagine viste fino a quel momento.
+    """
+
+    def __init__(self):
+        self.page_count = 0
+        self.counts = defaultdict(int)
+
+    def update(self, pages_keys: Dict[int, List[List[bytes]]]) -> Set[bytes]:
+        """Aggiunge le pagine di un'unità e restituisce gli hash che superano la soglia di frequenza."""
+        self.page_count += len(pages_keys)
+        for line_keys in pages_keys.values():
+            # Ogni riga conta una sola volta per pagina
+            for key in {key for keys in line_keys for key in keys}:
+                self.counts[key] += 1
+
+        min_pages = get_boilerplate_min_pages()
+        if self.page_count < min_pages:
+            return set()
+        threshold = max(min_pages, self.page_count * get_boilerplate_min_ratio())
+        return {key for key, count in self.counts.items() if count >= threshold}
+
+
+def _repeated_keys(pages_keys: Dict[int, List[List[bytes]]], detector=None) -> Set[bytes]:
+    """
+    Conta, per ogni hash di riga, il numero di pagine distinte in cui compare
+    e restituisce gli hash che superano la soglia di frequenza. Con
+    `detector` i conteggi si sommano a quelli delle unità precedenti.
+    """
+    return (detector or BoilerplateDetector()).update(pages_keys)
+
+
+def find_boilerplate_items(docs, item_maps, detector=None) -> Tuple[Set[Tuple[int, str]], int]:
+    """
+    Individua gli elementi testuali di uno o più documenti Docling (intervalli di
+    pagine dello stesso PDF) ripetuti su più pagine: intestazioni, piè di pagina,
+    disclaimer, numeri di pagina. `detector` (BoilerplateDetector) conserva i
+    conteggi tra le chiamate sulle unità successive dello stesso documento.
+    Ritorna (coppie (indice documento, riferimento) da saltare, caratteri risparmiati).
+    """
+    if not is_boilerplate_enabled():
+        return set(), 0
+
+    page_items = defaultdict(list)
+    for index, (doc, item_map) in enumerate(zip(docs, item_maps)):
+        for ref_item in doc.body.children:
+            item = item_map.get(ref_item.cref)
+            if item is None or item.label.name not in ['TEXT', 'SECTION_HEADER', 'LIST'] or not item.prov:
+                continue
+            page_items[item.prov[0].page_no].append((index, item))
+
+    pages_keys = {
+        page_no: _page_keys([(item.text, item.label.name == 'SECTION_HEADER') for _, item in items])
+        for page_no, items in page_items.items()
+    }
+    repeated = _repeated_keys(pages_keys, detector)
+    if not repeated:
+        return set(), 0
+
+    skip_items, saved_chars = set(), 0
+    for page_no, items in page_items.items():
+        for (index, item), keys in zip(items, pages_keys[page_no]):
+            if any(key in repeated for key in keys):
+                skip_items.add((index, item.self_ref))
+                saved_chars += len(item.text)
+
+    return skip_items, saved_chars
+
+
+def strip_boilerplate_pages(pages: Dict[int, str], detector=None) -> Tuple[Dict[int, str], int]:
+    """
+    Rimuove dal testo OCR (diviso per pagine) le righe ripetute su più pagine.
+    Con `detector` (BoilerplateDetector) i conteggi si sommano a quelli delle
+    finestre di pagine già elaborate.
+    Ritorna (pagine pulite, caratteri risparmiati).
+    """
+    if not is_boilerplate_enabled():
+        return pages, 0
+
+    page_lines = {page_num: content.split('\n') for page_num, content in pages.items()}
+    pages_keys = {
+        page_num: _page_keys([(line, line.lstrip().startswith('#')) for line in lines])
+        for page_num, lines in page_lines.items()
+    }
+    repeated = _repeated_keys(pages_keys, detector)
+    if not repeated:
+        return pages, 0
+
+    cleaned_pages, saved_chars = {}, 0
+    for page_num, lines in page_lines.items():
+        kept = []
+        for line, keys in zip(lines, pages_keys[page_num]):
+            if any(key in repeated for key in keys):
+                saved_chars += len(line)
+            else:
+                kept.append(line)
+        cleaned_pages[page_num] = '\n'.join(kept).strip()
+
+    return cleaned_pages, saved_chars
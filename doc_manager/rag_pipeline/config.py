@@ -51,6 +51,10 @@ def get_chunk_size():
     return get_param('chunking', 'max_text_chunk_size', 500)
 
 
+def get_max_chunk_tokens():
+    return get_param('chunking', 'max_chunk_tokens', 0)
+
+
 def get_chunk_overlap():
     return get_param('chunking', 'chunk_overlap_size', 50)
 
@@ -64,4 +68,107 @@ def get_collection_name():
 
 
 def get_embedding_model():
-    return get_param('embedding', 'model_name', 'paraphrase-multilingual-MiniLM-L12-v2')
\ No newline at end of file
+    return get_param('embedding', 'model_name', 'paraphrase-multilingual-MiniLM-L12-v2')
+
+def is_boilerplate_enabled():
+    return get_param('boilerplate', 'enabled', True)
+
+
+def get_boilerplate_min_ratio():
+    return get_param('boilerplate', 'min_page_ratio', 0.5)
+
+
+def get_boilerplate_min_pages():
+    return get_param('boilerplate', 'min_pages', 3)
+
+
+def get_boilerplate_max_line_length():
+    return get_param('boilerplate', 'max_line_length', 200)
+
+
+def get_parallel_min_pages():
+    return get_param('conversion', 'parallel_min_pages', 80)
+
+
+def get_pages_per_range():
+    return get_param('conversion', 'pages_per_range', 40)
+
+
+def get_conversion_workers():
+    return get_param('conversion', 'max_workers', 2)
+
+
+def get_ingest_queue_size():
+    return get_param('ingest', 'queue_size', 4)
+
+
+def get_embed_batch_size():
+    return get_param('ingest', 'embed_batch_size', 64)
+
+
+def get_insert_batch_size():
+    return get_param('ingest', 'insert_batch_size', 256)
+
+
+def is_fast_path_enabled():
+    return get_param('routing', 'fast_path_enabled', True)
+
+
+def get_min_chars_per_page():
+    return get_param('routing', 'min_chars_per_page', 200)
+
+
+def get_max_images():
+    return get_param('routing', 'max_images', 0)
+
+
+def get_max_paths_per_page():
+    return get_param('routing', 'max_paths_per_page', 20)
+
+
+def get_docling_seconds_per_page():
+    return get_param('routing', 'docling_seconds_per_page', 1.5)
+
+
+def get_min_text_layer_chars():
+    return get_param('routing', 'min_text_layer_chars', 20)
+
+
+def get_processing_profiles():
+    return get_config().get('processing_profiles', {})
+
+
+def get_default_profile():
+    return get_param('profile_selection', 'default', 'balanced')
+
+
+def get_preload_profiles():
+    return get_param('profile_selection', 'preload', [get_default_profile()])
+
+
+def get_profile_size_rules():
+    return get_param('profile_selection', 'by_pages', [])
+
+
+def is_parse_cache_enabled():
+    return get_param('parse_cache', 'enabled', True)
+
+
+def get_parse_cache_dir():
+    return get_param('parse_cache', 'directory', 'database/parse_cache')
+
+
+def get_window_min_pages():
+    return get_param('memory', 'window_min_pages', 300)
+
+
+def get_window_pages():
+    return get_param('memory', 'window_pages', 50)
+
+
+def get_max_document_mb():
+    return get_param('memory', 'max_document_mb', 0)
+
+
+def get_memory_sample_interval():
+    return get_param('memory', 'sample_interval', 0.5)
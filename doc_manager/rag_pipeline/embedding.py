@@ -4,6 +4,24 @@ from chromadb.utils import embedding_functions
 from django.conf import settings 
 import uuid
 from .config import get_collection_name, get_embedding_model
+from .memory import model_loading
+
+# Funzione di embedding condivisa: il modello SentenceTransformer viene
+# caricato una sola volta per processo invece che ad ogni init_chromadb
+_embedding_function = None
+
+
+def get_embedding_function():
+    global _embedding_function
+    if _embedding_function is None:
+        with model_loading():
+            _embedding_function = embedding_functions.SentenceTransformerEmbeddingFunction(model_name=get_embedding_model())
+    return _embedding_function
+
+
+def embed_texts(texts):
+    """Calcola gli embedding di una lista di testi con il modello configurato."""
+    return get_embedding_function()(texts)
 
 
 def init_chromadb(collection_name=None):
@@ -18,9 +36,7 @@ def init_chromadb(collection_name=None):
     
     client = chromadb.PersistentClient(path=db_path)
     COLLECTION_NAME = get_collection_name()    
-    MODEL_NAME = get_embedding_model()
-    embedding_function = embedding_functions.SentenceTransformerEmbeddingFunction(model_name=MODEL_NAME)
-    collection = client.get_or_create_collection(name=COLLECTION_NAME, embedding_function=embedding_function)
+    collection = client.get_or_create_collection(name=COLLECTION_NAME, embedding_function=get_embedding_function())
         
     return collection
 
@@ -49,9 +65,41 @@ def clean_metadata(metadata):
     return cleaned
 
 
-def add_chunks_to_db(collection, chunks, document_pk: int):
+def ocr_chunk_id(document_pk: int, page: int, index: int) -> str:
+    """ID deterministico di un chunk OCR: documento, pagina e posizione nella pagina."""
+    return f"{document_pk}-ocr-p{page}-{index}"
+
+
+def native_chunk_id(document_pk: int, index: int) -> str:
+    """ID deterministico di un chunk nativo: documento e posizione nel documento."""
+    return f"{document_pk}-c{index}"
+
+
+def get_ocr_chunk_pages(collection, document_pk: int):
+    """
+    Pagine OCR del documento già presenti nella collection, ricavate dagli ID
+    deterministici dei chunk. Ritorna {pagina: numero di chunk}.
+    """
+    result = collection.get(where={"document_pk": str(document_pk)}, include=[])
+    prefix = f"{document_pk}-ocr-p"
+    pages = {}
+    for chunk_id in result["ids"]:
+        if chunk_id.startswith(prefix):
+            page = int(chunk_id[len(prefix):].split('-', 1)[0])
+            pages[page] = pages.get(page, 0) + 1
+    return pages
+
+
+def add_chunks_to_db(collection, chunks, document_pk: int, embeddings=None):
     """
     Aggiunge i chunk alla collection ChromaDB.
+    Se `embeddings` è fornito (già calcolato dalla pipeline di ingest)
+    ChromaDB non ricalcola gli embedding.
+    I chunk con un "id" deterministico (vedi native_chunk_id e ocr_chunk_id)
+    lo mantengono e vengono scritti con upsert, così reinserirli sovrascrive
+    testo ed embedding di quelli esistenti invece di duplicarli; gli altri
+    ricevono un UUID.
+    Ritorna (ID scritti, ID che non esistevano prima di questa chiamata).
     """
     documents = [c["content"] for c in chunks]
     metadatas_with_pk = []
@@ -64,20 +112,40 @@ def add_chunks_to_db(collection, chunks, document_pk: int):
         
         metadatas_with_pk.append(meta)
 
-    ids = [f"{uuid.uuid4()}" for _ in chunks]
-
-    try:
+    if not any(c.get("id") for c in chunks):
+        ids = [f"{uuid.uuid4()}" for _ in chunks]
         collection.add(
             documents=documents, 
             metadatas=metadatas_with_pk,
+            embeddings=embeddings,
             ids=ids
         )
-    except chromadb.errors.IDAlreadyExistsError:
-        collection.upsert(
-            documents=documents, 
-            metadatas=metadatas_with_pk,
-            ids=ids
-        )
+        return ids, ids
+
+    ids = [c.get("id") or f"{uuid.uuid4()}" for c in chunks]
+    # add() non segnala gli ID già presenti: quelli esistenti vanno letti prima dell'upsert
+    existing = set(collection.get(ids=ids, include=[])["ids"])
+    collection.upsert(
+        documents=documents, 
+        metadatas=metadatas_with_pk,
+        embeddings=embeddings,
+        ids=ids
+    )
+    return ids, [chunk_id for chunk_id in ids if chunk_id not in existing]
+
+
+def delete_stale_chunks(collection, document_pk: int, keep_ids):
+    """
+    Rimuove i chunk del documento che non sono in `keep_ids`: quelli rimasti
+    da un'indicizzazione precedente che aveva prodotto più chunk, o con gli
+    UUID usati prima degli ID deterministici. Ritorna il numero di chunk rimossi.
+    """
+    result = collection.get(where={"document_pk": str(document_pk)}, include=[])
+    keep = set(keep_ids)
+    stale = [chunk_id for chunk_id in result["ids"] if chunk_id not in keep]
+    if stale:
+        collection.delete(ids=stale)
+    return len(stale)
 
 
 def delete_document_embeddings(collection, document_pk: int): 
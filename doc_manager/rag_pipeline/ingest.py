@@ -0,0 +1,237 @@
+import queue
+import threading
+import time
+from .config import get_ingest_queue_size, get_embed_batch_size, get_insert_batch_size
+from .embedding import embed_texts, add_chunks_to_db
+
+# Marcatore di fine flusso inoltrato da una fase alla successiva
+_DONE = object()
+
+
+class StageStats:
+    """Contatori di una fase della pipeline di ingest."""
+
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.busy_seconds = 0.0
+
+    def as_dict(self, wall_seconds):
+        return {
+            'items': self.items,
+            'busy_seconds': round(self.busy_seconds, 3),
+            'items_per_second': round(self.items / self.busy_seconds, 2) if self.busy_seconds else None,
+            'utilization': round(self.busy_seconds / wall_seconds, 3) if wall_seconds else None,
+        }
+
+
+class IngestPipeline:
+    """
+    Pipeline di ingest a fasi concorrenti:
+        sorgente (conversione) -> chunking -> embedding a batch -> inserimento a batch
+
+    Ogni fase gira in un thread separato e le fasi sono collegate da code
+    limitate: quando una fase rallenta, quelle a monte si bloccano
+    (backpressure), così in memoria restano solo poche unità in volo
+    indipendentemente dalla dimensione del documento. Conversione Docling,
+    modello di embedding e ChromaDB rilasciano il GIL nelle parti pesanti,
+    quindi le fasi si sovrappongono realmente.
+
+    `chunk_fn(unit)` trasforma un'unità prodotta dalla sorgente (documento
+    Docling parziale o pagina OCR) in un iterabile di chunk.
+    Se viene passato un `memory_monitor`, la pipeline si interrompe appena
+    il monitor rileva il superamento del limite di memoria (anche durante la
+    conversione di un'unità) e la sorgente ne chiama check() prima di
+    produrre ogni unità; run() solleva MemoryLimitExceeded come per
+    qualsiasi altro errore.
+    Se viene passato `on_progress(chunks, units)`, la fase di inserimento lo
+    chiama dopo ogni batch con i chunk inseriti e le unità prodotte finora.
+    """
+
+    STAGES = ('source', 'chunk', 'embed', 'insert')
+
+    def __init__(self, collection, document_pk, chunk_fn, metadata=None,
+                 queue_size=None, embed_batch_size=None, insert_batch_size=None, memory_monitor=None,
+                 on_progress=None):
+        self.collection = collection
+        self.document_pk = document_pk
+        self.chunk_fn = chunk_fn
+        self.metadata = metadata or {}
+        self.queue_size = queue_size or get_ingest_queue_size()
+        self.embed_batch_size = embed_batch_size or get_embed_batch_size()
+        self.insert_batch_size = insert_batch_size or get_insert_batch_size()
+        self.memory_monitor = memory_monitor
+        self.on_progress = on_progress
+        if memory_monitor is not None:
+            memory_monitor.listeners.append(lambda error: self.abort('memory', error))
+
+        self.stats = {name: StageStats(name) for name in self.STAGES}
+        self.inserted_ids = []
+        # Chunk creati da questa esecuzione (non sovrascritti): gli unici da rimuovere in caso di errore
+        self.created_ids = []
+        self._abort = threading.Event()
+        self._errors = []
+
+    def abort(self, stage, error):
+        """Interrompe tutte le fasi: run() solleverà `error` (se è il primo errore registrato)."""
+        self._errors.append((stage, error))
+        self._abort.set()
+
+    # ---- code con backpressure, interrompibili in caso di errore ----
+
+    def _put(self, q, item):
+        while not self._abort.is_set():
+            try:
+                q.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q):
+        while not self._abort.is_set():
+            try:
+                return q.get(timeout=0.5)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    # ---- fasi ----
+
+    def _source_stage(self, units, out_q):
+        stats = self.stats['source']
+        iterator = iter(units)
+        while True:
+            if self.memory_monitor is not None:
+                self.memory_monitor.check()
+            start = time.perf_counter()
+            unit = next(iterator, _DONE)
+            stats.busy_seconds += time.perf_counter() - start
+            if unit is _DONE:
+                break
+            stats.items += 1
+            if not self._put(out_q, unit):
+                return
+        self._put(out_q, _DONE)
+
+    def _chunk_stage(self, in_q, out_q):
+        stats = self.stats['chunk']
+        batch = []
+        while True:
+            unit = self._get(in_q)
+            if unit is _DONE:
+                break
+            start = time.perf_counter()
+            for chunk in self.chunk_fn(unit):
+                chunk["metadata"].update(self.metadata)
+                batch.append(chunk)
+                if len(batch) >= self.embed_batch_size:
+                    stats.busy_seconds += time.perf_counter() - start
+                    stats.items += len(batch)
+                    if not self._put(out_q, batch):
+                        return
+                    batch = []
+                    start = time.perf_counter()
+            stats.busy_seconds += time.perf_counter() - start
+            # L'unità elaborata non serve più: liberiamo il riferimento prima di attendere la successiva
+            del unit
+
+        if batch:
+            stats.items += len(batch)
+            if not self._put(out_q, batch):
+                return
+        self._put(out_q, _DONE)
+
+    def _embed_stage(self, in_q, out_q):
+        stats = self.stats['embed']
+        while True:
+            batch = self._get(in_q)
+            if batch is _DONE:
+                break
+            start = time.perf_counter()
+            embeddings = embed_texts([c["content"] for c in batch])
+            stats.busy_seconds += time.perf_counter() - start
+            stats.items += len(batch)
+            if not self._put(out_q, (batch, list(embeddings))):
+                return
+        self._put(out_q, _DONE)
+
+    def _insert_stage(self, in_q):
+        stats = self.stats['insert']
+        chunks, embeddings = [], []
+
+        def insert():
+            start = time.perf_counter()
+            ids, created_ids = add_chunks_to_db(self.collection, chunks, self.document_pk, embeddings=embeddings)
+            self.inserted_ids.extend(ids)
+            self.created_ids.extend(created_ids)
+            stats.busy_seconds += time.perf_counter() - start
+            stats.items += len(chunks)
+            if self.on_progress is not None:
+                self.on_progress(len(self.inserted_ids), self.stats['source'].items)
+
+        while True:
+            item = self._get(in_q)
+            if item is _DONE:
+                break
+            chunks.extend(item[0])
+            embeddings.extend(item[1])
+            if len(chunks) >= self.insert_batch_size:
+                insert()
+                chunks, embeddings = [], []
+
+        if chunks and not self._abort.is_set():
+            insert()
+
+    def _start(self, name, target, *args):
+        def runner():
+            try:
+                target(*args)
+            except BaseException as e:
+                self.abort(name, e)
+
+        thread = threading.Thread(target=runner, name=f"ingest-{name}-{self.document_pk}", daemon=True)
+        thread.start()
+        return thread
+
+    def run(self, units):
+        """
+        Esegue la pipeline sulle unità prodotte da `units` (tipicamente un generatore
+        che converte il documento un intervallo di pagine alla volta).
+        Ritorna il report con throughput per fase; in caso di errore rimuove i
+        chunk creati da questa esecuzione (quelli già presenti, sovrascritti
+        con gli stessi ID, restano) e rilancia l'eccezione della fase che ha fallito.
+        """
+        chunk_q = queue.Queue(maxsize=self.queue_size)
+        embed_q = queue.Queue(maxsize=self.queue_size)
+        insert_q = queue.Queue(maxsize=self.queue_size)
+
+        start = time.perf_counter()
+        threads = [
+            self._start('source', self._source_stage, units, chunk_q),
+            self._start('chunk', self._chunk_stage, chunk_q, embed_q),
+            self._start('embed', self._embed_stage, embed_q, insert_q),
+            self._start('insert', self._insert_stage, insert_q),
+        ]
+        for thread in threads:
+            thread.join()
+        wall_seconds = time.perf_counter() - start
+
+        if self._errors:
+            stage, error = self._errors[0]
+            print(f"[RAG] Pipeline di ingest interrotta nella fase '{stage}': {error}")
+            if self.created_ids:
+                self.collection.delete(ids=self.created_ids)
+            self.inserted_ids, self.created_ids = [], []
+            raise error
+
+        report = {
+            'wall_seconds': round(wall_seconds, 3),
+            'chunks': self.stats['insert'].items,
+            'stages': {name: self.stats[name].as_dict(wall_seconds) for name in self.STAGES},
+        }
+        for name in self.STAGES:
+            stage = report['stages'][name]
+            print(f"[RAG] Fase {name:<6} {stage['items']:>6} elementi, "
+                  f"{stage['busy_seconds']:.2f}s attivi, {stage['items_per_second']} el/s")
+        return report
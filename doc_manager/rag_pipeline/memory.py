@@ -0,0 +1,228 @@
+import gc
+import os
+import threading
+from contextlib import contextmanager
+import psutil
+from .config import get_max_document_mb, get_memory_sample_interval
+
+# Memoria residente del processo con i modelli già caricati, misurata da
+# set_baseline() dopo il preload: i figli del prefork la ereditano con il fork
+_baseline_rss_mb = None
+# Memoria dei modelli caricati dopo il baseline (senza preload, o profili usati
+# per la prima volta): fa parte del baseline e non dei documenti
+_models_rss_mb = 0.0
+# Memoria fissa (interprete e modelli) dei processi di conversione figli, per pid,
+# comunicata dai figli stessi tramite _footprint_queue dopo ogni caricamento di modelli
+_child_footprints_mb = {}
+_footprint_queue = None
+_footprint_lock = threading.Lock()
+
+
+class MemoryLimitExceeded(Exception):
+    """La memoria del documento ha superato `memory.max_document_mb` oltre il baseline del worker."""
+
+
+def process_rss_mb() -> float:
+    """Memoria residente del solo processo corrente."""
+    return psutil.Process().memory_info().rss / (1024 * 1024)
+
+
+def track_child_footprints(queue):
+    """
+    Registra la coda su cui i processi di conversione figli comunicano la
+    propria memoria fissa (vedi report_footprint). Le impronte dei figli del
+    pool precedente vengono scartate.
+    """
+    global _footprint_queue
+    with _footprint_lock:
+        _footprint_queue = queue
+        _child_footprints_mb.clear()
+
+
+def report_footprint(queue):
+    """Nel processo figlio: comunica la memoria occupata dopo il caricamento dei modelli."""
+    queue.put((os.getpid(), process_rss_mb()))
+
+
+def _drain_footprints():
+    with _footprint_lock:
+        while _footprint_queue is not None and not _footprint_queue.empty():
+            pid, rss_mb = _footprint_queue.get()
+            _child_footprints_mb[pid] = rss_mb
+
+
+def current_rss_mb() -> float:
+    """
+    Memoria residente del processo e dei suoi figli (processi di conversione a
+    intervalli). Dei figli conta solo la memoria oltre la loro impronta fissa:
+    i modelli che ogni processo del pool carica non sono memoria del documento.
+    """
+    _drain_footprints()
+    process = psutil.Process()
+    rss = process.memory_info().rss
+    for child in process.children(recursive=True):
+        try:
+            child_rss = child.memory_info().rss
+        except psutil.Error:
+            # Figlio terminato tra l'elenco e la lettura
+            continue
+        footprint = _child_footprints_mb.get(child.pid, 0) * 1024 * 1024
+        rss += max(0, child_rss - footprint)
+    return rss / (1024 * 1024)
+
+
+def set_baseline():
+    """
+    Registra come baseline la memoria residente attuale: va chiamata dopo il
+    caricamento dei modelli. Le pagine dei modelli condivise copy-on-write con
+    il processo principale fanno parte dell'RSS di ogni figlio, ma sono nel
+    baseline e non vengono attribuite ai documenti.
+    """
+    global _baseline_rss_mb, _models_rss_mb
+    _baseline_rss_mb = current_rss_mb()
+    _models_rss_mb = 0.0
+    return _baseline_rss_mb
+
+
+def get_baseline():
+    """
+    Baseline del processo più i modelli caricati dopo la sua misura; se nessun
+    preload l'ha registrato, parte dalla memoria attuale.
+    """
+    if _baseline_rss_mb is None:
+        set_baseline()
+    return _baseline_rss_mb + _models_rss_mb
+
+
+@contextmanager
+def model_loading():
+    """
+    Attribuisce al baseline la memoria allocata dal processo durante il
+    caricamento di un modello, così un modello caricato al primo uso (senza
+    preload) non viene contato nel limite del documento in elaborazione.
+    """
+    global _models_rss_mb
+    before = process_rss_mb()
+    try:
+        yield
+    finally:
+        loaded = max(0.0, process_rss_mb() - before)
+        if _baseline_rss_mb is not None:
+            _models_rss_mb += loaded
+
+
+class MemoryMonitor:
+    """
+    Campiona la memoria residente del processo (e dei processi di
+    conversione figli) durante l'elaborazione di un documento, in un thread
+    separato, e ne registra il picco.
+    Il limite è relativo al baseline del worker: `max_document_mb` oltre la
+    memoria occupata dai modelli caricati, compresi quelli caricati al primo
+    uso e quelli dei processi di conversione figli. Il thread lo controlla ad ogni
+    campione, quindi anche durante una singola conversione: al superamento
+    registra MemoryLimitExceeded e chiama i `listeners` (la pipeline si
+    interrompe, i processi di conversione vengono terminati). check(),
+    chiamato tra un'unità e la successiva, solleva l'errore registrato o
+    quello rilevato sul momento.
+    """
+
+    def __init__(self, max_document_mb=None, interval=None):
+        self.max_document_mb = get_max_document_mb() if max_document_mb is None else max_document_mb
+        self.interval = interval or get_memory_sample_interval()
+        self.baseline_rss_mb = 0.0
+        self.start_rss_mb = 0.0
+        self.peak_rss_mb = 0.0
+        self.error = None
+        # Funzioni chiamate (dal thread del monitor) con l'errore al superamento del limite
+        self.listeners = []
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def limit_rss_mb(self):
+        return self.baseline_rss_mb + self.max_document_mb if self.max_document_mb else 0
+
+    def _sample(self):
+        rss = current_rss_mb()
+        self.peak_rss_mb = max(self.peak_rss_mb, rss)
+        return rss
+
+    def _over_limit(self):
+        """Errore se la memoria supera il limite anche dopo una garbage collection, altrimenti None."""
+        if not self.max_document_mb:
+            return None
+        # Modelli caricati durante il documento (primo uso di un profilo) spostano il baseline
+        self.baseline_rss_mb = get_baseline()
+        rss = self._sample()
+        if rss <= self.limit_rss_mb:
+            return None
+        # Prima di arrendersi liberiamo gli oggetti delle unità già elaborate
+        gc.collect()
+        rss = self._sample()
+        if rss <= self.limit_rss_mb:
+            return None
+        return MemoryLimitExceeded(
+            f"memoria residente {rss:.0f} MB oltre il limite di {self.limit_rss_mb:.0f} MB "
+            f"(baseline {self.baseline_rss_mb:.0f} MB + {self.max_document_mb} MB per documento)"
+        )
+
+    def _exceeded(self, error):
+        with self._lock:
+            if self.error is not None:
+                return
+            self.error = error
+        print(f"[RAG] Limite di memoria superato: {error}")
+        for listener in self.listeners:
+            try:
+                listener(error)
+            except Exception as e:
+                print(f"[RAG] ERRORE durante l'interruzione per memoria: {e}")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if self.error is not None:
+                self._sample()
+                continue
+            error = self._over_limit()
+            if error is not None:
+                self._exceeded(error)
+
+    def start(self):
+        self.baseline_rss_mb = get_baseline()
+        self.start_rss_mb = self.peak_rss_mb = current_rss_mb()
+        self._thread = threading.Thread(target=self._run, name="memory-monitor", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._sample()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+    def check(self):
+        """Solleva MemoryLimitExceeded se il limite è stato superato."""
+        if self.error is None:
+            error = self._over_limit()
+            if error is not None:
+                self._exceeded(error)
+        if self.error is not None:
+            raise self.error
+
+    def report(self):
+        return {
+            'baseline_rss_mb': round(self.baseline_rss_mb, 1),
+            'start_rss_mb': round(self.start_rss_mb, 1),
+            'peak_rss_mb': round(self.peak_rss_mb, 1),
+            'document_peak_mb': round(self.peak_rss_mb - self.start_rss_mb, 1),
+            'max_document_mb': self.max_document_mb,
+            'limit_exceeded': self.error is not None,
+        }
@@ -0,0 +1,167 @@
+import glob
+import gzip
+import hashlib
+import json
+import os
+import time
+from importlib import metadata
+from django.conf import settings
+from docling_core.types.doc import DoclingDocument
+from .config import is_parse_cache_enabled, get_parse_cache_dir, get_processing_profiles
+from .processing import iter_pdf_docs
+
+# Da incrementare quando cambia il formato dei file in cache
+CACHE_FORMAT = 1
+
+
+def file_sha256(filename: str) -> str:
+    """Hash SHA-256 del contenuto del file, letto a blocchi."""
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def converter_version(profile: str) -> str:
+    """
+    Identifica l'output della conversione: versione di Docling, profilo e
+    relative opzioni. Se uno di questi cambia, la cache precedente non vale più.
+    """
+    try:
+        docling_version = metadata.version('docling')
+    except metadata.PackageNotFoundError:
+        docling_version = 'unknown'
+    options = json.dumps(get_processing_profiles().get(profile, {}), sort_keys=True)
+    options_hash = hashlib.sha256(options.encode('utf-8')).hexdigest()[:12]
+    return f"v{CACHE_FORMAT}-docling{docling_version}-{profile}-{options_hash}"
+
+
+def parse_version(profile: str, skip_pages=()) -> str:
+    """
+    Versione del converter (vedi converter_version) più, per i PDF misti, le
+    pagine escluse dalla conversione: documenti parziali diversi non
+    condividono la stessa voce di cache.
+    """
+    version = converter_version(profile)
+    if skip_pages:
+        pages = ','.join(str(page) for page in sorted(skip_pages))
+        version += '-skip' + hashlib.sha256(pages.encode('utf-8')).hexdigest()[:12]
+    return version
+
+
+def cache_path(file_hash: str, version: str) -> str:
+    cache_dir = get_parse_cache_dir()
+    if not os.path.isabs(cache_dir):
+        cache_dir = os.path.join(settings.BASE_DIR, cache_dir)
+    return os.path.join(cache_dir, file_hash[:2], f"{file_hash}-{version}.jsonl.gz")
+
+
+def _file_entries(file_hash: str):
+    """Voci di cache (di qualsiasi versione) del file con questo hash."""
+    pattern = cache_path(file_hash, '*')
+    return glob.glob(os.path.join(glob.escape(os.path.dirname(pattern)), os.path.basename(pattern)))
+
+
+def evict_stale_entries(file_hash: str, keep: str):
+    """
+    Rimuove le voci dello stesso file diverse da `keep`: versioni precedenti
+    del converter, altri profili o altre pagine escluse. Vale l'ultima
+    conversione, quella che rechunk_documents riusa.
+    """
+    for path in _file_entries(file_hash):
+        if path != keep:
+            try:
+                os.remove(path)
+                print(f"[RAG] Voce di cache Docling superata rimossa ({os.path.basename(path)})")
+            except OSError:
+                # Rimossa nel frattempo da un altro processo
+                continue
+
+
+def delete_cached_parses(filename: str):
+    """Rimuove tutte le voci di cache del file (es. documento eliminato)."""
+    try:
+        file_hash = file_sha256(filename)
+    except OSError:
+        return
+    for path in _file_entries(file_hash):
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+
+
+def has_cached_parse(filename: str, profile: str, skip_pages=()) -> bool:
+    return os.path.exists(cache_path(file_sha256(filename), parse_version(profile, skip_pages)))
+
+
+def _load_docs(path: str):
+    """Legge i documenti Docling parziali salvati, uno per riga."""
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            yield DoclingDocument.model_validate(json.loads(line))
+
+
+def _convert_and_store(filename: str, profile: str, file_hash: str, path: str, stats, pages_per_range=None,
+                       skip_pages=()):
+    """
+    Converte il PDF con iter_pdf_docs e salva ogni documento parziale mentre
+    viene prodotto. Il file viene reso visibile solo a conversione completata,
+    quindi una conversione interrotta non lascia cache incomplete; a quel punto
+    le voci precedenti dello stesso file vengono rimosse.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    completed = False
+    try:
+        with gzip.open(tmp_path, 'wt', encoding='utf-8', compresslevel=6) as f:
+            for doc in iter_pdf_docs(filename, profile=profile, stats=stats, pages_per_range=pages_per_range,
+                                     skip_pages=skip_pages):
+                f.write(json.dumps(doc.export_to_dict(), ensure_ascii=False))
+                f.write('\n')
+                yield doc
+        os.replace(tmp_path, path)
+        completed = True
+    finally:
+        if not completed and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    evict_stale_entries(file_hash, keep=path)
+
+
+def cached_pdf_docs(filename: str, profile: str, stats=None, pages_per_range=None, skip_pages=()):
+    """
+    Come iter_pdf_docs, ma riusa i documenti Docling già convertiti per lo
+    stesso file (hash del contenuto), la stessa versione del converter e le
+    stesse pagine escluse.
+    Alla prima conversione i documenti vengono salvati come JSON compresso.
+    """
+    if not is_parse_cache_enabled():
+        yield from iter_pdf_docs(filename, profile=profile, stats=stats, pages_per_range=pages_per_range,
+                                 skip_pages=skip_pages)
+        return
+
+    file_hash = file_sha256(filename)
+    version = parse_version(profile, skip_pages)
+    path = cache_path(file_hash, version)
+    hit = os.path.exists(path)
+
+    if stats is not None:
+        stats['parse_cache'] = {'hit': hit, 'file_hash': file_hash, 'converter_version': version}
+
+    if not hit:
+        yield from _convert_and_store(filename, profile, file_hash, path, stats, pages_per_range, skip_pages)
+        return
+
+    print(f"[RAG] Documento Docling letto dalla cache ({os.path.basename(path)})")
+    load_time = 0.0
+    docs = _load_docs(path)
+    while True:
+        start = time.perf_counter()
+        doc = next(docs, None)
+        load_time += time.perf_counter() - start
+        if doc is None:
+            break
+        yield doc
+    if stats is not None:
+        stats['parse_cache']['load_seconds'] = round(load_time, 3)
@@ -0,0 +1,112 @@
+import pypdfium2 as pdfium
+import pypdfium2.raw as pdfium_c
+from .config import is_fast_path_enabled, get_min_chars_per_page, get_max_images, get_max_paths_per_page, get_min_text_layer_chars
+
+ROUTE_TEXT_LAYER = 'text_layer'
+ROUTE_DOCLING = 'docling'
+
+
+def _inspect_page(page):
+    """Conta caratteri del text layer, immagini e tracciati vettoriali di una pagina."""
+    textpage = page.get_textpage()
+    try:
+        chars = textpage.count_chars()
+    finally:
+        textpage.close()
+
+    images = paths = 0
+    for obj in page.get_objects(max_depth=2):
+        if obj.type == pdfium_c.FPDF_PAGEOBJ_IMAGE:
+            images += 1
+        elif obj.type == pdfium_c.FPDF_PAGEOBJ_PATH:
+            paths += 1
+    return chars, images, paths
+
+
+def inspect_pdf(source):
+    """
+    Analizza text layer e complessità di layout di un PDF senza caricare modelli.
+    `source` può essere un percorso, un oggetto bytes o un file binario.
+    Ritorna un dizionario con le statistiche per pagina e aggregate.
+    """
+    pdf = pdfium.PdfDocument(source)
+    try:
+        chars_per_page, images_per_page, paths_per_page = [], [], []
+        for index in range(len(pdf)):
+            page = pdf[index]
+            try:
+                chars, images, paths = _inspect_page(page)
+            finally:
+                page.close()
+            chars_per_page.append(chars)
+            images_per_page.append(images)
+            paths_per_page.append(paths)
+    finally:
+        pdf.close()
+
+    page_count = len(chars_per_page)
+    return {
+        'page_count': page_count,
+        'chars_per_page': chars_per_page,
+        'images_per_page': images_per_page,
+        'paths_per_page': paths_per_page,
+        'avg_chars_per_page': round(sum(chars_per_page) / page_count, 1) if page_count else 0,
+        'images': sum(images_per_page),
+        'max_paths_per_page': max(paths_per_page, default=0),
+    }
+
+
+def choose_route(report):
+    """
+    Decide il percorso di conversione di un PDF nativo a partire dal report di inspect_pdf.
+    I documenti solo testo (text layer denso, nessuna immagine, pochi tracciati
+    vettoriali che indicherebbero tabelle) vengono estratti direttamente dal
+    text layer; gli altri passano da Docling.
+    Ritorna (route, motivo).
+    """
+    if not is_fast_path_enabled():
+        return ROUTE_DOCLING, "fast path disabilitato"
+    if not report['page_count']:
+        return ROUTE_DOCLING, "nessuna pagina"
+    if report['avg_chars_per_page'] < get_min_chars_per_page():
+        return ROUTE_DOCLING, f"text layer scarso ({report['avg_chars_per_page']} caratteri/pagina)"
+    if report['images'] > get_max_images():
+        return ROUTE_DOCLING, f"{report['images']} immagini"
+    if report['max_paths_per_page'] > get_max_paths_per_page():
+        return ROUTE_DOCLING, f"possibili tabelle ({report['max_paths_per_page']} tracciati in una pagina)"
+    return ROUTE_TEXT_LAYER, "solo testo"
+
+
+def classify_text_layer(report):
+    """
+    Classifica il PDF in base al text layer di ogni pagina.
+    Ritorna (document_type, pagine da sottoporre a OCR):
+      - 'native': tutte le pagine hanno testo selezionabile
+      - 'scanned': nessuna pagina ha testo, OCR sull'intero documento
+      - 'mixed': solo le pagine senza testo (numerate da 1) vanno in OCR
+    """
+    min_chars = get_min_text_layer_chars()
+    ocr_pages = [index + 1 for index, chars in enumerate(report['chars_per_page']) if chars < min_chars]
+
+    if not ocr_pages:
+        return 'native', []
+    if len(ocr_pages) == report['page_count']:
+        return 'scanned', ocr_pages
+    return 'mixed', ocr_pages
+
+
+def detect_document_type(uploaded_file):
+    """
+    Rileva il tipo di un PDF caricato (UploadedFile di Django) analizzandone
+    il text layer pagina per pagina. Ritorna (document_type, pagine OCR, report).
+    """
+    if hasattr(uploaded_file, 'temporary_file_path'):
+        source = uploaded_file.temporary_file_path()
+    else:
+        uploaded_file.seek(0)
+        source = uploaded_file.read()
+    uploaded_file.seek(0)
+
+    report = inspect_pdf(source)
+    document_type, ocr_pages = classify_text_layer(report)
+    return document_type, ocr_pages, report
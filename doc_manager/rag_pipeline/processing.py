@@ -1,229 +1,545 @@
 from docling.document_converter import DocumentConverter, PdfFormatOption
-from docling.datamodel.pipeline_options import PdfPipelineOptions
+from docling.datamodel.pipeline_options import PdfPipelineOptions, TableStructureOptions, TableFormerMode
+from docling.datamodel.base_models import InputFormat
+from docling_core.types.doc import DoclingDocument
 from langchain_text_splitters import RecursiveCharacterTextSplitter
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import io
+import multiprocessing
+import os
+import pypdfium2 as pdfium
 import re
-from typing import List, Dict, Any
-from .config import get_chunk_size, get_chunk_overlap
+import threading
+import time
+from typing import List, Dict, Any, Tuple
+from .config import get_chunk_size, get_chunk_overlap, get_max_chunk_tokens, get_parallel_min_pages, get_pages_per_range, get_conversion_workers
+from .config import get_processing_profiles, get_default_profile, get_preload_profiles, get_profile_size_rules
+from .boilerplate import BoilerplateDetector, find_boilerplate_items, strip_boilerplate_pages
+from .memory import model_loading, report_footprint, track_child_footprints
+from .tokens import count_tokens, count_tokens_batch, num_special_tokens, split_by_tokens, SPLIT_SEPARATORS
 
 MAX_TEXT_CHUNK_SIZE = get_chunk_size()
 CHUNK_OVERLAP_SIZE = get_chunk_overlap()
+MAX_CHUNK_TOKENS = get_max_chunk_tokens()
 
+# Converter già inizializzati (modelli di layout e TableFormer caricati) per profilo,
+# riutilizzati da tutti i task eseguiti nello stesso processo worker
+_CONVERTERS = {}
+_CONVERTER_LOAD_TIMES = {}
+_CONVERTERS_LOCK = threading.Lock()
 
-LAST_CHUNK_CONTENT = "" 
+HEADING_PATTERN = re.compile(r'^#+\s+(.+)$', re.MULTILINE)
+HEADING_AT_PATTERN = re.compile(r'#+\s+(.+)$', re.MULTILINE)
+PAGE_SEPARATOR_PATTERN = re.compile(r'={60}\nPAGINA\s+(\d+)\n={60}')
+
+
+def _starts_line(text, chars):
+    """True se almeno una riga del testo inizia con uno dei caratteri indicati."""
+    return text.startswith(chars) or any('\n' + c in text for c in chars)
+
+
+# Pulizia del Markdown OCR: (controllo rapido, pattern precompilato, sostituzione),
+# applicate nell'ordine; il controllo evita la passata quando non può trovare nulla.
+# I pattern di inizio riga con un carattere fisso sono scritti come carattere +
+# lookbehind (equivalente a '^' in MULTILINE): iniziando con un letterale, il
+# motore regex salta direttamente alle occorrenze invece di provare ogni posizione.
+MARKDOWN_CLEANUP_PASSES = [
+    (lambda t: '#' in t, re.compile(r'#(?<![^\n]#)#{0,5}\s+'), ''),
+    (lambda t: '**' in t, re.compile(r'\*\*(.+?)\*\*'), r'\1'),
+    (lambda t: '__' in t, re.compile(r'__(.+?)__'), r'\1'),
+    (lambda t: '*' in t, re.compile(r'\*(.+?)\*'), r'\1'),
+    (lambda t: '_' in t, re.compile(r'_(.+?)_'), r'\1'),
+    (lambda t: '`' in t, re.compile(r'`(.+?)`'), r'\1'),
+    (lambda t: '](' in t, re.compile(r'\[(.+?)\]\(.+?\)'), r'\1'),
+    (lambda t: '![' in t, re.compile(r'!\[.*?\]\(.+?\)'), ''),
+    (lambda t: '```' in t, re.compile(r'```[\s\S]*?```'), ''),
+    (lambda t: _starts_line(t, ('-', '_', '*')), re.compile(r'^[\-_\*]{3,}$', re.MULTILINE), ''),
+    (lambda t: '>' in t, re.compile(r'>(?<![^\n]>)\s+'), ''),
+    (lambda t: _starts_line(t, ('-', '*', '+')), re.compile(r'^[\-\*\+]\s+', re.MULTILINE), ''),
+    (lambda t: '\n\n\n' in t, re.compile(r'\n{3,}'), '\n\n'),
+    (lambda t: '  ' in t, re.compile(r' {2,}'), ' '),
+]
+
+# Tipi di segmento prodotti dallo scanner del markdown OCR
+SEGMENT_TEXT = 'text'
+SEGMENT_HEADING = 'heading'
+SEGMENT_TABLE = 'table'
+
+# Pool di processi per la conversione parallela a intervalli di pagine,
+# mantenuto vivo tra i task così i processi figli riusano i propri converter
+_RANGE_POOL = None
+_RANGE_POOL_WORKERS = 0
+# Nei processi del pool: coda per comunicare al worker la memoria fissa del processo
+_RANGE_FOOTPRINTS = None
 
-def flush_text_buffer(buffer, page_num, all_chunks_list):
-    """Unisce il testo nel buffer e lo aggiunge come un unico chunk."""
-    global LAST_CHUNK_CONTENT
-    if buffer:
-        content = "\n".join(buffer)
-        all_chunks_list.append({
-            "content": content,
-            "metadata": {"page": page_num, "type": "text"}
-        })
-        LAST_CHUNK_CONTENT = content
-    buffer.clear()
 
-def add_overlap_to_buffer(buffer):
+class Chunker:
     """
-    Aggiunge una sezione del contenuto dell'ultimo chunk all'inizio del nuovo buffer
-    per creare l'overlap contestuale.
+    Chunker incrementale per documenti Docling.
+    Mantiene la lunghezza del buffer di testo in modo incrementale (niente
+    ricalcolo di "\n".join ad ogni elemento) e conserva lo stato dell'overlap
+    per istanza, così più documenti possono essere elaborati in parallelo
+    nello stesso processo (Celery con thread o gevent).
+    Con `max_tokens` il budget dei chunk di testo è misurato in token del
+    modello di embedding invece che in caratteri, e ogni chunk riporta il
+    proprio `token_count`.
+    I chunk vengono prodotti come generatore.
+    Un documento convertito a intervalli di pagine può essere passato
+    un'unità alla volta con feed()/feed_text_pages() seguiti da finish():
+    buffer, overlap e conteggi del boilerplate proseguono da un'unità alla
+    successiva, e il testo in sospeso viene emesso solo dopo l'ultima.
     """
-    global LAST_CHUNK_CONTENT
-    if LAST_CHUNK_CONTENT:
-        overlap_text = LAST_CHUNK_CONTENT[-CHUNK_OVERLAP_SIZE:]
-        buffer.append(overlap_text)
+
+    def __init__(self, max_chunk_size=MAX_TEXT_CHUNK_SIZE, overlap=CHUNK_OVERLAP_SIZE, strip_boilerplate=True,
+                 max_tokens=MAX_CHUNK_TOKENS):
+        self.max_chunk_size = max_chunk_size
+        self.overlap = overlap
+        self.strip_boilerplate = strip_boilerplate
+        self.max_tokens = max_tokens
+        self._buffer = []
+        # Lunghezza di "\n".join(self._buffer), aggiornata ad ogni append
+        self._buffer_length = 0
+        # Token del testo nel buffer (solo con budget in token)
+        self._buffer_tokens = 0
+        self._last_chunk_content = ""
+        self._current_page = 1
+        self._boilerplate = BoilerplateDetector()
+
+    def reset(self):
+        """Azzera lo stato prima di un nuovo documento."""
+        self._buffer, self._buffer_length, self._buffer_tokens = [], 0, 0
+        self._last_chunk_content = ""
+        self._current_page = 1
+        self._boilerplate = BoilerplateDetector()
+
+    @property
+    def token_budget(self):
+        """Token disponibili per il testo di un chunk, esclusi i token speciali del modello."""
+        return max(1, self.max_tokens - num_special_tokens())
+
+    def _append(self, text, tokens=None):
+        if self._buffer:
+            self._buffer_length += 1
+        self._buffer_length += len(text)
+        self._buffer.append(text)
+        if self.max_tokens:
+            self._buffer_tokens += count_tokens(text) if tokens is None else tokens
+
+    def _metadata(self, page_num, chunk_type, content, tokens=None):
+        metadata = {"page": page_num, "type": chunk_type}
+        if self.max_tokens:
+            metadata["token_count"] = (count_tokens(content) if tokens is None else tokens) + num_special_tokens()
+        return metadata
+
+    def flush(self, page_num):
+        """Unisce il testo nel buffer e lo emette come un unico chunk."""
+        if self._buffer:
+            content = "\n".join(self._buffer)
+            self._last_chunk_content = content
+            yield {
+                "content": content,
+                "metadata": self._metadata(page_num, "text", content, self._buffer_tokens)
+            }
+        self._buffer = []
+        self._buffer_length = 0
+        self._buffer_tokens = 0
+
+    def _add_overlap(self):
+        """
+        Aggiunge una sezione del contenuto dell'ultimo chunk all'inizio del nuovo buffer
+        per creare l'overlap contestuale.
+        """
+        if self._last_chunk_content:
+            self._append(self._last_chunk_content[-self.overlap:])
+
+    def push_text(self, text, page_num):
+        """Aggiunge un blocco di testo, emettendo un chunk quando il buffer è pieno."""
+        if self.max_tokens:
+            yield from self._push_text_tokens(text, page_num)
+            return
+        if self._buffer_length + len(text) + 1 > self.max_chunk_size:
+            yield from self.flush(page_num)
+            self._add_overlap()
+        self._append(text)
+
+    def _push_text_tokens(self, text, page_num):
+        """Variante di push_text con il budget misurato in token."""
+        budget = self.token_budget
+        tokens = count_tokens(text)
+
+        if tokens > budget:
+            # Un blocco che da solo supera il budget viene diviso sui confini dei token
+            yield from self.flush(page_num)
+            for piece in split_by_tokens(text, self.max_tokens, self.overlap):
+                self._append(piece)
+                yield from self.flush(page_num)
+            return
+
+        if self._buffer_tokens + tokens > budget:
+            yield from self.flush(page_num)
+            self._add_overlap()
+            if self._buffer_tokens + tokens > budget:
+                # L'overlap non deve far superare il budget al nuovo blocco
+                self._buffer, self._buffer_length, self._buffer_tokens = [], 0, 0
+        self._append(text, tokens)
+
+    def push_block(self, content, page_num, chunk_type, extra_metadata=None, tokens=None):
+        """
+        Emette un chunk autonomo (tabella, immagine) interrompendo il flusso di
+        testo. `tokens` evita di ricontare un blocco già misurato.
+        """
+        yield from self.flush(page_num)
+        self._last_chunk_content = ""
+        metadata = self._metadata(page_num, chunk_type, content, tokens)
+        if extra_metadata:
+            metadata.update(extra_metadata)
+        yield {
+            "content": content,
+            "metadata": metadata
+        }
+
+    def iter_chunks(self, doc, stats=None):
+        """
+        Converte un documento Docling in chunk logici:
+        - testo (TEXT, LIST, SECTION_HEADER)
+        - tabelle 
+        - immagini 
+        `doc` può essere anche una lista di documenti parziali (intervalli di pagine
+        consecutivi dello stesso PDF), trattati come un unico documento.
+        Le righe ripetute su più pagine (intestazioni, piè di pagina) vengono scartate;
+        se viene passato il dizionario `stats` vi si registrano i caratteri risparmiati.
+        """
+        self.reset()
+        yield from self.feed(doc, stats=stats)
+        yield from self.finish()
+
+    def feed(self, doc, stats=None):
+        """
+        Come iter_chunks per un'unità del documento (uno o più documenti
+        parziali), senza emettere il testo rimasto nel buffer: l'unità
+        successiva lo prosegue. Dopo l'ultima unità va chiamato finish().
+        """
+        docs = doc if isinstance(doc, (list, tuple)) else [doc]
+
+        item_maps = [
+            {item.self_ref: item for item in (d.texts + d.tables + d.pictures)}
+            for d in docs
+        ]
+
+        skip_items, saved_chars = set(), 0
+        if self.strip_boilerplate:
+            skip_items, saved_chars = find_boilerplate_items(docs, item_maps, self._boilerplate)
+        if saved_chars:
+            print(f"[RAG] Boilerplate rimosso: {len(skip_items)} elementi, {saved_chars} caratteri")
+        if stats is not None:
+            stats['boilerplate_chars_removed'] = stats.get('boilerplate_chars_removed', 0) + saved_chars
+
+        for index, (d, item_map) in enumerate(zip(docs, item_maps)):
+            for ref_item in d.body.children:
+                cref = ref_item.cref
+                if cref not in item_map or (index, cref) in skip_items:
+                    continue
+                item = item_map[cref]
+
+                if item.prov:
+                    self._current_page = item.prov[0].page_no
+                current_page = self._current_page
+
+                item_type = item.label.name
+
+                if item_type in ['TEXT', 'SECTION_HEADER', 'LIST']:
+                    yield from self.push_text(item.text, current_page)
+
+                elif item_type == 'TABLE':
+                    for table_md, row_range, tokens in iter_table_chunks(item.data, current_page, self.max_chunk_size, self.max_tokens):
+                        yield from self.push_block(table_md, current_page, "table", row_range, tokens)
+
+                elif item_type == 'PICTURE':
+                    desc = "Immagine rilevata (nessuna didascalia trovata)"
+                    if item.captions:
+                        caption_texts = []
+                        for ref in item.captions:
+                            if ref.cref in item_map:
+                                caption_texts.append(item_map[ref.cref].text)
+                        if caption_texts:
+                            desc = "\n".join(caption_texts)
+                    img_summary = f"Riferimento a immagine (Pagina {current_page}). Didascalia: '{desc}'"
+                    yield from self.push_block(img_summary, current_page, "image")
+
+    def finish(self):
+        """Emette il testo ancora nel buffer, dopo l'ultima unità del documento."""
+        yield from self.flush(self._current_page)
+
+    def iter_text_pages(self, pages, stats=None):
+        """
+        Genera i chunk dal testo estratto direttamente dal text layer
+        ({numero pagina: testo}), con lo stesso schema dei chunk Docling.
+        """
+        self.reset()
+        yield from self.feed_text_pages(pages, stats=stats)
+        yield from self.finish()
+
+    def feed_text_pages(self, pages, stats=None):
+        """Come feed() per una finestra di pagine del text layer ({numero pagina: testo})."""
+        if self.strip_boilerplate:
+            pages, saved_chars = strip_boilerplate_pages(pages, self._boilerplate)
+            if stats is not None:
+                stats['boilerplate_chars_removed'] = stats.get('boilerplate_chars_removed', 0) + saved_chars
+
+        for current_page, page_text in pages.items():
+            self._current_page = current_page
+            for line in page_text.split("\n"):
+                line = line.strip()
+                if line:
+                    yield from self.push_text(line, current_page)
+
+
+def table_markdown_lines(table_data):
+    """Righe Markdown di una tabella Docling: ([intestazione, separatore], righe dati)."""
+    grid = table_data.grid
+    header = [
+        "| " + " | ".join(cell.text for cell in grid[0]) + " |",
+        "| " + " | ".join(["---"] * len(grid[0])) + " |",
+    ]
+    rows = ["| " + " | ".join(cell.text for cell in row) + " |" for row in grid[1:]]
+    return header, rows
+
 
 def convert_table_to_markdown(table_data, page_num: int) -> str:
     """
     Converte i dati della tabella Docling in una stringa Markdown.
     """
-    grid = table_data.grid
-    if not grid:
+    if not table_data.grid:
         return f"Tabella vuota a pagina {page_num}"
 
-    markdown = ""
-    markdown += "| " + " | ".join(cell.text for cell in grid[0]) + " |\n"
-    markdown += "| " + " | ".join(["---"] * len(grid[0])) + " |\n"
-    for row in grid[1:]:
-        markdown += "| " + " | ".join(cell.text for cell in row) + " |\n"
+    header, rows = table_markdown_lines(table_data)
+    return "\n".join(header + rows) + "\n"
 
-    return markdown
 
-def create_chunks(doc):
+def split_table_rows(header: List[str], rows: List[str], max_chunk_size=MAX_TEXT_CHUNK_SIZE,
+                     max_tokens=MAX_CHUNK_TOKENS) -> List[tuple]:
     """
-    Converte un documento Docling in chunk logici:
-    - testo (TEXT, LIST, SECTION_HEADER)
-    - tabelle 
-    - immagini 
+    Raggruppa le righe di una tabella Markdown in blocchi che rispettano il budget
+    dei chunk (token se `max_tokens`, altrimenti caratteri), ripetendo
+    l'intestazione in ogni blocco. Una riga che da sola supera il budget forma
+    un blocco a sé.
+    Ritorna una lista di (prima riga, ultima riga, righe del blocco, dimensione),
+    con le righe dati numerate da 1; la dimensione è nell'unità del budget
+    (token compresi quelli speciali, o caratteri), sommata riga per riga.
     """
-    global LAST_CHUNK_CONTENT
-    all_chunks, text_buffer, current_page = [], [], 1
-    LAST_CHUNK_CONTENT = "" 
+    if max_tokens:
+        budget = max_tokens
+        header_size = sum(count_tokens_batch(header)) + num_special_tokens()
+        row_sizes = count_tokens_batch(rows)
+    else:
+        budget = max_chunk_size
+        header_size = sum(len(line) + 1 for line in header)
+        row_sizes = [len(row) + 1 for row in rows]
 
-    item_map = {item.self_ref: item for item in (doc.texts + doc.tables + doc.pictures)}
+    groups = []
+    group_start, size = 0, header_size
+    for index, row_size in enumerate(row_sizes):
+        if index > group_start and size + row_size > budget:
+            groups.append((group_start, index, size))
+            group_start, size = index, header_size
+        size += row_size
+    groups.append((group_start, len(rows), size))
 
-    for ref_item in doc.body.children:
-        cref = ref_item.cref
-        if cref not in item_map:
-            continue  
-        item = item_map[cref]
+    return [(start + 1, end, header + rows[start:end], size) for start, end, size in groups]
 
-        if item.prov:
-            current_page = item.prov[0].page_no
 
-        item_type = item.label.name
+def _row_range_metadata(first_row, last_row, total_rows):
+    return {"row_start": first_row, "row_end": last_row, "table_rows": total_rows}
 
-        if item_type in ['TEXT', 'SECTION_HEADER', 'LIST']:
-            new_text = item.text
-            
-            current_buffer_length = len("\n".join(text_buffer)) if text_buffer else 0
-            new_line_length = len(new_text) + 1
-
-            if current_buffer_length + new_line_length > MAX_TEXT_CHUNK_SIZE:
-                flush_text_buffer(text_buffer, current_page, all_chunks)
-
-                add_overlap_to_buffer(text_buffer)
-                text_buffer.append(new_text)
-            else:
-                text_buffer.append(new_text)
-
-        elif item_type == 'TABLE':
-            flush_text_buffer(text_buffer, current_page, all_chunks)
-            LAST_CHUNK_CONTENT = ""
-            table_md = convert_table_to_markdown(item.data, current_page)
-            all_chunks.append({
-                "content": table_md,
-                "metadata": {"page": current_page, "type": "table"}
-            })
-
-        elif item_type == 'PICTURE':
-            flush_text_buffer(text_buffer, current_page, all_chunks)
-            LAST_CHUNK_CONTENT = ""
-            desc = "Immagine rilevata (nessuna didascalia trovata)"
-            if item.captions:
-                caption_texts = []
-                for ref in item.captions:
-                    if ref.cref in item_map:
-                        caption_texts.append(item_map[ref.cref].text)
-                if caption_texts:
-                    desc = "\n".join(caption_texts)
-            img_summary = f"Riferimento a immagine (Pagina {current_page}). Didascalia: '{desc}'"
-            all_chunks.append({
-                "content": img_summary,
-                "metadata": {"page": current_page, "type": "image"}
-            })
-
-    flush_text_buffer(text_buffer, current_page, all_chunks)
-    return all_chunks
-
-
-def create_chunks_scannedpdf(text, title, chunk_size=MAX_TEXT_CHUNK_SIZE, overlap=CHUNK_OVERLAP_SIZE):
+
+def _token_count_metadata(size, max_tokens):
+    """token_count di un gruppo già misurato da split_table_rows (solo con il budget in token)."""
+    return {"token_count": size} if max_tokens else {}
+
+
+def _group_tokens(size, max_tokens):
+    """Token (senza quelli speciali) di un gruppo già misurato da split_table_rows, o None se misurato in caratteri."""
+    return size - num_special_tokens() if max_tokens else None
+
+
+def iter_table_chunks(table_data, page_num: int, max_chunk_size=MAX_TEXT_CHUNK_SIZE, max_tokens=MAX_CHUNK_TOKENS):
+    """
+    Genera (markdown, metadata aggiuntivi, token) per una tabella Docling. Le
+    tabelle che superano il budget vengono divise in gruppi di righe con
+    l'intestazione ripetuta; ogni gruppo riporta l'intervallo di righe che
+    contiene. I token (senza quelli speciali) sono quelli già misurati per la
+    divisione, None se non sono stati contati.
+    """
+    if not table_data.grid:
+        yield f"Tabella vuota a pagina {page_num}", {}, None
+        return
+
+    header, rows = table_markdown_lines(table_data)
+    table_md = "\n".join(header + rows) + "\n"
+    if not max_tokens and len(table_md) <= max_chunk_size:
+        yield table_md, {}, None
+        return
+
+    groups = split_table_rows(header, rows, max_chunk_size, max_tokens)
+    if len(groups) == 1:
+        yield table_md, {}, _group_tokens(groups[0][3], max_tokens)
+        return
+
+    for first_row, last_row, lines, size in groups:
+        yield "\n".join(lines) + "\n", _row_range_metadata(first_row, last_row, len(rows)), _group_tokens(size, max_tokens)
+
+
+def split_markdown_table(table: str, max_chunk_size=MAX_TEXT_CHUNK_SIZE, max_tokens=MAX_CHUNK_TOKENS):
+    """
+    Divide una tabella Markdown già testuale (output OCR) in gruppi di righe,
+    come iter_table_chunks. L'intestazione è la prima riga, più la riga di
+    separazione ('|---|') se presente.
+    Ritorna una lista di (markdown, metadata aggiuntivi); con `max_tokens` i
+    metadata riportano anche il token_count misurato per la divisione.
+    """
+    if not max_tokens and len(table) <= max_chunk_size:
+        return [(table, {})]
+
+    lines = table.split('\n')
+    header_length = 2 if len(lines) > 1 and not lines[1].strip(' |-:') else 1
+    header, rows = lines[:header_length], lines[header_length:]
+
+    groups = split_table_rows(header, rows, max_chunk_size, max_tokens)
+    if len(groups) == 1:
+        return [(table, _token_count_metadata(groups[0][3], max_tokens))]
+    return [
+        ("\n".join(group_lines), {**_row_range_metadata(first_row, last_row, len(rows)), **_token_count_metadata(size, max_tokens)})
+        for first_row, last_row, group_lines, size in groups
+    ]
+
+
+def create_chunks(doc, stats=None, max_tokens=MAX_CHUNK_TOKENS):
+    """
+    Converte un documento Docling (o la lista dei documenti parziali prodotti
+    da convert_pdf_to_docs) nella lista completa dei chunk.
+    Per elaborare i chunk man mano che vengono prodotti usare Chunker.iter_chunks.
+    """
+    return list(Chunker(max_tokens=max_tokens).iter_chunks(doc, stats=stats))
+
+
+def split_ocr_pages(text: str) -> Dict[int, str]:
+    """Divide il testo OCR nelle pagine delimitate dai separatori del server GPU."""
+    return _split_by_pages(text, PAGE_SEPARATOR_PATTERN)
+
+
+def iter_ocr_page_windows(text: str, window_pages: int):
+    """
+    Divide il testo OCR in finestre di `window_pages` pagine ({numero pagina: testo}),
+    scorrendo i separatori senza costruire il dizionario di tutte le pagine.
+    """
+    window = {}
+    previous = None
+    for match in PAGE_SEPARATOR_PATTERN.finditer(text):
+        if previous is not None:
+            window[int(previous.group(1))] = text[previous.end():match.start()].strip()
+            if len(window) >= window_pages:
+                yield window
+                window = {}
+        previous = match
+
+    if previous is None:
+        window[1] = text
+    else:
+        window[int(previous.group(1))] = text[previous.end():].strip()
+    yield window
+
+
+def create_chunks_scannedpdf(text, title, chunk_size=MAX_TEXT_CHUNK_SIZE, overlap=CHUNK_OVERLAP_SIZE, stats=None,
+                             max_tokens=MAX_CHUNK_TOKENS):
     """
     Crea chunks da testo OCR
     """
-    chunks = []
-    
-    heading_pattern = re.compile(r'^#+\s+(.+)$', re.MULTILINE)
-    page_separator_pattern = re.compile(r'={60}\nPAGINA\s+(\d+)\n={60}')
-    pages = _split_by_pages(text, page_separator_pattern)
-    
-    for page_num, page_content in pages.items():
-        table_ranges = _find_tables(page_content)
-        
-        # Processa contenuto della pagina
-        last_pos = 0
-        current_heading = None
-        
-        for table_start, table_end, table_content in table_ranges:
-            if last_pos < table_start:
-                text_section = page_content[last_pos:table_start].strip()
-                if text_section:
-                    heading_match = heading_pattern.search(text_section)
-                    if heading_match:
-                        current_heading = heading_match.group(1)
-                    
-                    # Pulisci Markdown dal testo
-                    cleaned_text = _clean_markdown(text_section)
-                    
-                    if len(cleaned_text) <= chunk_size:
-                        chunks.append({
-                            "content": cleaned_text,
-                            "metadata": {
-                                "page": page_num,
-                                "type": "text",
-                                "chunk_type": "text",
-                                "source_title": title,
-                                "heading": current_heading
-                            }
-                        })
-                    else:
-                        text_chunks = _split_long_text(cleaned_text, chunk_size, overlap)
-                        for i, chunk_text in enumerate(text_chunks):
-                            chunks.append({
-                                "content": chunk_text,
-                                "metadata": {
-                                    "page": page_num,
-                                    "type": "text",
-                                    "chunk_type": "text",
-                                    "source_title": title,
-                                    "heading": current_heading,
-                                    "chunk_index": i,
-                                    "is_continuation": i > 0
-                                }
-                            })
-            
-            chunks.append({
-                "content": table_content,
-                "metadata": {
+    pages = split_ocr_pages(text)
+
+    pages, saved_chars = strip_boilerplate_pages(pages)
+    if saved_chars:
+        print(f"[RAG] Boilerplate OCR rimosso: {saved_chars} caratteri")
+    if stats is not None:
+        stats['boilerplate_chars_removed'] = saved_chars
+
+    return list(iter_ocr_page_chunks(pages, title, chunk_size, overlap, max_tokens))
+
+
+def _ocr_text_chunks(cleaned_text, page_num, title, heading, chunk_size, overlap, max_tokens=MAX_CHUNK_TOKENS):
+    """
+    Genera i chunk di una sezione di testo OCR già ripulita dal Markdown.
+    Con `max_tokens` la sezione viene divisa secondo il budget in token e
+    ogni chunk riporta il proprio token_count.
+    """
+    if max_tokens:
+        token_count = count_tokens(cleaned_text) + num_special_tokens()
+        fits = token_count <= max_tokens
+    else:
+        fits = len(cleaned_text) <= chunk_size
+
+    if fits:
+        metadata = {
+            "page": page_num,
+            "type": "text",
+            "chunk_type": "text",
+            "source_title": title,
+            "heading": heading
+        }
+        if max_tokens:
+            metadata["token_count"] = token_count
+        yield {"content": cleaned_text, "metadata": metadata}
+        return
+
+    text_chunks = _split_long_text(cleaned_text, chunk_size, overlap, max_tokens=max_tokens)
+    token_counts = count_tokens_batch(text_chunks) if max_tokens else []
+    for i, chunk_text in enumerate(text_chunks):
+        metadata = {
+            "page": page_num,
+            "type": "text",
+            "chunk_type": "text",
+            "source_title": title,
+            "heading": heading,
+            "chunk_index": i,
+            "is_continuation": i > 0
+        }
+        if max_tokens:
+            metadata["token_count"] = token_counts[i] + num_special_tokens()
+        yield {"content": chunk_text, "metadata": metadata}
+
+
+def iter_ocr_page_chunks(pages: Dict[int, str], title, chunk_size=MAX_TEXT_CHUNK_SIZE, overlap=CHUNK_OVERLAP_SIZE,
+                         max_tokens=MAX_CHUNK_TOKENS):
+    """
+    Genera i chunk di un insieme di pagine OCR ({numero pagina: testo markdown}).
+    Il titolo corrente vale fino al titolo successivo nella stessa pagina.
+    """
+    current_page = None
+    current_heading = None
+
+    for page_num, kind, content in iter_ocr_segments(pages):
+        if page_num != current_page:
+            current_page = page_num
+            current_heading = None
+
+        if kind == SEGMENT_HEADING:
+            current_heading = content
+        elif kind == SEGMENT_TEXT:
+            # Pulisci Markdown dal testo
+            cleaned_text = _clean_markdown(content)
+            yield from _ocr_text_chunks(cleaned_text, page_num, title, current_heading, chunk_size, overlap, max_tokens)
+        else:
+            for table_md, row_range in split_markdown_table(content, chunk_size, max_tokens):
+                metadata = {
                     "page": page_num,
                     "type": "table",
                     "chunk_type": "table",
                     "source_title": title,
                     "context_heading": current_heading
                 }
-            })
-            
-            last_pos = table_end
-        
-        if last_pos < len(page_content):
-            remaining_text = page_content[last_pos:].strip()
-            if remaining_text:
-                heading_match = heading_pattern.search(remaining_text)
-                if heading_match:
-                    current_heading = heading_match.group(1)
-                
-                cleaned_text = _clean_markdown(remaining_text)
-                
-                if len(cleaned_text) <= chunk_size:
-                    chunks.append({
-                        "content": cleaned_text,
-                        "metadata": {
-                            "page": page_num,
-                            "type": "text",
-                            "chunk_type": "text",
-                            "source_title": title,
-                            "heading": current_heading
-                        }
-                    })
-                else:
-                    text_chunks = _split_long_text(cleaned_text, chunk_size, overlap)
-                    for i, chunk_text in enumerate(text_chunks):
-                        chunks.append({
-                            "content": chunk_text,
-                            "metadata": {
-                                "page": page_num,
-                                "type": "text",
-                                "chunk_type": "text",
-                                "source_title": title,
-                                "heading": current_heading,
-                                "chunk_index": i,
-                                "is_continuation": i > 0
-                            }
-                        })
-    
-    text_chunks = sum(1 for c in chunks if c['metadata']['type'] == 'text')
-    
-    return chunks
+                metadata.update(row_range)
+                yield {"content": table_md, "metadata": metadata}
 
 
 def _split_by_pages(text: str, page_pattern) -> Dict[int, str]:
@@ -244,64 +560,104 @@ def _split_by_pages(text: str, page_pattern) -> Dict[int, str]:
     return pages
 
 
-def _find_tables(text: str) -> List[tuple]:
-    """Trova tutte le tabelle nel testo e ritorna (start, end, content)"""
-    tables = []
-    lines = text.split('\n')
-    
-    in_table = False
-    table_start_line = 0
-    table_lines = []
-    
-    for i, line in enumerate(lines):
-        if '|' in line:
-            if not in_table:
-                in_table = True
-                table_start_line = i
-                table_lines = [line]
-            else:
-                table_lines.append(line)
-        else:
-            if in_table:
-                table_content = '\n'.join(table_lines)
-                start_pos = sum(len(l) + 1 for l in lines[:table_start_line])
-                end_pos = start_pos + len(table_content)
-                tables.append((start_pos, end_pos, table_content))
-                
-                in_table = False
-                table_lines = []
-    
-    if in_table and table_lines:
-        table_content = '\n'.join(table_lines)
-        start_pos = sum(len(l) + 1 for l in lines[:table_start_line])
-        end_pos = start_pos + len(table_content)
-        tables.append((start_pos, end_pos, table_content))
-    
-    return tables
+def _strip_bounds(text: str, start: int, end: int) -> Tuple[int, int]:
+    """Equivalente di text[start:end].strip() espresso come offset, senza copie."""
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return start, end
+
+
+def _first_heading(text: str, start: int, end: int):
+    """Primo titolo Markdown nella sezione text[start:end] (già priva di spazi ai bordi)."""
+    if text.find('#', start, end) == -1:
+        return None
+    # '^' non corrisponde all'offset iniziale se non segue un a capo: la prima riga va provata a parte
+    match = HEADING_AT_PATTERN.match(text, start, end) or HEADING_PATTERN.search(text, start, end)
+    return match.group(1) if match else None
+
+
+def _iter_table_spans(text: str):
+    """
+    Individua le tabelle (righe consecutive contenenti '|') come intervalli
+    (inizio, fine) di offset. Il testo tra una tabella e l'altra viene saltato
+    con str.find, quindi il costo è lineare e proporzionale alle righe di tabella.
+    """
+    length = len(text)
+    pos = text.find('|')
+    while pos != -1:
+        start = text.rfind('\n', 0, pos) + 1
+        end = text.find('\n', pos)
+        if end == -1:
+            end = length
+        # Estende la tabella finché anche la riga successiva contiene '|'
+        while end < length:
+            next_end = text.find('\n', end + 1)
+            if next_end == -1:
+                next_end = length
+            if text.find('|', end + 1, next_end) == -1:
+                break
+            end = next_end
+        yield start, end
+        pos = text.find('|', end)
+
+
+def iter_page_segments(text: str):
+    """
+    Divide il markdown OCR di una pagina in segmenti (tipo, contenuto) con una
+    sola scansione, lavorando sugli offset invece che su copie del testo:
+      - SEGMENT_HEADING: primo titolo della sezione di testo che segue
+      - SEGMENT_TEXT: testo tra due tabelle, senza spazi ai bordi
+      - SEGMENT_TABLE: righe consecutive che contengono '|'
+    """
+    last_pos = 0
+    for table_start, table_end in _iter_table_spans(text):
+        yield from _text_segments(text, last_pos, table_start)
+        yield SEGMENT_TABLE, text[table_start:table_end]
+        last_pos = table_end
+    yield from _text_segments(text, last_pos, len(text))
+
+
+def _text_segments(text: str, start: int, end: int):
+    start, end = _strip_bounds(text, start, end)
+    if start == end:
+        return
+    heading = _first_heading(text, start, end)
+    if heading is not None:
+        yield SEGMENT_HEADING, heading
+    yield SEGMENT_TEXT, text[start:end]
+
+
+def iter_ocr_segments(pages: Dict[int, str]):
+    """Genera i segmenti (pagina, tipo, contenuto) di tutte le pagine OCR, in ordine."""
+    for page_num, page_content in pages.items():
+        for kind, content in iter_page_segments(page_content):
+            yield page_num, kind, content
 
 
 def _clean_markdown(text: str) -> str:
-    """Rimuove formattazione Markdown dal testo"""
-    text = re.sub(r'^#{1,6}\s+', '', text, flags=re.MULTILINE) 
-    text = re.sub(r'\*\*(.+?)\*\*', r'\1', text)
-    text = re.sub(r'__(.+?)__', r'\1', text)  
-    text = re.sub(r'\*(.+?)\*', r'\1', text)
-    text = re.sub(r'_(.+?)_', r'\1', text)
-    text = re.sub(r'`(.+?)`', r'\1', text)  
-    text = re.sub(r'\[(.+?)\]\(.+?\)', r'\1', text) 
-    text = re.sub(r'!\[.*?\]\(.+?\)', '', text)
-    text = re.sub(r'```[\s\S]*?```', '', text)
-    text = re.sub(r'^[\-_\*]{3,}$', '', text, flags=re.MULTILINE)
-    text = re.sub(r'^>\s+', '', text, flags=re.MULTILINE)
-    text = re.sub(r'^[\-\*\+]\s+', '', text, flags=re.MULTILINE)
-    text = re.sub(r'\n{3,}', '\n\n', text)
-    text = re.sub(r' {2,}', ' ', text)
-    
+    """
+    Rimuove formattazione Markdown dal testo.
+    Le sostituzioni di MARKDOWN_CLEANUP_PASSES dipendono dall'ordine (ad es.
+    '**' prima di '*'), quindi restano passate distinte: ognuna viene saltata
+    se il testo non contiene i caratteri che potrebbe trasformare.
+    """
+    for guard, pattern, replacement in MARKDOWN_CLEANUP_PASSES:
+        if guard(text):
+            text = pattern.sub(replacement, text)
+
     return text.strip()
 
 
-def _split_long_text(text: str, chunk_size: int, overlap: int) -> List[str]:
-    """Divide testo lungo in chunk con overlap intelligente"""
+def _split_long_text(text: str, chunk_size: int, overlap: int, max_tokens: int = 0) -> List[str]:
+    """
+    Divide testo lungo in chunk con overlap intelligente.
+    Con `max_tokens` il limite è il budget in token del modello di embedding.
+    """
+    if max_tokens:
+        return split_by_tokens(text, max_tokens, overlap)
+
     chunks = []
     start = 0
     text_length = len(text)
@@ -310,7 +666,7 @@ def _split_long_text(text: str, chunk_size: int, overlap: int) -> List[str]:
         end = start + chunk_size
         
         if end < text_length:
-            separators = ['\n\n', '\n', '. ', '。', '! ', '? ', ' ']
+            separators = SPLIT_SEPARATORS
             search_start = max(start + chunk_size - 100, start)
             search_end = min(end + 100, text_length)
             search_text = text[search_start:search_end]
@@ -336,16 +692,353 @@ def _split_long_text(text: str, chunk_size: int, overlap: int) -> List[str]:
     return chunks
 
 
-def convert_pdf_to_doc(filename: str):
+def build_pipeline_options(profile):
+    """
+    Costruisce le PdfPipelineOptions di Docling a partire da un profilo di
+    `processing_profiles` in rag_config.yaml.
+    """
+    profiles = get_processing_profiles()
+    if profile not in profiles:
+        raise ValueError(f"Profilo di elaborazione sconosciuto: '{profile}'")
+    profile_options = profiles[profile]
+
+    table_mode = TableFormerMode.FAST if profile_options.get('table_mode') == 'fast' else TableFormerMode.ACCURATE
+    return PdfPipelineOptions(
+        do_table_structure=profile_options.get('table_structure', True),
+        table_structure_options=TableStructureOptions(mode=table_mode),
+        generate_picture_images=profile_options.get('generate_picture_images', False),
+        do_ocr=profile_options.get('do_ocr', False),
+        images_scale=profile_options.get('images_scale', 1.0),
+    )
+
+
+def select_profile(page_count: int) -> str:
+    """
+    Sceglie il profilo in base al numero di pagine secondo `profile_selection.by_pages`
+    (prima regola con max_pages soddisfatta; una regola senza max_pages vale sempre).
+    """
+    for rule in get_profile_size_rules():
+        max_pages = rule.get('max_pages')
+        if max_pages is None or page_count <= max_pages:
+            return rule['profile']
+    return get_default_profile()
+
+
+def get_converter(profile=None):
+    """
+    Restituisce il DocumentConverter del profilo richiesto, creandolo e
+    caricandone i modelli alla prima richiesta nel processo corrente.
+    Ritorna (converter, secondi spesi a caricare i modelli in questa chiamata).
+    """
+    profile = profile or get_default_profile()
+    converter = _CONVERTERS.get(profile)
+    if converter is not None:
+        return converter, 0.0
+
+    with _CONVERTERS_LOCK:
+        converter = _CONVERTERS.get(profile)
+        if converter is not None:
+            return converter, 0.0
+
+        start = time.perf_counter()
+        with model_loading():
+            options = build_pipeline_options(profile)
+            pdf_format = PdfFormatOption(pipeline_options=options)
+            converter = DocumentConverter(format_options={InputFormat.PDF: pdf_format})
+            # Carica subito i modelli invece di farlo alla prima conversione
+            converter.initialize_pipeline(InputFormat.PDF)
+        load_time = time.perf_counter() - start
+
+        _CONVERTERS[profile] = converter
+        _CONVERTER_LOAD_TIMES[profile] = load_time
+        print(f"[RAG] Converter Docling '{profile}' inizializzato in {load_time:.2f}s")
+        return converter, load_time
+
+
+def warmup_converters(profiles=None):
+    """
+    Inizializza i converter dei profili indicati (se None quelli elencati in
+    `profile_selection.preload`). Chiamata all'avvio di ogni processo worker Celery.
+    """
+    for profile in (profiles or get_preload_profiles()):
+        get_converter(profile)
+    return dict(_CONVERTER_LOAD_TIMES)
+
+
+def convert_pdf_to_doc(filename: str, profile=None, stats=None):
     """
     Converte un PDF in documento Docling pronto per l'elaborazione.
-    Imposta le opzioni della pipeline:
-      - riconoscimento delle tabelle
-      - estrazione delle immagini
+    Il converter (con i modelli già caricati) viene riutilizzato tra le chiamate;
+    se viene passato `stats` vi si registrano separatamente il tempo di
+    caricamento dei modelli e quello di conversione.
     """
-    options = PdfPipelineOptions(do_table_structure=True, generate_picture_images=True)
-    pdf_format = PdfFormatOption(pipeline_options=options)
-    converter = DocumentConverter(format_options={"pdf": pdf_format})
+    converter, load_time = get_converter(profile)
     print(f"Inizio analisi strutturata di: {filename}")
+    start = time.perf_counter()
     result = converter.convert(filename)
-    return result.document
\ No newline at end of file
+    conversion_time = time.perf_counter() - start
+    print(f"[RAG] Conversione completata in {conversion_time:.2f}s (caricamento modelli: {load_time:.2f}s)")
+
+    if stats is not None:
+        stats['model_load_seconds'] = round(stats.get('model_load_seconds', 0) + load_time, 3)
+        stats['conversion_seconds'] = round(stats.get('conversion_seconds', 0) + conversion_time, 3)
+    return result.document
+
+
+def extract_text_pages(filename: str, stats=None) -> Dict[int, str]:
+    """
+    Estrae il testo dal text layer del PDF pagina per pagina, senza modelli
+    di layout: percorso veloce per i documenti nativi solo testo.
+    """
+    start = time.perf_counter()
+    pages = {}
+    pdf = pdfium.PdfDocument(filename)
+    try:
+        for index in range(len(pdf)):
+            page = pdf[index]
+            textpage = page.get_textpage()
+            try:
+                pages[index + 1] = textpage.get_text_bounded().replace("\r\n", "\n").replace("\r", "\n")
+            finally:
+                textpage.close()
+                page.close()
+    finally:
+        pdf.close()
+
+    if stats is not None:
+        stats['page_count'] = len(pages)
+        stats['conversion_seconds'] = round(time.perf_counter() - start, 3)
+    return pages
+
+
+def iter_text_page_windows(filename: str, window_pages: int, stats=None):
+    """
+    Come extract_text_pages, ma produce il testo a finestre di `window_pages`
+    pagine ({numero pagina: testo}), senza tenere in memoria l'intero documento.
+    """
+    start = time.perf_counter()
+    page_count = 0
+    window = {}
+    pdf = pdfium.PdfDocument(filename)
+    try:
+        for index in range(len(pdf)):
+            page = pdf[index]
+            textpage = page.get_textpage()
+            try:
+                window[index + 1] = textpage.get_text_bounded().replace("\r\n", "\n").replace("\r", "\n")
+            finally:
+                textpage.close()
+                page.close()
+            page_count += 1
+            if len(window) >= window_pages:
+                yield window
+                window = {}
+        if window:
+            yield window
+    finally:
+        pdf.close()
+
+    if stats is not None:
+        stats['page_count'] = page_count
+        stats['conversion_seconds'] = round(time.perf_counter() - start, 3)
+
+
+def build_pdf_subset(filename: str, pages: List[int]):
+    """
+    Crea in memoria un PDF con le sole pagine indicate (numerate da 1),
+    nell'ordine dato. Usato per inviare all'OCR solo le pagine senza testo.
+    """
+    source = pdfium.PdfDocument(filename)
+    subset = pdfium.PdfDocument.new()
+    try:
+        subset.import_pages(source, pages=[page - 1 for page in pages])
+        buffer = io.BytesIO()
+        subset.save(buffer)
+    finally:
+        subset.close()
+        source.close()
+    buffer.seek(0)
+    return buffer
+
+
+def get_pdf_page_count(filename: str) -> int:
+    """Conta le pagine del PDF senza caricare i modelli Docling."""
+    pdf = pdfium.PdfDocument(filename)
+    try:
+        return len(pdf)
+    finally:
+        pdf.close()
+
+
+def _page_ranges(page_count: int, pages_per_range: int, skip_pages=()):
+    """
+    Divide le pagine 1..page_count in intervalli (inizio, fine) inclusivi di al
+    più `pages_per_range` pagine. Le pagine in `skip_pages` restano fuori: ogni
+    intervallo contiene solo pagine consecutive da convertire.
+    """
+    skip_pages = set(skip_pages)
+    ranges = []
+    for page in range(1, page_count + 1):
+        if page in skip_pages:
+            continue
+        if ranges and ranges[-1][1] == page - 1 and page - ranges[-1][0] < pages_per_range:
+            ranges[-1] = (ranges[-1][0], page)
+        else:
+            ranges.append((page, page))
+    return ranges
+
+
+def _ensure_absolute_pages(doc, first_page: int):
+    """
+    Garantisce che i numeri di pagina del documento parziale siano relativi
+    all'intero PDF e non all'intervallo convertito.
+    """
+    pages = [prov.page_no for item in (doc.texts + doc.tables + doc.pictures) for prov in item.prov]
+    offset = first_page - min(pages) if pages and min(pages) < first_page else 0
+    if offset:
+        for item in doc.texts + doc.tables + doc.pictures:
+            for prov in item.prov:
+                prov.page_no += offset
+    return doc
+
+
+def _init_range_worker(footprints):
+    """Inizializza un processo del pool: la coda riceve la sua memoria fissa dopo ogni caricamento di modelli."""
+    global _RANGE_FOOTPRINTS
+    _RANGE_FOOTPRINTS = footprints
+
+
+def _convert_page_range(filename: str, profile: str, page_range):
+    """
+    Converte un intervallo di pagine in un processo figlio.
+    Il documento viene restituito come dict per un trasferimento sicuro tra processi.
+    """
+    converter, load_time = get_converter(profile)
+    if load_time and _RANGE_FOOTPRINTS is not None:
+        # I modelli del figlio non sono memoria del documento (vedi memory.current_rss_mb)
+        report_footprint(_RANGE_FOOTPRINTS)
+    start = time.perf_counter()
+    result = converter.convert(filename, page_range=page_range)
+    return result.document.export_to_dict(), load_time, time.perf_counter() - start
+
+
+def _get_range_pool(max_workers: int):
+    global _RANGE_POOL, _RANGE_POOL_WORKERS
+    # Un pool rotto (processo figlio terminato, es. per OOM) non accetta più lavoro: va ricreato
+    broken = _RANGE_POOL is not None and getattr(_RANGE_POOL, '_broken', False)
+    if _RANGE_POOL is None or _RANGE_POOL_WORKERS != max_workers or broken:
+        if _RANGE_POOL is not None:
+            _RANGE_POOL.shutdown(wait=False)
+        # 'spawn': i figli non ereditano lo stato (thread, connessioni) del worker Celery
+        context = multiprocessing.get_context('spawn')
+        footprints = context.SimpleQueue()
+        track_child_footprints(footprints)
+        _RANGE_POOL = ProcessPoolExecutor(max_workers=max_workers, mp_context=context,
+                                          initializer=_init_range_worker, initargs=(footprints,))
+        _RANGE_POOL_WORKERS = max_workers
+    return _RANGE_POOL
+
+
+def _reset_range_pool(pool):
+    """Scarta il pool di conversione, se è ancora quello in uso: il prossimo documento ne crea uno nuovo."""
+    global _RANGE_POOL, _RANGE_POOL_WORKERS
+    if pool is not None and _RANGE_POOL is pool:
+        _RANGE_POOL = None
+        _RANGE_POOL_WORKERS = 0
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def terminate_range_pool():
+    """
+    Termina subito i processi del pool di conversione (es. limite di memoria
+    superato durante una conversione): l'intervallo in corso fallisce con
+    BrokenProcessPool e il pool viene ricreato al documento successivo.
+    """
+    pool = _RANGE_POOL
+    if pool is None:
+        return
+    for process in list((getattr(pool, '_processes', None) or {}).values()):
+        process.kill()
+    _reset_range_pool(pool)
+
+
+def iter_pdf_docs(filename: str, profile=None, stats=None, pages_per_range=None, skip_pages=()):
+    """
+    Converte un PDF producendo, in ordine di pagina, documenti Docling parziali.
+    I PDF piccoli vengono convertiti in un'unica chiamata; quelli con almeno
+    `conversion.parallel_min_pages` pagine vengono divisi in intervalli
+    convertiti in parallelo da un pool di processi (o in sequenza se il pool
+    non è disponibile). Ogni intervallo viene restituito appena pronto, così
+    le fasi successive possono iniziare prima della fine della conversione;
+    al massimo un intervallo per processo è in conversione o in attesa di
+    essere consumato, quindi la memoria resta limitata anche se la pipeline
+    a valle è più lenta.
+    I documenti parziali mantengono i numeri di pagina del PDF originale.
+    `pages_per_range` sostituisce `conversion.pages_per_range` (modalità a finestre).
+    Le pagine in `skip_pages` (quelle inviate all'OCR nei PDF misti) non
+    vengono convertite: si convertono solo gli intervalli di pagine native.
+    """
+    page_count = get_pdf_page_count(filename)
+    max_workers = get_conversion_workers() or os.cpu_count() or 1
+    ranges = _page_ranges(page_count, pages_per_range or get_pages_per_range(), skip_pages)
+    parallel = page_count >= get_parallel_min_pages() and len(ranges) >= 2
+
+    if stats is not None:
+        stats['page_count'] = page_count
+
+    if not parallel and not skip_pages:
+        yield convert_pdf_to_doc(filename, profile=profile, stats=stats)
+        return
+
+    workers = min(max_workers, len(ranges)) if parallel else 1
+    start = time.perf_counter()
+    pending = None
+    if workers >= 2:
+        try:
+            pool = _get_range_pool(workers)
+            pending = deque(pool.submit(_convert_page_range, filename, profile, page_range) for page_range in ranges[:workers])
+            print(f"[RAG] Conversione parallela di {page_count} pagine in {len(ranges)} intervalli su {workers} processi")
+        except AssertionError:
+            # I processi daemon (pool prefork di Celery) non possono creare figli
+            print("[RAG] Conversione parallela non disponibile in questo worker, conversione sequenziale")
+
+    load_time = cpu_time = 0.0
+    for index, page_range in enumerate(ranges):
+        if pending is not None:
+            try:
+                doc_dict, range_load, range_cpu = pending.popleft().result()
+                if index + workers < len(ranges):
+                    pending.append(pool.submit(_convert_page_range, filename, profile, ranges[index + workers]))
+            except BrokenProcessPool:
+                print("[RAG] Processo di conversione terminato: il pool verrà ricreato al prossimo documento")
+                _reset_range_pool(pool)
+                raise
+            doc = DoclingDocument.model_validate(doc_dict)
+            del doc_dict
+            load_time = max(load_time, range_load)
+        else:
+            converter, range_load = get_converter(profile)
+            range_start = time.perf_counter()
+            doc = converter.convert(filename, page_range=page_range).document
+            range_cpu = time.perf_counter() - range_start
+            load_time += range_load
+        cpu_time += range_cpu
+        yield _ensure_absolute_pages(doc, page_range[0])
+
+    wall_time = time.perf_counter() - start
+    print(f"[RAG] Conversione a intervalli completata in {wall_time:.2f}s")
+
+    if stats is not None:
+        stats['model_load_seconds'] = round(stats.get('model_load_seconds', 0) + load_time, 3)
+        stats['conversion_seconds'] = round(stats.get('conversion_seconds', 0) + wall_time, 3)
+        stats['conversion_cpu_seconds'] = round(cpu_time, 3)
+        stats['conversion_ranges'] = len(ranges)
+        stats['conversion_workers'] = workers if pending is not None else 1
+
+
+def convert_pdf_to_docs(filename: str, profile=None, stats=None):
+    """
+    Converte un PDF nella lista completa dei documenti Docling parziali
+    (vedi iter_pdf_docs), pronta per create_chunks.
+    """
+    return list(iter_pdf_docs(filename, profile=profile, stats=stats))
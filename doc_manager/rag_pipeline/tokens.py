@@ -0,0 +1,91 @@
+import threading
+from bisect import bisect_left
+from typing import List
+from .config import get_embedding_model
+from .memory import model_loading
+
+# Separatori preferiti per spezzare il testo, in ordine di priorità
+SPLIT_SEPARATORS = ['\n\n', '\n', '. ', '。', '! ', '? ', ' ']
+
+# Tokenizer del modello di embedding, caricato una sola volta per processo
+_tokenizer = None
+_tokenizer_lock = threading.Lock()
+
+
+def get_tokenizer():
+    """
+    Restituisce il tokenizer (fast) del modello di embedding configurato,
+    lo stesso che SentenceTransformer usa per troncare l'input.
+    """
+    global _tokenizer
+    if _tokenizer is None:
+        with _tokenizer_lock:
+            if _tokenizer is None:
+                from transformers import AutoTokenizer
+                model_name = get_embedding_model()
+                if '/' not in model_name:
+                    model_name = f"sentence-transformers/{model_name}"
+                with model_loading():
+                    _tokenizer = AutoTokenizer.from_pretrained(model_name, use_fast=True)
+    return _tokenizer
+
+
+def num_special_tokens() -> int:
+    """Token aggiunti dal modello ad ogni input ([CLS]/[SEP] o <s>/</s>)."""
+    return get_tokenizer().num_special_tokens_to_add()
+
+
+def count_tokens(text: str) -> int:
+    """Numero di token del testo, senza token speciali."""
+    return len(get_tokenizer()(text, add_special_tokens=False, verbose=False)['input_ids'])
+
+
+def count_tokens_batch(texts: List[str]) -> List[int]:
+    """Come count_tokens ma con una sola chiamata al tokenizer per tutta la lista."""
+    if not texts:
+        return []
+    encoded = get_tokenizer()(list(texts), add_special_tokens=False, verbose=False)
+    return [len(ids) for ids in encoded['input_ids']]
+
+
+def split_by_tokens(text: str, max_tokens: int, overlap: int) -> List[str]:
+    """
+    Divide il testo in parti di al massimo `max_tokens` token (inclusi i token
+    speciali), tokenizzando il testo una sola volta e tagliando preferibilmente
+    su un separatore nella seconda metà della finestra.
+    `overlap` è espresso in caratteri, come nella divisione a caratteri.
+    """
+    offsets = get_tokenizer()(text, add_special_tokens=False, return_offsets_mapping=True, verbose=False)['offset_mapping']
+    token_starts = [token_start for token_start, _ in offsets]
+    budget = max(1, max_tokens - num_special_tokens())
+
+    chunks = []
+    start = 0
+    while start < len(text):
+        first = bisect_left(token_starts, start)
+        last = first + budget
+        if last >= len(offsets):
+            chunk = text[start:].strip()
+            if chunk:
+                chunks.append(chunk)
+            break
+
+        # Primo token che non entra nel budget
+        end = token_starts[last]
+        search_start = start + (end - start) // 2
+        for separator in SPLIT_SEPARATORS:
+            position = text.rfind(separator, search_start, end)
+            if position != -1:
+                end = position + len(separator)
+                break
+
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+
+        # Il chunk successivo riparte da un confine di token, sempre più avanti del precedente
+        next_token = bisect_left(token_starts, end - overlap)
+        next_start = token_starts[next_token] if next_token < len(token_starts) else end
+        start = next_start if next_start > start else end
+
+    return chunks
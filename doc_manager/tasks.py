@@ -1,26 +1,258 @@
-from celery import shared_task
-from django.shortcuts import get_object_or_404
+from celery import shared_task, group
+from celery.signals import worker_init, worker_process_init
 from django.conf import settings
+from django.db import connection
 from django.utils import timezone
+import gc
+import hashlib
 import os
+import json
+import threading
+import time
+import uuid
 import requests
-from .models import Document
-from .rag_pipeline.processing import convert_pdf_to_doc, create_chunks, create_chunks_scannedpdf
-from .rag_pipeline.embedding import init_chromadb, add_chunks_to_db
+from collections import Counter, defaultdict, deque
+from contextlib import contextmanager
+from datetime import timedelta
+from itertools import chain, count
+from .models import Document, BulkIngestJob
+from .bulk import create_documents, cleanup_staging, refresh_job_progress
+from .leases import DocumentLease, TASK_LEASE_TTL
+from .progress import publish_documents, publish_stage
+from .ocr_client import get_ocr_client, request_not_sent, OcrServerUnavailable, OcrUploadError, RETRY_STATUS_CODES
+from .rag_pipeline.processing import (
+    Chunker, select_profile, extract_text_pages, iter_text_page_windows, split_ocr_pages, iter_ocr_page_windows,
+    iter_ocr_page_chunks, warmup_converters, build_pdf_subset, get_pdf_page_count, terminate_range_pool
+)
+from .rag_pipeline.preflight import inspect_pdf, choose_route, ROUTE_TEXT_LAYER
+from .rag_pipeline.config import get_docling_seconds_per_page, get_window_min_pages, get_window_pages
+from .rag_pipeline.boilerplate import BoilerplateDetector, strip_boilerplate_pages
+from .rag_pipeline.parse_cache import cached_pdf_docs
+from .rag_pipeline.embedding import (
+    init_chromadb, ocr_chunk_id, native_chunk_id, get_ocr_chunk_pages, delete_stale_chunks, get_embedding_function
+)
+from .rag_pipeline.tokens import get_tokenizer
+from .rag_pipeline.ingest import IngestPipeline
+from .rag_pipeline.memory import MemoryMonitor, set_baseline
 
 COLLECTION_NAME = "docseek_collection"
-GPU_SERVER_URL = getattr(settings, 'GPU_SERVER_URL', 'http://localhost:8000')
-OCR_TIMEOUT = getattr(settings, 'OCR_REQUEST_TIMEOUT', 300)
+PRELOAD_CONVERTERS = getattr(settings, 'DOCLING_PRELOAD_CONVERTERS', True)
+RAG_WORKER_TORCH_THREADS = getattr(settings, 'RAG_WORKER_TORCH_THREADS', 0)
+OCR_CALLBACK_URL = getattr(settings, 'OCR_CALLBACK_URL', '')
+OCR_STALE_AFTER = getattr(settings, 'OCR_STALE_AFTER', 300)
+OCR_MAX_IDLE = getattr(settings, 'OCR_MAX_IDLE', 3600)
+OCR_DISPATCH_MAX_DEFERRALS = getattr(settings, 'OCR_DISPATCH_MAX_DEFERRALS', 60)
+OCR_BATCH_ENABLED = getattr(settings, 'OCR_BATCH_ENABLED', True)
+OCR_BATCH_WINDOW = getattr(settings, 'OCR_BATCH_WINDOW', 10)
+OCR_BATCH_MAX_FILES = getattr(settings, 'OCR_BATCH_MAX_FILES', 16)
+OCR_BATCH_MAX_BYTES = getattr(settings, 'OCR_BATCH_MAX_BYTES', 64 * 1024 * 1024)
+OCR_STATUS_BATCH_SIZE = getattr(settings, 'OCR_STATUS_BATCH_SIZE', 100)
+OCR_CLAIM_HEARTBEAT = getattr(settings, 'OCR_CLAIM_HEARTBEAT', 60)
+OCR_INCREMENTAL_INDEXING = getattr(settings, 'OCR_INCREMENTAL_INDEXING', True)
+OCR_UPLOAD_CHUNKED_MIN_BYTES = getattr(settings, 'OCR_UPLOAD_CHUNKED_MIN_BYTES', 16 * 1024 * 1024)
+BULK_INGEST_MAX_CONCURRENCY = getattr(settings, 'BULK_INGEST_MAX_CONCURRENCY', 16)
+BULK_INGEST_DISPATCH_INTERVAL = getattr(settings, 'BULK_INGEST_DISPATCH_INTERVAL', 15)
+INGEST_SMALL_MAX_PAGES = getattr(settings, 'INGEST_SMALL_MAX_PAGES', 20)
+INGEST_LARGE_MIN_PAGES = getattr(settings, 'INGEST_LARGE_MIN_PAGES', 200)
+INGEST_SMALL_MAX_BYTES = getattr(settings, 'INGEST_SMALL_MAX_BYTES', 2 * 1024 * 1024)
+INGEST_LARGE_MIN_BYTES = getattr(settings, 'INGEST_LARGE_MIN_BYTES', 50 * 1024 * 1024)
+INGEST_QUEUE_SLOTS = getattr(settings, 'INGEST_QUEUE_SLOTS', {'small': 4, 'medium': 2, 'large': 1})
+INGEST_MAX_PER_UPLOADER = getattr(settings, 'INGEST_MAX_PER_UPLOADER', 0)
+PROGRESS_MIN_INTERVAL = getattr(settings, 'PROGRESS_MIN_INTERVAL', 1.0)
+# Oltre la durata del lease il task è stato terminato (time limit, worker
+# caduto): il documento non occupa più il posto e il suo lease è già scaduto
+INDEXING_STALE_AFTER = TASK_LEASE_TTL
+INDEXING_MAX_INTERRUPTIONS = getattr(settings, 'INDEXING_MAX_INTERRUPTIONS', 1)
 
-@shared_task
-def process_scanned_document(document_pk):
+# Stati in cui il documento attende il risultato del server GPU
+# ('partially_indexed': OCR in corso, le pagine già arrivate sono ricercabili)
+OCR_ACTIVE_STATES = ['ocr_queued', 'ocr_processing', 'partially_indexed']
+
+# Stati in cui il documento è già in elaborazione: non va accodato di nuovo
+IN_PROGRESS_STATES = OCR_ACTIVE_STATES + ['rag_queued', 'rag_processing']
+
+# Prefisso di ocr_task_id per i documenti presi in carico da un invio batch in corso
+OCR_CLAIM_PREFIX = 'claim:'
+
+# Unità finale aggiunta alla sorgente nativa: chiude il Chunker del documento
+_END_OF_UNITS = object()
+
+# Code di indicizzazione per classe di dimensione del documento
+INGEST_QUEUES = {'small': 'rag_small', 'medium': 'rag_medium', 'large': 'rag_large'}
+
+# Code dei task che usano i modelli: solo i worker che ne consumano almeno una
+# li caricano all'avvio
+RAG_QUEUES = ['default'] + list(INGEST_QUEUES.values())
+
+
+def preload_models():
+    """
+    Carica nel processo corrente converter Docling, modello di embedding e
+    tokenizer. Ritorna i tempi di caricamento in secondi.
+    """
+    load_times = {profile: round(seconds, 3) for profile, seconds in warmup_converters().items()}
+    start = time.perf_counter()
+    get_embedding_function()
+    get_tokenizer()
+    load_times['embedding'] = round(time.perf_counter() - start, 3)
+    # Il garbage collector non esamina più gli oggetti caricati: nei processi
+    # figli le pagine dei modelli non vengono riscritte e restano condivise
+    gc.freeze()
+    # Il limite di memoria dei documenti si misura da qui (modelli inclusi)
+    set_baseline()
+    return load_times
+
+
+def _consumes_queues(worker, queues):
+    """True se il worker consuma almeno una delle code (senza -Q le consuma tutte)."""
+    consume_from = getattr(getattr(worker.app.amqp, 'queues', None), 'consume_from', None)
+    return not consume_from or any(queue in consume_from for queue in queues)
+
+
+@worker_init.connect
+def preload_worker_models(sender=None, **kwargs):
+    """
+    Carica i modelli nel processo principale del worker, prima dell'avvio del
+    pool: con il pool prefork i processi figli li ereditano con il fork e ne
+    condividono la memoria copy-on-write invece di caricarne ciascuno una
+    copia, e un figlio riavviato (--max-tasks-per-child) è subito pronto.
+    I worker che non consumano RAG_QUEUES (es. quello OCR) non caricano nulla.
+    """
+    if not PRELOAD_CONVERTERS or (sender is not None and not _consumes_queues(sender, RAG_QUEUES)):
+        return
+    try:
+        print(f"[RAG] Modelli pronti nel processo principale del worker: {preload_models()}")
+    except Exception as e:
+        # Il worker resta utilizzabile: i modelli verranno caricati al primo task
+        print(f"[RAG] ERRORE durante il preload dei modelli: {e}")
+
+
+@worker_process_init.connect
+def limit_worker_process_threads(**kwargs):
+    """
+    Processo figlio del prefork: i modelli sono già in memoria, si limita
+    solo il numero di thread di torch perché i figli non si contendano gli
+    stessi core.
+    """
+    if RAG_WORKER_TORCH_THREADS:
+        import torch
+        torch.set_num_threads(RAG_WORKER_TORCH_THREADS)
+
+
+def _ocr_upload(doc_instance):
+    """File da inviare all'OCR: per i PDF misti solo le pagine senza text layer."""
+    if doc_instance.document_type == 'mixed' and doc_instance.ocr_pages:
+        print(f"[OCR] Invio delle sole {len(doc_instance.ocr_pages)} pagine senza text layer di {doc_instance.title}")
+        return build_pdf_subset(doc_instance.file.path, doc_instance.ocr_pages)
+    return open(doc_instance.file.path, 'rb')
+
+
+def _upload_resumable(client, doc_instance):
+    """
+    Carica il documento a blocchi (OcrClient.upload_resumable), riprendendo il
+    caricamento interrotto registrato su ocr_upload_id; l'offset confermato
+    dal server viene salvato dopo ogni blocco. Ritorna il task ID dell'OCR.
+    """
+    def on_progress(upload_id, offset):
+        doc_instance.ocr_upload_id = upload_id
+        doc_instance.ocr_upload_offset = offset
+        # update() non tocca updated_at (auto_now): va aggiornato qui, altrimenti un caricamento
+        # lungo risulta fermo e lo sweeper ne rilascia il claim mentre è ancora in corso
+        Document.objects.filter(pk=doc_instance.pk).update(
+            ocr_upload_id=upload_id, ocr_upload_offset=offset, updated_at=timezone.now()
+        )
+        if offset:
+            publish_stage(doc_instance, 'upload', f"Uploading to GPU server: {offset // (1024 * 1024)} MB sent")
+
+    metadata = {
+        'document_id': doc_instance.pk,
+        'title': doc_instance.title,
+        'filename': os.path.basename(doc_instance.file.path),
+    }
+    if OCR_CALLBACK_URL:
+        metadata['callback_url'] = OCR_CALLBACK_URL
+
+    print(f"[OCR] Caricamento a blocchi di {doc_instance.title}...")
+    with _ocr_upload(doc_instance) as upload:
+        task_id = client.upload_resumable(upload, metadata, doc_instance.ocr_upload_id or None, on_progress)
+    on_progress('', 0)
+    return task_id
+
+
+def _content_fingerprint(doc_instance):
+    """
+    Impronta del contenuto da elaborare: due task con la stessa impronta sullo
+    stesso documento sono duplicati. Usa solo campi economici (nome, dimensione
+    e mtime del file, pagine OCR, lunghezza e data del testo OCR) perché viene
+    calcolata a ogni invocazione, anche per i duplicati poi scartati.
+    """
+    try:
+        stat = os.stat(doc_instance.file.path)
+        file_key = [doc_instance.file.name, stat.st_size, stat.st_mtime_ns]
+    except (OSError, ValueError):
+        file_key = [doc_instance.file.name, 'missing']
+    completed_at = doc_instance.ocr_completed_at.isoformat() if doc_instance.ocr_completed_at else None
+    key = [file_key, doc_instance.ocr_pages, len(doc_instance.ocr_text or ''), completed_at]
+    return hashlib.sha256(json.dumps(key).encode()).hexdigest()[:16]
+
+
+def _unanswered_submit_error(error):
+    """Messaggio per un invio arrivato al server GPU senza risposta: il task OCR potrebbe esistere già."""
+    return (f"Nessuna risposta dal server GPU dopo l'invio ({type(error).__name__}): il task OCR potrebbe "
+            f"essere già stato creato, il documento non viene reinviato automaticamente")
+
+
+def _fail_ocr(doc_instance, error_msg):
+    doc_instance.processing_state = 'ocr_failed'
+    doc_instance.ocr_error = error_msg
+    doc_instance.save()
+    publish_documents(doc_instance.pk)
+
+
+@shared_task(bind=True, max_retries=OCR_DISPATCH_MAX_DEFERRALS)
+def process_scanned_document(self, document_pk):
     """
     Task che invia il documento scansionato al server GPU per OCR con DeepSeek-VL.
+    Se il server non è raggiungibile (circuit breaker aperto, connessione
+    rifiutata o timeout di connessione dopo i retry del client) l'invio viene
+    rimandato invece di far fallire il documento, fino a
+    OCR_DISPATCH_MAX_DEFERRALS volte. Se invece la richiesta è partita senza
+    risposta (timeout di lettura, connessione interrotta) il documento
+    fallisce: il server potrebbe aver già creato il task.
+    Un lease per documento scarta le copie duplicate del task.
     """
+    doc_instance = Document.objects.filter(pk=document_pk).first()
+    if doc_instance is None:
+        print(f"[OCR] Documento {document_pk} non trovato: invio annullato")
+        return
+    lease = DocumentLease('ocr', document_pk, _content_fingerprint(doc_instance))
+    if not lease.acquire():
+        print(f"[OCR] Invio del documento {document_pk} già in corso: duplicato scartato")
+        return
     try:
-        doc_instance = get_object_or_404(Document, pk=document_pk)
+        defer_for = _submit_scanned_document(self, doc_instance)
+    finally:
+        lease.release()
+
+    if defer_for is not None:
+        print(f"[OCR] Invio del documento {document_pk} rimandato di {defer_for:.0f}s")
+        raise self.retry(countdown=defer_for)
+
+
+def _submit_scanned_document(task, doc_instance):
+    """Invio al server GPU di process_scanned_document. Ritorna i secondi di attesa prima di riprovare, o None."""
+    document_pk = doc_instance.pk
+    defer_for = None
+    try:
+        # Stato aggiornato dopo aver ottenuto il lease: una copia precedente può aver già inviato il documento
+        doc_instance.refresh_from_db()
+        # Duplicato arrivato dopo un invio riuscito (o durante un invio batch): il server GPU ha già il documento
+        if doc_instance.ocr_task_id and doc_instance.processing_state in OCR_ACTIVE_STATES:
+            print(f"[OCR] Documento {document_pk} già inviato al server GPU ({doc_instance.ocr_task_id}): duplicato scartato")
+            return None
         doc_instance.processing_state = 'ocr_queued'
         doc_instance.save()
+        publish_documents(document_pk)
         
         print(f"[OCR] Invio documento {doc_instance.title} al server GPU...")
         
@@ -29,179 +261,805 @@ def process_scanned_document(document_pk):
         # Verifica che il file esista
         if not os.path.exists(file_path):
             print(f"[OCR] ERRORE: File non trovato: {file_path}")
-            doc_instance.processing_state = 'ocr_failed'
-            doc_instance.ocr_error = "File not found"
-            doc_instance.save()
-            return
+            _fail_ocr(doc_instance, "File not found")
+            return None
         
+        client = get_ocr_client()
+        resumable = os.path.getsize(file_path) >= OCR_UPLOAD_CHUNKED_MIN_BYTES
         try:
-            # Invio del file al server GPU
-            with open(file_path, 'rb') as f:
-                files = {'file': (os.path.basename(file_path), f, 'application/pdf')}
-                data = {
-                    'document_id': document_pk,
-                    'title': doc_instance.title
-                }
-                
-                print(f"[OCR] Connessione a {GPU_SERVER_URL}...")
-                response = requests.post(
-                    f'{GPU_SERVER_URL}/api/ocr/process',
-                    files=files,
-                    data=data,
-                    timeout=OCR_TIMEOUT
-                )
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    task_id = result.get('task_id')
-                    
-                    doc_instance.processing_state = 'ocr_processing'
-                    doc_instance.processing_output = f"OCR avviato su GPU. Task ID: {task_id}"
-                    doc_instance.save()
-                    
-                    print(f"[OCR] Task GPU creato con successo: {task_id}")
-                    
-                    check_ocr_status.apply_async(
-                        args=[document_pk, task_id],
-                        countdown=30  
-                    )
-                else:
+            if resumable:
+                # File grandi: caricamento a blocchi, ripreso dal punto di interruzione se il task viene ripetuto
+                task_id = _upload_resumable(client, doc_instance)
+            else:
+                # Invio del file al server GPU
+                with _ocr_upload(doc_instance) as f:
+                    files = {'file': (os.path.basename(file_path), f, 'application/pdf')}
+                    data = {
+                        'document_id': document_pk,
+                        'title': doc_instance.title
+                    }
+                    # Il server GPU notifica progressi e completamento a questo URL
+                    if OCR_CALLBACK_URL:
+                        data['callback_url'] = OCR_CALLBACK_URL
+
+                    print(f"[OCR] Connessione a {client.base_url}...")
+                    response = client.submit(files, data)
+
+                if response.status_code in RETRY_STATUS_CODES:
+                    raise OcrServerUnavailable(f"GPU server returned status {response.status_code}")
+                if response.status_code != 200:
                     raise Exception(f"GPU server returned status {response.status_code}: {response.text}")
-                
-        except requests.ConnectionError as e:
-            error_msg = f"Impossibile connettersi al server GPU: {str(e)}"
-            print(f"[OCR] ERRORE: {error_msg}")
-            print(f"[OCR] Verifica che il server GPU sia attivo e raggiungibile")
-            doc_instance.processing_state = 'ocr_failed'
-            doc_instance.ocr_error = error_msg
+                task_id = response.json().get('task_id')
+
+            doc_instance.processing_state = 'ocr_processing'
+            doc_instance.ocr_task_id = task_id
+            doc_instance.ocr_progress = 0
+            doc_instance.processing_output = f"OCR avviato su GPU. Task ID: {task_id}"
             doc_instance.save()
-            
-        except requests.Timeout as e:
-            error_msg = f"Timeout connessione al server GPU: {str(e)}"
+            publish_documents(document_pk)
+
+            print(f"[OCR] Task GPU creato con successo: {task_id}")
+            if not OCR_CALLBACK_URL:
+                print(f"[OCR] Nessun OCR_CALLBACK_URL: lo stato verrà controllato da sweep_ocr_documents")
+
+        except (OcrServerUnavailable, requests.ConnectionError, requests.Timeout) as e:
+            error_msg = f"Server GPU non raggiungibile: {str(e)}"
             print(f"[OCR] ERRORE: {error_msg}")
-            doc_instance.processing_state = 'ocr_failed'
-            doc_instance.ocr_error = error_msg
-            doc_instance.save()
+            if not resumable and not request_not_sent(e):
+                # /process può aver già creato il task: un nuovo invio lo duplicherebbe
+                # (il caricamento a blocchi invece riprende lo stesso upload_id)
+                _fail_ocr(doc_instance, _unanswered_submit_error(e))
+            elif task.request.retries < task.max_retries:
+                defer_for = max(getattr(e, 'retry_after', 0), client.breaker.retry_after(), 30)
+                doc_instance.processing_output = f"In attesa del server GPU, nuovo invio tra {defer_for:.0f}s"
+                doc_instance.save()
+                publish_documents(document_pk)
+            else:
+                print(f"[OCR] Verifica che il server GPU sia attivo e raggiungibile")
+                _fail_ocr(doc_instance, error_msg)
                 
+    except Document.DoesNotExist:
+        print(f"[OCR] Documento {document_pk} eliminato durante l'invio")
     except Exception as e:
         print(f"[OCR] ERRORE CRITICO per documento ID {document_pk}: {e}")
-        doc_instance = Document.objects.get(pk=document_pk)
-        doc_instance.processing_state = 'ocr_failed'
-        doc_instance.ocr_error = str(e)
-        doc_instance.save()
+        _fail_ocr(doc_instance, str(e))
 
+    return defer_for
 
-@shared_task
-def check_ocr_status(document_pk, task_id, retry_count=0):
+
+def enqueue_ocr(document_pk):
     """
-    Task che controlla periodicamente lo stato dell'OCR sul server GPU.
+    Mette in coda il documento per l'OCR. Con OCR_BATCH_ENABLED l'invio
+    avviene tramite submit_ocr_batch dopo OCR_BATCH_WINDOW secondi, così i
+    documenti caricati insieme partono nella stessa richiesta; il documento
+    deve essere in stato 'ocr_queued' con ocr_task_id vuoto.
     """
-    max_retries = 60 
-    
+    if OCR_BATCH_ENABLED:
+        submit_ocr_batch.apply_async(countdown=OCR_BATCH_WINDOW)
+    else:
+        process_scanned_document.delay(document_pk)
+
+
+def group_by_size(entries, max_files, max_bytes):
+    """
+    Raggruppa le coppie (dimensione, documento) in batch di al massimo
+    `max_files` file e `max_bytes` byte, ordinandole per dimensione così che
+    ogni batch contenga file simili. Un file più grande di `max_bytes`
+    viene inviato da solo.
+    """
+    batches = []
+    batch, batch_bytes = [], 0
+    for size, doc_instance in sorted(entries, key=lambda entry: entry[0]):
+        if batch and (len(batch) >= max_files or batch_bytes + size > max_bytes):
+            batches.append(batch)
+            batch, batch_bytes = [], 0
+        batch.append(doc_instance)
+        batch_bytes += size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def _submit_batch(client, batch, claim):
+    """Invia un batch di documenti con una sola richiesta e registra i task ID ricevuti."""
+    uploads = []
     try:
-        doc_instance = get_object_or_404(Document, pk=document_pk)
-        
-        print(f"[OCR] Controllo stato task {task_id} (tentativo {retry_count + 1}/{max_retries})...")
-        
-        response = requests.get(
-            f'{GPU_SERVER_URL}/api/ocr/status/{task_id}',
-            timeout=30
+        for doc_instance in batch:
+            uploads.append(_ocr_upload(doc_instance))
+        files = [
+            ('files', (os.path.basename(doc_instance.file.path), upload, 'application/pdf'))
+            for doc_instance, upload in zip(batch, uploads)
+        ]
+        data = {'documents': json.dumps([{'document_id': doc_instance.pk, 'title': doc_instance.title} for doc_instance in batch])}
+        if OCR_CALLBACK_URL:
+            data['callback_url'] = OCR_CALLBACK_URL
+        response = client.submit_batch(files, data)
+    finally:
+        for upload in uploads:
+            upload.close()
+
+    now = timezone.now()
+    claimed = Document.objects.filter(ocr_task_id=claim)
+    pks = [doc_instance.pk for doc_instance in batch]
+    if response.status_code != 200:
+        error = f"GPU server returned status {response.status_code}: {response.text}"
+        print(f"[OCR] ERRORE invio batch: {error}")
+        claimed.filter(pk__in=pks).update(
+            processing_state='ocr_failed', ocr_task_id='', ocr_error=error, updated_at=now
         )
-        
-        if response.status_code == 200:
-            result = response.json()
-            status = result.get('status')
-            progress = result.get('progress', 0)
-            
-            print(f"[OCR] Status: {status}, Progress: {progress}%")
-            
-            if status == 'completed':
-                ocr_text = result.get('text', '')
-                char_count = result.get('char_count', len(ocr_text))
-                page_count = result.get('page_count', 0)
-                
-                doc_instance.ocr_text = ocr_text
-                doc_instance.processing_state = 'ocr_completed'
-                doc_instance.ocr_completed_at = timezone.now()
-                doc_instance.processing_output = f"OCR completato. Estratti {char_count} caratteri da {page_count} pagine."
-                doc_instance.save()
-                
-                print(f"[OCR] ✓ OCR completato per {doc_instance.title}")
-                print(f"[OCR] Avvio indicizzazione RAG...")
-                
-                index_document_rag.delay(document_pk)
-                
-            elif status == 'failed':
-                error = result.get('error', 'Unknown error')
-                doc_instance.processing_state = 'ocr_failed'
-                doc_instance.ocr_error = error
-                doc_instance.save()
-                print(f"[OCR] ✗ OCR fallito per {doc_instance.title}: {error}")
-                
-            elif status in ['pending', 'queued', 'processing']:
-                doc_instance.processing_output = f"OCR in corso... Progresso: {progress}%"
-                doc_instance.save()
-                
-                if retry_count < max_retries:
-                    check_ocr_status.apply_async(
-                        args=[document_pk, task_id, retry_count + 1],
-                        countdown=60
-                    )
-                else:
-                    doc_instance.processing_state = 'ocr_failed'
-                    doc_instance.ocr_error = "Timeout: OCR non completato dopo 1 ora"
-                    doc_instance.save()
-                    print(f"[OCR] ✗ Timeout per {doc_instance.title}")
-            else:
-                print(f"[OCR] Status sconosciuto: {status}")
+        publish_documents(*pks)
+        return
+
+    for task in response.json().get('tasks', []):
+        task_id = task.get('task_id')
+        if task_id:
+            claimed.filter(pk=task['document_id']).update(
+                processing_state='ocr_processing',
+                ocr_task_id=task_id,
+                ocr_progress=0,
+                processing_output=f"OCR avviato su GPU. Task ID: {task_id}",
+                updated_at=now,
+            )
         else:
-            print(f"[OCR] Errore response: {response.status_code}")
-            if retry_count < max_retries:
-                check_ocr_status.apply_async(
-                    args=[document_pk, task_id, retry_count + 1],
-                    countdown=120 
+            claimed.filter(pk=task['document_id']).update(
+                processing_state='ocr_failed', ocr_task_id='', ocr_error=task.get('error', 'Unknown error'), updated_at=now
+            )
+    publish_documents(*pks)
+    print(f"[OCR] Batch di {len(batch)} documenti inviato al server GPU")
+
+
+def _submit_resumable(client, doc_instance, claim):
+    """Invia un documento grande con il caricamento a blocchi e ne registra il task ID."""
+    try:
+        task_id = _upload_resumable(client, doc_instance)
+    except OcrUploadError as e:
+        print(f"[OCR] ERRORE caricamento a blocchi: {e}")
+        Document.objects.filter(pk=doc_instance.pk, ocr_task_id=claim).update(
+            processing_state='ocr_failed', ocr_task_id='', ocr_error=str(e), updated_at=timezone.now()
+        )
+        publish_documents(doc_instance.pk)
+        return
+    Document.objects.filter(pk=doc_instance.pk, ocr_task_id=claim).update(
+        processing_state='ocr_processing',
+        ocr_task_id=task_id,
+        ocr_progress=0,
+        processing_output=f"OCR avviato su GPU. Task ID: {task_id}",
+        updated_at=timezone.now(),
+    )
+    publish_documents(doc_instance.pk)
+    print(f"[OCR] Documento {doc_instance.title} caricato a blocchi, task GPU {task_id}")
+
+
+def _fail_claimed(claim, batch, error):
+    """Marca come falliti i documenti del batch ancora presi in carico con `claim`."""
+    pks = [doc_instance.pk for doc_instance in batch]
+    Document.objects.filter(ocr_task_id=claim, pk__in=pks).update(
+        processing_state='ocr_failed', ocr_task_id='', ocr_error=error, updated_at=timezone.now()
+    )
+    publish_documents(*pks)
+
+
+@contextmanager
+def _claim_heartbeat(claim):
+    """
+    Finché l'invio è in corso aggiorna ogni OCR_CLAIM_HEARTBEAT secondi
+    updated_at dei documenti presi in carico con `claim`: un caricamento lento
+    sul tunnel può superare OCR_STALE_AFTER, e senza heartbeat lo sweeper
+    rimetterebbe in coda documenti ancora in corso di invio.
+    """
+    stop = threading.Event()
+
+    def beat():
+        try:
+            while not stop.wait(OCR_CLAIM_HEARTBEAT):
+                try:
+                    Document.objects.filter(ocr_task_id=claim).update(updated_at=timezone.now())
+                except Exception as e:
+                    print(f"[OCR] Heartbeat del claim {claim} non riuscito: {e}")
+        finally:
+            # Il thread ha una propria connessione al database
+            connection.close()
+
+    thread = threading.Thread(target=beat, name=f"ocr-claim-{claim}", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+@shared_task
+def submit_ocr_batch():
+    """
+    Invia al server GPU tutti i documenti in coda per l'OCR, raggruppati per
+    dimensione in richieste multi-file (POST /api/ocr/process_batch).
+    I documenti vengono prima presi in carico con un UPDATE condizionato, così
+    più esecuzioni concorrenti del task non li inviano due volte; se il server
+    non è raggiungibile tornano in coda e l'invio viene ripianificato.
+    Durante l'invio il claim riceve un heartbeat (vedi _claim_heartbeat).
+    """
+    claim = f"{OCR_CLAIM_PREFIX}{uuid.uuid4().hex}"
+    queued = Document.objects.filter(processing_state='ocr_queued', ocr_task_id='')
+    if not queued.update(ocr_task_id=claim, updated_at=timezone.now()):
+        return
+
+    entries = []
+    for doc_instance in Document.objects.filter(ocr_task_id=claim):
+        if not os.path.exists(doc_instance.file.path):
+            print(f"[OCR] ERRORE: File non trovato: {doc_instance.file.path}")
+            doc_instance.ocr_task_id = ''
+            _fail_ocr(doc_instance, "File not found")
+            continue
+        entries.append((os.path.getsize(doc_instance.file.path), doc_instance))
+    claimed_pks = [doc_instance.pk for _, doc_instance in entries]
+
+    # I file grandi non entrano nei batch multi-file: vengono caricati a blocchi uno alla volta
+    jobs = [(_submit_resumable, doc_instance, [doc_instance])
+            for size, doc_instance in entries if size >= OCR_UPLOAD_CHUNKED_MIN_BYTES]
+    entries = [(size, doc_instance) for size, doc_instance in entries if size < OCR_UPLOAD_CHUNKED_MIN_BYTES]
+    jobs += [(_submit_batch, batch, batch) for batch in group_by_size(entries, OCR_BATCH_MAX_FILES, OCR_BATCH_MAX_BYTES)]
+
+    client = get_ocr_client()
+    with _claim_heartbeat(claim):
+        for submit, job, batch in jobs:
+            try:
+                submit(client, job, claim)
+            except (OcrServerUnavailable, requests.ConnectionError, requests.Timeout) as e:
+                if submit is _submit_batch and not request_not_sent(e):
+                    # /process_batch può aver già creato i task: i documenti non vengono reinviati
+                    print(f"[OCR] ERRORE invio batch senza risposta: {e}")
+                    _fail_claimed(claim, batch, _unanswered_submit_error(e))
+                    continue
+                retry_after = max(getattr(e, 'retry_after', 0), client.breaker.retry_after(), 30)
+                print(f"[OCR] Server GPU non raggiungibile ({e}), invio rimandato di {retry_after:.0f}s")
+                Document.objects.filter(ocr_task_id=claim).update(
+                    ocr_task_id='', processing_output=f"In attesa del server GPU, nuovo invio tra {retry_after:.0f}s"
                 )
-                
-    except requests.RequestException as e:
+                publish_documents(*claimed_pks)
+                submit_ocr_batch.apply_async(countdown=retry_after)
+                return
+            except Exception as e:
+                print(f"[OCR] ERRORE CRITICO durante l'invio batch: {e}")
+                _fail_claimed(claim, batch, str(e))
+
+    # Documenti che il server non ha riportato nella risposta: tornano in coda
+    if Document.objects.filter(ocr_task_id=claim).update(ocr_task_id=''):
+        submit_ocr_batch.apply_async(countdown=OCR_BATCH_WINDOW)
+
+
+def apply_ocr_update(document_pk, task_id, payload):
+    """
+    Applica un aggiornamento di stato del server GPU, ricevuto dal callback
+    o dal polling dello sweeper. Gli aggiornamenti sono condizionati allo
+    stato del documento, quindi callback duplicati o in concorrenza con lo
+    sweeper non avviano due volte l'indicizzazione.
+    Ritorna True se l'aggiornamento è stato applicato.
+    """
+    status = payload.get('status')
+    now = timezone.now()
+    active = Document.objects.filter(pk=document_pk, ocr_task_id=task_id, processing_state__in=OCR_ACTIVE_STATES)
+
+    if status == 'completed':
+        ocr_text = payload.get('text', '')
+        char_count = payload.get('char_count', len(ocr_text))
+        page_count = payload.get('page_count', 0)
+        updated = active.update(
+            ocr_text=ocr_text,
+            processing_state='ocr_completed',
+            ocr_completed_at=now,
+            ocr_progress=100,
+            processing_output=f"OCR completato. Estratti {char_count} caratteri da {page_count} pagine.",
+            updated_at=now,
+        )
+        if updated:
+            print(f"[OCR] ✓ OCR completato per documento {document_pk}, avvio indicizzazione RAG...")
+            queue_indexing(document_pk)
+
+    elif status == 'failed':
+        error = payload.get('error', 'Unknown error')
+        updated = active.update(processing_state='ocr_failed', ocr_error=error, updated_at=now)
+        if updated:
+            print(f"[OCR] ✗ OCR fallito per documento {document_pk}: {error}")
+
+    elif status in ['pending', 'queued', 'processing']:
+        progress = int(payload.get('progress') or 0)
+        output = f"OCR in corso... Progresso: {progress}%"
+        # Solo un progresso reale aggiorna updated_at, che misura l'inattività del task
+        updated = active.filter(processing_state='ocr_queued').update(
+            processing_state='ocr_processing', ocr_progress=progress, processing_output=output, updated_at=now
+        )
+        updated += active.exclude(ocr_progress=progress).update(
+            ocr_progress=progress, processing_output=output, updated_at=now
+        )
+
+        # Pagine già riconosciute, nella numerazione del testo OCR finale: vengono indicizzate subito
+        pages = payload.get('pages')
+        if pages and OCR_INCREMENTAL_INDEXING and (updated or active.exists()):
+            index_ocr_pages.delay(document_pk, task_id, pages)
+            updated = True
+
+    else:
+        print(f"[OCR] Status sconosciuto: {status}")
+        return False
+
+    if updated:
+        publish_documents(document_pk)
+    return bool(updated)
+
+
+@shared_task
+def check_ocr_status(document_pk, task_id, retry_count=0):
+    """
+    Controlla una volta lo stato dell'OCR sul server GPU.
+    Non si rischedula più: i documenti in attesa vengono ricontrollati da
+    sweep_ocr_documents (`retry_count` resta per i messaggi già in coda).
+    """
+    try:
+        print(f"[OCR] Controllo stato task {task_id} per documento {document_pk}...")
+        response = get_ocr_client().status(task_id)
+        if response.status_code != 200:
+            print(f"[OCR] Errore response: {response.status_code}")
+            return
+        result = response.json()
+        print(f"[OCR] Status: {result.get('status')}, Progress: {result.get('progress', 0)}%")
+        apply_ocr_update(document_pk, task_id, result)
+
+    except (OcrServerUnavailable, requests.RequestException) as e:
         print(f"[OCR] Errore connessione durante status check: {e}")
-        if retry_count < max_retries:
-            check_ocr_status.apply_async(
-                args=[document_pk, task_id, retry_count + 1],
-                countdown=120
-            )
     except Exception as e:
         print(f"[OCR] ERRORE durante status check per ID {document_pk}: {e}")
 
 
+def poll_ocr_statuses(documents):
+    """
+    Interroga lo stato dei task OCR dei documenti con una richiesta
+    /api/ocr/status_batch ogni OCR_STATUS_BATCH_SIZE task (una richiesta
+    per documento se OCR_BATCH_ENABLED è disattivato).
+    """
+    if not OCR_BATCH_ENABLED:
+        for doc_instance in documents:
+            check_ocr_status(doc_instance.pk, doc_instance.ocr_task_id)
+        return
+
+    client = get_ocr_client()
+    for start in range(0, len(documents), OCR_STATUS_BATCH_SIZE):
+        batch = documents[start:start + OCR_STATUS_BATCH_SIZE]
+        try:
+            response = client.status_batch([doc_instance.ocr_task_id for doc_instance in batch])
+        except (OcrServerUnavailable, requests.RequestException) as e:
+            print(f"[OCR] Errore connessione durante status check batch: {e}")
+            return
+        if response.status_code != 200:
+            print(f"[OCR] Errore response status batch: {response.status_code}")
+            return
+
+        statuses = response.json().get('statuses', {})
+        for doc_instance in batch:
+            payload = statuses.get(doc_instance.ocr_task_id)
+            if payload:
+                apply_ocr_update(doc_instance.pk, doc_instance.ocr_task_id, payload)
+
+
+@shared_task
+def sweep_ocr_documents():
+    """
+    Fallback periodico (Celery beat) al callback del server GPU: ricontrolla i
+    documenti OCR senza aggiornamenti da OCR_STALE_AFTER secondi (ad ogni
+    esecuzione se il callback non è configurato) e marca come falliti quelli
+    fermi da più di OCR_MAX_IDLE secondi. Rimette in coda i documenti di invii
+    batch interrotti e avvia submit_ocr_batch se ci sono documenti in attesa.
+    """
+    now = timezone.now()
+    stale_after = OCR_STALE_AFTER if OCR_CALLBACK_URL else 0
+    waiting = Document.objects.filter(processing_state__in=OCR_ACTIVE_STATES).exclude(ocr_task_id='')
+
+    stale = []
+    for doc_instance in waiting.only('pk', 'title', 'ocr_task_id', 'updated_at'):
+        idle = (now - doc_instance.updated_at).total_seconds()
+        if idle > OCR_MAX_IDLE:
+            timed_out = Document.objects.filter(pk=doc_instance.pk, processing_state__in=OCR_ACTIVE_STATES).update(
+                processing_state='ocr_failed',
+                ocr_error=f"Timeout: nessun progresso OCR da {int(idle // 60)} minuti",
+                updated_at=now,
+            )
+            if timed_out:
+                print(f"[OCR] ✗ Timeout per {doc_instance.title}")
+                publish_documents(doc_instance.pk)
+        elif doc_instance.ocr_task_id.startswith(OCR_CLAIM_PREFIX):
+            # Invio batch interrotto (ad es. worker terminato): senza heartbeat il documento torna in coda
+            if idle >= max(OCR_STALE_AFTER, 3 * OCR_CLAIM_HEARTBEAT):
+                Document.objects.filter(pk=doc_instance.pk, ocr_task_id=doc_instance.ocr_task_id).update(ocr_task_id='')
+        elif idle >= stale_after:
+            stale.append(doc_instance)
+
+    if stale:
+        poll_ocr_statuses(stale)
+    if OCR_BATCH_ENABLED and Document.objects.filter(processing_state='ocr_queued', ocr_task_id='').exists():
+        submit_ocr_batch.delay()
+
+    client = get_ocr_client()
+    if client.metrics:
+        print(f"[OCR] Metriche client GPU: {client.report()}")
+
+
+def size_class(page_count, file_size):
+    """
+    Classe di dimensione del documento ('small', 'medium' o 'large'), dal
+    numero di pagine o, se non è noto, dalla dimensione del file.
+    """
+    if page_count:
+        if page_count <= INGEST_SMALL_MAX_PAGES:
+            return 'small'
+        return 'large' if page_count >= INGEST_LARGE_MIN_PAGES else 'medium'
+    if file_size:
+        if file_size <= INGEST_SMALL_MAX_BYTES:
+            return 'small'
+        return 'large' if file_size >= INGEST_LARGE_MIN_BYTES else 'medium'
+    return 'medium'
+
+
+def queue_indexing(document_pk):
+    """
+    Mette il documento in attesa di indicizzazione ('rag_queued'): il task
+    parte quando schedule_indexing gli assegna un posto nella coda della sua
+    classe di dimensione. Per i documenti caricati prima del preflight
+    dimensionale numero di pagine e dimensione vengono calcolati qui.
+    """
+    doc_instance = Document.objects.only('pk', 'file', 'page_count').get(pk=document_pk)
+    updates = {'processing_state': 'rag_queued', 'updated_at': timezone.now()}
+    if not doc_instance.page_count:
+        try:
+            updates['page_count'] = get_pdf_page_count(doc_instance.file.path)
+            updates['file_size'] = doc_instance.file.size
+        except Exception as e:
+            print(f"[RAG] Dimensione del documento {document_pk} non rilevabile: {e}")
+    Document.objects.filter(pk=document_pk).update(**updates)
+    publish_documents(document_pk)
+    schedule_indexing.delay()
+
+
+def _recover_interrupted_indexing(stale_before, now):
+    """
+    Documenti rimasti in 'rag_processing' oltre INDEXING_STALE_AFTER: il task
+    è stato terminato senza aggiornarli (time limit, worker caduto). Tornano
+    in coda per una nuova indicizzazione; dopo INDEXING_MAX_INTERRUPTIONS
+    interruzioni vengono marcati 'failed', altrimenti un documento che supera
+    sempre il time limit occuperebbe il posto della sua classe all'infinito.
+    """
+    recovered = []
+    stale = Document.objects.filter(processing_state='rag_processing', updated_at__lt=stale_before)
+    for pk, updated_at, stats in stale.values_list('pk', 'updated_at', 'processing_stats'):
+        stats = dict(stats or {})
+        stats['interrupted_runs'] = stats.get('interrupted_runs', 0) + 1
+        if stats['interrupted_runs'] > INDEXING_MAX_INTERRUPTIONS:
+            state, output = 'failed', f"Errore: indicizzazione interrotta {stats['interrupted_runs']} volte (time limit o worker terminato)"
+        else:
+            state, output = 'rag_queued', "Indexing interrupted, waiting for an indexing slot."
+        # Update condizionale: con due scheduler in concorrenza il documento viene recuperato una volta sola
+        updated = Document.objects.filter(pk=pk, processing_state='rag_processing', updated_at=updated_at).update(
+            processing_state=state, processing_output=output, processing_stats=stats, updated_at=now,
+        )
+        if updated:
+            recovered.append(pk)
+            print(f"[RAG] Indicizzazione del documento {pk} interrotta: {'nuovo tentativo' if state == 'rag_queued' else 'fallita'}")
+    if recovered:
+        publish_documents(*recovered)
+    return recovered
+
+
+@shared_task
+def schedule_indexing():
+    """
+    Avvia i documenti in attesa di indicizzazione, separati per classe di
+    dimensione: ogni classe ha la sua coda Celery e al più
+    INGEST_QUEUE_SLOTS[classe] documenti in corso, così un manuale di 800
+    pagine non blocca i documenti piccoli accodati dopo di lui.
+    I posti liberi vengono assegnati a turno tra gli utenti, partendo da chi
+    ha meno documenti in corso (a parità, dal documento in attesa da più
+    tempo); con INGEST_MAX_PER_UPLOADER un utente non supera quel numero di
+    documenti in corso per classe.
+    Viene eseguito ad ogni documento accodato o concluso e dal beat.
+    """
+    now = timezone.now()
+    stale_before = now - timedelta(seconds=INDEXING_STALE_AFTER)
+    _recover_interrupted_indexing(stale_before, now)
+
+    fields = ('pk', 'uploader_id', 'page_count', 'file_size')
+    running = Document.objects.filter(processing_state='rag_processing', updated_at__gte=stale_before)
+    in_flight = defaultdict(Counter)
+    for _, uploader_id, page_count, file_size in running.values_list(*fields):
+        in_flight[size_class(page_count, file_size)][uploader_id] += 1
+
+    # classe -> utente -> (posizione di arrivo, pk) in ordine di attesa
+    waiting = defaultdict(lambda: defaultdict(deque))
+    queued = Document.objects.filter(processing_state='rag_queued').order_by('updated_at', 'pk')
+    for position, (pk, uploader_id, page_count, file_size) in enumerate(queued.values_list(*fields)):
+        waiting[size_class(page_count, file_size)][uploader_id].append((position, pk))
+
+    released = []
+    for klass, by_uploader in waiting.items():
+        counts = in_flight[klass]
+        slots = INGEST_QUEUE_SLOTS.get(klass, 1) - sum(counts.values())
+        if INGEST_MAX_PER_UPLOADER:
+            for uploader_id in [u for u in by_uploader if counts[u] >= INGEST_MAX_PER_UPLOADER]:
+                del by_uploader[uploader_id]
+
+        while slots > 0 and by_uploader:
+            uploader_id = min(by_uploader, key=lambda u: (counts[u], by_uploader[u][0][0]))
+            _, pk = by_uploader[uploader_id].popleft()
+            # Update condizionale: con due scheduler in concorrenza il documento parte una volta sola
+            claimed = Document.objects.filter(pk=pk, processing_state='rag_queued').update(
+                processing_state='rag_processing',
+                processing_output="Indexing started in background.",
+                updated_at=now,
+            )
+            if claimed:
+                released.append((pk, INGEST_QUEUES[klass]))
+                counts[uploader_id] += 1
+                slots -= 1
+            if not by_uploader[uploader_id] or (INGEST_MAX_PER_UPLOADER and counts[uploader_id] >= INGEST_MAX_PER_UPLOADER):
+                del by_uploader[uploader_id]
+
+    if released:
+        publish_documents(*[pk for pk, _ in released])
+        group(index_document_rag.s(pk).set(queue=queue) for pk, queue in released).apply_async()
+        print(f"[RAG] Indicizzazione avviata: " + ", ".join(f"{pk} ({queue})" for pk, queue in released))
+    return len(released)
+
+
+def _window_pages(doc_instance):
+    """
+    Pagine per finestra se il documento è abbastanza grande da essere elaborato
+    a finestre (memory.window_min_pages), altrimenti None.
+    """
+    try:
+        page_count = get_pdf_page_count(doc_instance.file.path)
+    except Exception:
+        return None
+    return get_window_pages() if page_count >= get_window_min_pages() else None
+
+
+def _with_ocr_ids(document_pk, chunks):
+    """Assegna ai chunk OCR id deterministici (vedi ocr_chunk_id), numerandoli per pagina."""
+    counters = {}
+    for chunk in chunks:
+        page = chunk["metadata"]["page"]
+        index = counters.get(page, 0)
+        counters[page] = index + 1
+        chunk["id"] = ocr_chunk_id(document_pk, page, index)
+        yield chunk
+
+
+def _with_native_ids(document_pk, chunks, positions):
+    """Assegna ai chunk nativi id deterministici (vedi native_chunk_id) in ordine di documento."""
+    for chunk in chunks:
+        chunk["id"] = native_chunk_id(document_pk, next(positions))
+        yield chunk
+
+
+def _ocr_source(doc_instance, stats, window_pages=None, pages=None, skip_pages=()):
+    """
+    Prepara le pagine OCR come unità della pipeline di ingest.
+    Per i PDF misti il server GPU ha ricevuto solo le pagine senza text layer:
+    la numerazione viene riportata a quella del PDF originale.
+    Con `window_pages` le unità sono finestre di pagine, estratte dal testo
+    OCR solo quando servono; i conteggi del boilerplate proseguono da una
+    finestra alla successiva.
+    `pages` ({pagina: testo}) sostituisce il testo OCR salvato, e le pagine in
+    `skip_pages` (numerazione originale) sono già indicizzate e vengono saltate.
+    """
+    original_pages = doc_instance.ocr_pages if doc_instance.document_type == 'mixed' else None
+    title = doc_instance.title
+    document_pk = doc_instance.pk
+    boilerplate = BoilerplateDetector()
+
+    def prepare(pages):
+        pages, saved_chars = strip_boilerplate_pages(pages, boilerplate)
+        stats['boilerplate_chars_removed'] = stats.get('boilerplate_chars_removed', 0) + saved_chars
+        if original_pages:
+            pages = {
+                original_pages[page_num - 1]: content
+                for page_num, content in pages.items()
+                if 0 < page_num <= len(original_pages)
+            }
+        stats['ocr_page_count'] = stats.get('ocr_page_count', 0) + len(pages)
+        if skip_pages:
+            pages = {page_num: content for page_num, content in pages.items() if page_num not in skip_pages}
+        return pages
+
+    if window_pages and pages is None:
+        units = iter_ocr_page_windows(doc_instance.ocr_text, window_pages)
+        return units, lambda window: _with_ocr_ids(document_pk, iter_ocr_page_chunks(prepare(window), title))
+
+    # Ogni pagina OCR è un'unità della pipeline
+    pages = prepare(split_ocr_pages(doc_instance.ocr_text) if pages is None else pages)
+    return pages.items(), lambda page: _with_ocr_ids(document_pk, iter_ocr_page_chunks(dict([page]), title))
+
+
+def _native_source(doc_instance, file_path, stats, window_pages=None):
+    """
+    Sceglie il percorso di estrazione del PDF nativo e prepara le unità della pipeline.
+    Le pagine inviate all'OCR (PDF misti) vengono escluse prima del chunking:
+    Docling converte solo gli intervalli di pagine native e le pagine del
+    text layer vengono scartate, così il Chunker non le vede mai.
+    Con `window_pages` testo e conversione procedono a finestre di pagine.
+    Tutte le unità passano dallo stesso Chunker: buffer, overlap e conteggi
+    del boilerplate proseguono da un'unità alla successiva e il testo in
+    sospeso viene emesso solo dopo l'ultima.
+    Ritorna (percorso, unità, funzione di chunking).
+    """
+    # Preflight: i PDF solo testo non hanno bisogno dei modelli di layout di Docling
+    preflight = inspect_pdf(file_path)
+    route, reason = choose_route(preflight)
+    stats['preflight'] = {
+        key: preflight[key] for key in ['page_count', 'avg_chars_per_page', 'images', 'max_paths_per_page']
+    }
+    stats['route_reason'] = reason
+    print(f"[RAG] Elaborazione PDF nativo (percorso: {route}, {reason})...")
+
+    skip_pages = set(doc_instance.ocr_pages) if doc_instance.document_type == 'mixed' else set()
+    chunker = Chunker()
+    if route == ROUTE_TEXT_LAYER:
+        if window_pages:
+            units = iter_text_page_windows(file_path, window_pages, stats=stats)
+        else:
+            units = [extract_text_pages(file_path, stats=stats)]
+        if skip_pages:
+            units = ({page: text for page, text in pages.items() if page not in skip_pages} for pages in units)
+        feed = lambda pages: chunker.feed_text_pages(pages, stats=stats)
+    else:
+        # Profilo scelto all'upload oppure in base al numero di pagine
+        if not doc_instance.processing_profile:
+            doc_instance.processing_profile = select_profile(preflight['page_count'])
+        stats['profile'] = doc_instance.processing_profile
+        print(f"[RAG] Profilo di elaborazione: {doc_instance.processing_profile}")
+
+        # Conversione PDF -> Docling un intervallo di pagine alla volta (o lettura dalla cache)
+        units = cached_pdf_docs(file_path, doc_instance.processing_profile, stats=stats, pages_per_range=window_pages,
+                                skip_pages=skip_pages)
+        feed = lambda doc: chunker.feed(doc, stats=stats)
+
+    units = chain(units, [_END_OF_UNITS])
+    chunk_fn = lambda unit: chunker.finish() if unit is _END_OF_UNITS else feed(unit)
+
+    # Le unità vengono spezzate in ordine da un solo thread: la numerazione è stabile tra le esecuzioni
+    positions = count()
+    numbered_chunk_fn = chunk_fn
+    chunk_fn = lambda unit: _with_native_ids(doc_instance.pk, numbered_chunk_fn(unit), positions)
+
+    return route, units, chunk_fn
+
+
+def _chunk_metadata(doc_instance):
+    """Metadata comuni a tutti i chunk del documento."""
+    return {
+        "source_title": doc_instance.title,
+        "document_id": doc_instance.pk,
+        "uploader": doc_instance.uploader.username,
+        "document_type": doc_instance.document_type,
+    }
+
+
 @shared_task
-def index_document_rag(document_pk):
+def index_ocr_pages(document_pk, task_id, pages):
+    """
+    Indicizza subito le pagine OCR ricevute con un aggiornamento di progresso
+    ([{"page": n, "text": ...}], numerate come nel testo OCR finale), così le
+    prime pagine di una scansione lunga sono ricercabili prima della fine
+    dell'OCR. I chunk hanno id deterministici: pagine ricevute più volte
+    vengono saltate, e a OCR completato index_document_rag indicizza solo le
+    pagine mancanti.
+    """
+    try:
+        doc_instance = Document.objects.get(pk=document_pk)
+        if doc_instance.ocr_task_id != task_id or doc_instance.processing_state not in OCR_ACTIVE_STATES:
+            return
+
+        collection = init_chromadb(COLLECTION_NAME)
+        indexed = get_ocr_chunk_pages(collection, document_pk)
+        stats = {}
+        units, chunk_fn = _ocr_source(
+            doc_instance, stats,
+            pages={int(page['page']): page['text'] for page in pages},
+            skip_pages=set(indexed),
+        )
+        report = IngestPipeline(collection, document_pk, chunk_fn, metadata=_chunk_metadata(doc_instance)).run(units)
+
+        page_count = len(get_ocr_chunk_pages(collection, document_pk))
+        Document.objects.filter(pk=document_pk, ocr_task_id=task_id, processing_state__in=OCR_ACTIVE_STATES).update(
+            processing_state='partially_indexed',
+            processing_output=f"OCR in corso: {page_count} pagine già ricercabili",
+        )
+        publish_documents(document_pk)
+        print(f"[RAG] {report['chunks']} chunk indicizzati in anticipo per il documento {document_pk}")
+
+    except Exception as e:
+        # Le pagine verranno indicizzate comunque a OCR completato
+        print(f"[RAG] ERRORE durante l'indicizzazione incrementale per ID {document_pk}: {e}")
+
+
+def _indexing_progress(doc_instance, early_chunks):
+    """Callback on_progress della IngestPipeline: pubblica i chunk indicizzati al più ogni PROGRESS_MIN_INTERVAL secondi."""
+    last = 0.0
+
+    def on_progress(chunks, units):
+        nonlocal last
+        now = time.monotonic()
+        if now - last >= PROGRESS_MIN_INTERVAL:
+            last = now
+            publish_stage(doc_instance, 'indexing', f"Indexing: {early_chunks + chunks} chunks stored in ChromaDB...")
+
+    return on_progress
+
+
+def _tagged(tag, units):
+    for unit in units:
+        yield tag, unit
+
+
+@shared_task(bind=True)
+def index_document_rag(self, document_pk):
     """
     Task asincrono per l'indicizzazione RAG di un documento.
-    Gestisce sia PDF nativi che documenti con OCR completato.
+    Gestisce PDF nativi, documenti con OCR completato e PDF misti
+    (pagine native + pagine OCR).
+    Conversione, chunking, embedding e inserimento in ChromaDB procedono
+    come fasi concorrenti della IngestPipeline.
+    Al termine il posto nella coda passa al prossimo documento in attesa.
+    Un lease per documento scarta le copie duplicate del task; se il
+    contenuto è cambiato nel frattempo (es. testo OCR arrivato durante
+    l'indicizzazione) il documento viene reindicizzato una volta al termine.
     """
+    doc_instance = Document.objects.filter(pk=document_pk).first()
+    if doc_instance is None:
+        print(f"[RAG] Documento {document_pk} non trovato: indicizzazione annullata")
+        return
+    lease = DocumentLease('index', document_pk, _content_fingerprint(doc_instance), coalesce=True)
+    if not lease.acquire():
+        changed = "contenuto cambiato, verrà reindicizzato al termine" if lease.holder != lease.fingerprint else "duplicato scartato"
+        print(f"[RAG] Indicizzazione del documento {document_pk} già in corso: {changed}")
+        return
+
+    stats = {}
     try:
-        doc_instance = get_object_or_404(Document, pk=document_pk)
+        # Stato aggiornato dopo aver ottenuto il lease
+        doc_instance.refresh_from_db()
         
         print(f"[RAG] Inizio indicizzazione per: {doc_instance.title}")
+        sources = {}
+        collection = init_chromadb(COLLECTION_NAME)
+        early_chunks = 0
+        indexed = {}
+
+        # I documenti molto grandi vengono elaborati a finestre di pagine
+        window_pages = _window_pages(doc_instance)
+        if window_pages:
+            stats['window_pages'] = window_pages
+            print(f"[RAG] Documento di grandi dimensioni: elaborazione a finestre di {window_pages} pagine")
         
-        if doc_instance.document_type == 'scanned':
+        if doc_instance.document_type in ['scanned', 'mixed']:
             if not doc_instance.ocr_text:
                 print(f"[RAG] ERRORE: Nessun testo OCR disponibile per documento {document_pk}")
                 doc_instance.processing_state = 'failed'
                 doc_instance.processing_output = "Errore: testo OCR non disponibile"
                 doc_instance.save()
+                publish_documents(document_pk)
                 return
             
             print(f"[RAG] Creazione chunks da testo OCR...")
-            doc_instance.processing_state = 'rag_processing'
-            doc_instance.save()
+            doc_instance.processing_route = 'ocr'
+            # Pagine già indicizzate durante l'OCR (index_ocr_pages); un documento già
+            # indicizzato (es. rechunk_documents) viene invece ricalcolato per intero
+            if not doc_instance.is_processed:
+                indexed = get_ocr_chunk_pages(collection, document_pk)
+            if indexed:
+                early_chunks = sum(indexed.values())
+                stats['ocr_pages_indexed_early'] = len(indexed)
+                print(f"[RAG] {len(indexed)} pagine OCR già indicizzate durante l'OCR")
+            sources['ocr'] = _ocr_source(doc_instance, stats, window_pages, skip_pages=set(indexed))
             
-            chunks = create_chunks_scannedpdf(
-                doc_instance.ocr_text, 
-                doc_instance.title
-            )
-            
-        else:
+        if doc_instance.document_type in ['native', 'mixed']:
             file_path = doc_instance.file.path
             
             if not os.path.exists(file_path):
@@ -209,42 +1067,163 @@ def index_document_rag(document_pk):
                 doc_instance.processing_state = 'failed'
                 doc_instance.processing_output = "Errore: file non trovato"
                 doc_instance.save()
+                publish_documents(document_pk)
                 return
                 
-            print(f"[RAG] Elaborazione PDF nativo...")
-            doc_instance.processing_state = 'rag_processing'
-            doc_instance.save()
-            
-            # Conversione PDF -> Docling
-            document = convert_pdf_to_doc(file_path)
-            chunks = create_chunks(document)
+            route, units, chunk_fn = _native_source(doc_instance, file_path, stats, window_pages)
+            doc_instance.processing_route = route
+            sources['native'] = (units, chunk_fn)
+
+        doc_instance.processing_state = 'rag_processing'
+        doc_instance.save()
+        publish_documents(document_pk)
+
+        # Le unità di tutte le sorgenti scorrono nella stessa pipeline
+        units = chain(*(_tagged(tag, source_units) for tag, (source_units, _) in sources.items()))
+        chunk_fn = lambda item: sources[item[0]][1](item[1])
         
-        # Aggiungi metadata comuni
-        for c in chunks:
-            c["metadata"]["source_title"] = doc_instance.title
-            c["metadata"]["document_id"] = document_pk
-            c["metadata"]["uploader"] = doc_instance.uploader.username
-            c["metadata"]["document_type"] = doc_instance.document_type
-
-        # Setup del DB e indicizzazione
-        print(f"[RAG] Indicizzazione {len(chunks)} chunks in ChromaDB...")
-        collection = init_chromadb(COLLECTION_NAME)
-        add_chunks_to_db(collection, chunks, document_pk)
+        # Metadata comuni a tutti i chunk
+        metadata = _chunk_metadata(doc_instance)
+
+        # Indicizzazione in streaming
+        print(f"[RAG] Indicizzazione in ChromaDB...")
+        # A finestre teniamo in coda una sola unità per fase
+        monitor = MemoryMonitor()
+        pipeline = IngestPipeline(collection, document_pk, chunk_fn, metadata=metadata,
+                                  queue_size=1 if window_pages else None, memory_monitor=monitor,
+                                  on_progress=_indexing_progress(doc_instance, early_chunks))
+        # Dopo l'interruzione della pipeline, le conversioni nei processi figli vengono terminate subito
+        monitor.listeners.append(lambda error: terminate_range_pool())
+        try:
+            with monitor:
+                report = pipeline.run(units)
+        finally:
+            stats['memory'] = monitor.report()
+            print(f"[RAG] Picco memoria residente: {stats['memory']['peak_rss_mb']} MB")
+        chunk_count = report['chunks'] + early_chunks
+
+        # Gli ID sono deterministici: restano da togliere solo i chunk di indicizzazioni
+        # precedenti non più prodotti (o con UUID), tenendo le pagine OCR già indicizzate
+        keep_ids = pipeline.inserted_ids + [
+            ocr_chunk_id(document_pk, page, index) for page, page_chunks in indexed.items() for index in range(page_chunks)
+        ]
+        stale_chunks = delete_stale_chunks(collection, document_pk, keep_ids)
+        if stale_chunks:
+            stats['stale_chunks_removed'] = stale_chunks
+            print(f"[RAG] Rimossi {stale_chunks} chunk di un'indicizzazione precedente")
+
+        if doc_instance.processing_route == ROUTE_TEXT_LAYER:
+            estimated_docling = stats['page_count'] * get_docling_seconds_per_page()
+            stats['estimated_seconds_saved'] = round(max(0, estimated_docling - stats['conversion_seconds']), 2)
 
         # Aggiorna stato documento
         doc_instance.is_processed = True
         doc_instance.processing_state = 'completed'
-        doc_instance.processing_output = f"✓ Indexed {len(chunks)} chunks in ChromaDB. Document is ready for semantic search."   
+        doc_instance.processing_output = f"✓ Indexed {chunk_count} chunks in ChromaDB. Document is ready for semantic search."   
+        stats['chunk_count'] = chunk_count
+        stats['ingest'] = report
+        doc_instance.processing_stats = stats
         doc_instance.save()
+        publish_documents(document_pk)
         
         print(f"[RAG] ✓ Indicizzazione completata per {doc_instance.title}")
 
+    except Document.DoesNotExist:
+        print(f"[RAG] Documento {document_pk} eliminato durante l'indicizzazione")
+
     except Exception as e:
         print(f"[RAG] ERRORE CRITICO durante indicizzazione per ID {document_pk}: {e}")
         import traceback
         traceback.print_exc()
         
-        doc_instance = Document.objects.get(pk=document_pk)
+        # Scarta le modifiche parziali in memoria prima di registrare l'errore
+        try:
+            doc_instance.refresh_from_db()
+        except Document.DoesNotExist:
+            return
         doc_instance.processing_state = 'failed'
         doc_instance.processing_output = f"Errore durante indicizzazione: {str(e)}"
+        doc_instance.processing_stats = stats
         doc_instance.save()
+        publish_documents(document_pk)
+
+    finally:
+        if lease.release():
+            print(f"[RAG] Contenuto del documento {document_pk} cambiato durante l'indicizzazione: nuova indicizzazione")
+            queue_indexing(document_pk)
+        # Chiamato direttamente (es. rechunk_documents) il task non occupa posti nelle code
+        elif not self.request.called_directly:
+            schedule_indexing.delay()
+
+
+@shared_task
+def ingest_bulk_job(job_pk):
+    """
+    Crea in blocco i documenti di un BulkIngestJob e, se richiesto, ne avvia
+    l'elaborazione con dispatch_bulk_job.
+    """
+    job = BulkIngestJob.objects.get(pk=job_pk)
+    try:
+        created = create_documents(job)
+    except Exception as e:
+        print(f"[RAG] ERRORE durante la creazione dei documenti del job {job.name}: {e}")
+        job.state = 'failed'
+        job.errors.append({'file': job.name, 'error': str(e)})
+        job.finished_at = timezone.now()
+        job.save()
+        return
+    finally:
+        cleanup_staging(job)
+
+    print(f"[RAG] Job {job.name}: {created} documenti creati, {len(job.errors)} file scartati")
+    if job.auto_process and created:
+        job.state = 'processing'
+        job.save(update_fields=['state', 'updated_at'])
+        dispatch_bulk_job.delay(job_pk)
+    else:
+        # I documenti restano 'pending' e si elaborano singolarmente dalla dashboard
+        job.state = 'completed'
+        job.finished_at = timezone.now()
+        job.save(update_fields=['state', 'finished_at', 'updated_at'])
+
+
+@shared_task
+def dispatch_bulk_job(job_pk):
+    """
+    Avvia a ondate l'elaborazione dei documenti 'pending' del job, con al più
+    BULK_INGEST_MAX_CONCURRENCY documenti in corso alla volta: i nativi
+    passano per schedule_indexing, gli scansionati e i misti per la coda OCR. Il task si rischedula ogni
+    BULK_INGEST_DISPATCH_INTERVAL secondi finché il job non è completato,
+    aggiornandone l'avanzamento aggregato.
+    """
+    job = refresh_job_progress(BulkIngestJob.objects.get(pk=job_pk))
+    if job.state != 'processing':
+        print(f"[RAG] Job {job.name} {job.state}: {job.completed_count} completati, {job.failed_count} falliti")
+        return
+
+    slots = BULK_INGEST_MAX_CONCURRENCY - job.in_progress_count
+    native, scanned = [], []
+    if slots > 0:
+        candidates = job.documents.filter(processing_state='pending').order_by('pk').only('pk', 'document_type')[:slots]
+        for doc_instance in candidates:
+            # Update condizionale: un documento avviato nel frattempo dalla dashboard non parte due volte
+            pending = Document.objects.filter(pk=doc_instance.pk, processing_state='pending', is_processed=False)
+            if doc_instance.document_type in ['scanned', 'mixed']:
+                if pending.update(processing_state='ocr_queued', ocr_task_id='',
+                                  processing_output="Document sent for OCR processing on GPU server."):
+                    scanned.append(doc_instance.pk)
+            elif pending.update(processing_state='rag_queued', processing_output="Waiting for an indexing slot."):
+                native.append(doc_instance.pk)
+
+    if native or scanned:
+        publish_documents(*native, *scanned)
+    if native:
+        schedule_indexing.delay()
+    # Con l'invio batch basta un solo submit_ocr_batch per tutti i documenti in coda
+    for pk in scanned[:1] if OCR_BATCH_ENABLED else scanned:
+        enqueue_ocr(pk)
+
+    if native or scanned:
+        print(f"[RAG] Job {job.name}: avviati {len(native)} documenti nativi e {len(scanned)} OCR "
+              f"({job.in_progress_count} già in corso)")
+    dispatch_bulk_job.apply_async(args=[job_pk], countdown=BULK_INGEST_DISPATCH_INTERVAL)
@@ -1,3 +1,1000 @@
-from django.test import TestCase
+import hashlib
+import hmac
+import io
+import json
+import os
+import queue
+import re
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import requests
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import leases, progress, tasks
+from .models import Document
+from .ocr_client import MAX_UPLOAD_RESTARTS, OcrClient, OcrUploadError
+from .rag_pipeline import config, ingest, memory, parse_cache, preflight, processing
+from .rag_pipeline.boilerplate import BoilerplateDetector, strip_boilerplate_pages
+from .rag_pipeline.embedding import add_chunks_to_db, get_ocr_chunk_pages, native_chunk_id, ocr_chunk_id
+from .rag_pipeline.ingest import IngestPipeline
+from .rag_pipeline.preflight import ROUTE_DOCLING, ROUTE_TEXT_LAYER, choose_route
+from .rag_pipeline.processing import (
+    Chunker, SEGMENT_HEADING, SEGMENT_TABLE, SEGMENT_TEXT, _clean_markdown, _iter_table_spans, _page_ranges,
+    iter_page_segments, iter_pdf_docs, split_markdown_table, split_table_rows,
+)
+
+
+def _docling_doc(items):
+    """Documento in stile Docling da una lista di (etichetta, pagina, testo)."""
+    texts, pictures, children = [], [], []
+    for label, page_no, text in items:
+        collection, kind = (pictures, 'pictures') if label == 'PICTURE' else (texts, 'texts')
+        ref = f"#/{kind}/{len(collection)}"
+        collection.append(SimpleNamespace(
+            self_ref=ref,
+            label=SimpleNamespace(name=label),
+            prov=[SimpleNamespace(page_no=page_no)],
+            text=text,
+            captions=[],
+        ))
+        children.append(SimpleNamespace(cref=ref))
+    return SimpleNamespace(texts=texts, tables=[], pictures=pictures, body=SimpleNamespace(children=children))
+
+
+class FakeConverter:
+    """Converter Docling che restituisce le pagine indicate e registra gli intervalli richiesti."""
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.ranges = []
+
+    def convert(self, filename, page_range=None):
+        self.ranges.append(page_range)
+        start, end = page_range or (1, len(self.pages))
+        return SimpleNamespace(document=_docling_doc([self.pages[page] for page in range(start, end + 1)]))
+
+
+@mock.patch.object(preflight, 'get_max_paths_per_page', return_value=20)
+@mock.patch.object(preflight, 'get_max_images', return_value=0)
+@mock.patch.object(preflight, 'get_min_chars_per_page', return_value=200)
+@mock.patch.object(preflight, 'is_fast_path_enabled', return_value=True)
+class RoutingTests(SimpleTestCase):
+    """Instradamento dei PDF nativi: text layer diretto per i documenti solo testo, Docling per gli altri."""
+
+    def _report(self, chars=1000, images=0, paths=0, page_count=2):
+        return {'page_count': page_count, 'avg_chars_per_page': chars, 'images': images, 'max_paths_per_page': paths}
+
+    def test_text_only_document_uses_text_layer(self, *_):
+        self.assertEqual(choose_route(self._report())[0], ROUTE_TEXT_LAYER)
+
+    def test_layout_features_use_docling(self, *_):
+        for report in (self._report(chars=50), self._report(images=1), self._report(paths=21), self._report(page_count=0)):
+            with self.subTest(report=report):
+                self.assertEqual(choose_route(report)[0], ROUTE_DOCLING)
+
+    def test_disabled_fast_path_uses_docling(self, is_fast_path_enabled, *_):
+        is_fast_path_enabled.return_value = False
+
+        self.assertEqual(choose_route(self._report()), (ROUTE_DOCLING, "fast path disabilitato"))
+
+
+class MixedPdfConversionTests(SimpleTestCase):
+    """PDF misti: le pagine inviate all'OCR non passano da Docling né dal Chunker."""
+
+    PAGES = {
+        1: ('TEXT', 1, "Testo nativo della prima pagina."),
+        2: ('PICTURE', 2, None),
+        3: ('TEXT', 3, "Testo nativo della terza pagina."),
+    }
+
+    def test_page_ranges_skip_ocr_pages(self):
+        self.assertEqual(_page_ranges(3, 40, {2}), [(1, 1), (3, 3)])
+        self.assertEqual(_page_ranges(10, 4, {5, 6}), [(1, 4), (7, 10)])
+        self.assertEqual(_page_ranges(100, 40), [(1, 40), (41, 80), (81, 100)])
+        self.assertEqual(_page_ranges(2, 40, {1, 2}), [])
+
+    def test_native_scanned_native_keeps_native_text(self):
+        converter = FakeConverter(self.PAGES)
+        with mock.patch.object(processing, 'get_pdf_page_count', return_value=3), \
+                mock.patch.object(processing, 'get_converter', return_value=(converter, 0.0)):
+            docs = list(iter_pdf_docs('mixed.pdf', profile='balanced', skip_pages={2}))
+
+        self.assertEqual(converter.ranges, [(1, 1), (3, 3)])
+        chunks = list(Chunker(max_tokens=0, strip_boilerplate=False).iter_chunks(docs))
+        content = "\n".join(chunk["content"] for chunk in chunks)
+        self.assertIn("Testo nativo della prima pagina.", content)
+        self.assertIn("Testo nativo della terza pagina.", content)
+        self.assertNotIn(2, [chunk["metadata"]["page"] for chunk in chunks])
+        self.assertNotIn("Riferimento a immagine", content)
+
+
+
+class ProfileSelectionTests(SimpleTestCase):
+    """Scelta del profilo Docling in base al numero di pagine."""
+
+    RULES = [{'max_pages': 20, 'profile': 'full'}, {'max_pages': 300, 'profile': 'balanced'}, {'profile': 'fast'}]
+
+    @mock.patch.object(processing, 'get_profile_size_rules', return_value=RULES)
+    def test_first_matching_rule_wins(self, _):
+        self.assertEqual(processing.select_profile(1), 'full')
+        self.assertEqual(processing.select_profile(20), 'full')
+        self.assertEqual(processing.select_profile(21), 'balanced')
+        self.assertEqual(processing.select_profile(5000), 'fast')
+
+    @mock.patch.object(processing, 'get_default_profile', return_value='balanced')
+    @mock.patch.object(processing, 'get_profile_size_rules', return_value=[{'max_pages': 20, 'profile': 'full'}])
+    def test_no_matching_rule_uses_default(self, *_):
+        self.assertEqual(processing.select_profile(21), 'balanced')
+
+    def test_selectable_profiles_are_preloaded(self):
+        selectable = {rule['profile'] for rule in config.get_profile_size_rules()} | {config.get_default_profile()}
+
+        self.assertLessEqual(selectable, set(config.get_preload_profiles()))
+
+@mock.patch('doc_manager.rag_pipeline.boilerplate.get_boilerplate_min_ratio', return_value=0.5)
+@mock.patch('doc_manager.rag_pipeline.boilerplate.get_boilerplate_min_pages', return_value=3)
+class BoilerplateTests(SimpleTestCase):
+    """Righe ripetute su più pagine (intestazioni, piè di pagina) rimosse prima del chunking."""
+
+    HEADER = "Manuale tecnico ACME - riservato"
+    BODIES = {1: "Introduzione al prodotto", 2: "Installazione del sistema", 3: "Configurazione di rete", 4: "Manutenzione periodica"}
+
+    def _window(self, *page_numbers):
+        return {page: f"{self.HEADER}\n{self.BODIES[page]}" for page in page_numbers}
+
+    def test_repeated_lines_are_removed(self, *_):
+        pages, saved = strip_boilerplate_pages(self._window(1, 2, 3, 4))
+
+        self.assertEqual(saved, 4 * len(self.HEADER))
+        self.assertEqual(pages, self.BODIES)
+
+    def test_too_few_pages_are_kept(self, *_):
+        pages, saved = strip_boilerplate_pages(self._window(3, 4))
+
+        self.assertEqual(saved, 0)
+        self.assertIn(self.HEADER, pages[3])
+
+    def test_counts_carry_across_windows(self, *_):
+        detector = BoilerplateDetector()
+        strip_boilerplate_pages(self._window(1, 2), detector)
+        pages, saved = strip_boilerplate_pages(self._window(3, 4), detector)
+
+        self.assertEqual(saved, 2 * len(self.HEADER))
+        self.assertNotIn(self.HEADER, pages[3] + pages[4])
+        self.assertEqual(pages[4].strip(), self.BODIES[4])
+
+
+class ChunkerTests(SimpleTestCase):
+    """Chunker a caratteri: buffer del testo, overlap e blocchi autonomi."""
+
+    def _chunker(self):
+        return Chunker(max_chunk_size=100, overlap=10, strip_boilerplate=False, max_tokens=0)
+
+    def test_text_is_buffered_until_budget(self):
+        doc = _docling_doc([('TEXT', 1, "a" * 40), ('TEXT', 1, "b" * 40), ('TEXT', 2, "c" * 40)])
+        chunks = list(self._chunker().iter_chunks(doc))
+
+        self.assertEqual([chunk["content"] for chunk in chunks], ["a" * 40 + "\n" + "b" * 40, "b" * 10 + "\n" + "c" * 40])
+        self.assertEqual([chunk["metadata"] for chunk in chunks], [{"page": 2, "type": "text"}] * 2)
+
+    def test_blocks_interrupt_text_without_overlap(self):
+        doc = _docling_doc([('TEXT', 1, "Testo prima"), ('PICTURE', 1, None), ('TEXT', 2, "Testo dopo")])
+        chunks = list(self._chunker().iter_chunks(doc))
+
+        self.assertEqual([chunk["metadata"]["type"] for chunk in chunks], ["text", "image", "text"])
+        self.assertEqual(chunks[2]["content"], "Testo dopo")
+
+    def test_units_continue_the_same_buffer(self):
+        first = _docling_doc([('TEXT', 1, "a" * 40)])
+        second = _docling_doc([('TEXT', 2, "b" * 40), ('TEXT', 2, "c" * 40)])
+        chunker = self._chunker()
+
+        self.assertEqual(list(chunker.feed(first)), [])
+        chunks = list(chunker.feed(second)) + list(chunker.finish())
+
+        self.assertEqual(chunks, list(self._chunker().iter_chunks([first, second])))
+        self.assertEqual(chunks[0]["content"], "a" * 40 + "\n" + "b" * 40)
+
+    def test_iter_chunks_resets_previous_document(self):
+        chunker = self._chunker()
+        list(chunker.feed(_docling_doc([('TEXT', 1, "resto del documento precedente")])))
+        chunks = list(chunker.iter_chunks(_docling_doc([('TEXT', 1, "nuovo documento")])))
+
+        self.assertEqual([chunk["content"] for chunk in chunks], ["nuovo documento"])
+
+
+class OcrSegmentTests(SimpleTestCase):
+    """Scanner lineare di titoli, testo e tabelle del markdown OCR."""
+
+    def test_page_segments(self):
+        text = "# Titolo\nTesto intro\n| a | b |\n|---|---|\n| 1 | 2 |\nTesto finale\n"
+
+        self.assertEqual(list(iter_page_segments(text)), [
+            (SEGMENT_HEADING, "Titolo"),
+            (SEGMENT_TEXT, "# Titolo\nTesto intro"),
+            (SEGMENT_TABLE, "| a | b |\n|---|---|\n| 1 | 2 |"),
+            (SEGMENT_TEXT, "Testo finale"),
+        ])
+
+    def test_table_spans(self):
+        self.assertEqual(list(_iter_table_spans("solo testo\nsenza tabelle")), [])
+        text = "| a |\n| b |\ntesto\n| c |"
+        self.assertEqual([text[start:end] for start, end in _iter_table_spans(text)], ["| a |\n| b |", "| c |"])
+
+    def test_table_at_end_of_page(self):
+        self.assertEqual(list(iter_page_segments("Testo\n| x | y |")), [
+            (SEGMENT_TEXT, "Testo"),
+            (SEGMENT_TABLE, "| x | y |"),
+        ])
+
+
+def _reference_clean_markdown(text):
+    """_clean_markdown prima delle passate precompilate: l'output deve restare identico."""
+    text = re.sub(r'^#{1,6}\s+', '', text, flags=re.MULTILINE)
+    text = re.sub(r'\*\*(.+?)\*\*', r'\1', text)
+    text = re.sub(r'__(.+?)__', r'\1', text)
+    text = re.sub(r'\*(.+?)\*', r'\1', text)
+    text = re.sub(r'_(.+?)_', r'\1', text)
+    text = re.sub(r'`(.+?)`', r'\1', text)
+    text = re.sub(r'\[(.+?)\]\(.+?\)', r'\1', text)
+    text = re.sub(r'!\[.*?\]\(.+?\)', '', text)
+    text = re.sub(r'```[\s\S]*?```', '', text)
+    text = re.sub(r'^[\-_\*]{3,}$', '', text, flags=re.MULTILINE)
+    text = re.sub(r'^>\s+', '', text, flags=re.MULTILINE)
+    text = re.sub(r'^[\-\*\+]\s+', '', text, flags=re.MULTILINE)
+    text = re.sub(r'\n{3,}', '\n\n', text)
+    text = re.sub(r' {2,}', ' ', text)
+    return text.strip()
+
+
+class MarkdownCleanupTests(SimpleTestCase):
+    """Passate di pulizia precompilate: stesso output dei re.sub originali."""
+
+    def test_clean_markdown(self):
+        text = "## Titolo\n**grassetto** e *corsivo* con `codice` e [link](http://x.it)\n> citazione\n- voce\n\n\n\nfine  testo"
+
+        self.assertEqual(_clean_markdown(text), "Titolo\ngrassetto e corsivo con codice e link\ncitazione\nvoce\n\nfine testo")
+
+    def test_clean_markdown_matches_reference(self):
+        samples = [
+            "",
+            "testo semplice senza markup",
+            "a ## non titolo\n### titolo\n#senza spazio\n>non citazione\n> citazione\nx > y",
+            "***\n---\n___\n* voce\n+ voce\n-- non voce\n1. numerata",
+            "```\ncodice\n```\n![immagine](img.png) e __sottolineato__ e _corsivo_",
+            "#\n\n#  \n>\n>> doppia",
+        ]
+        for text in samples:
+            with self.subTest(text=text):
+                self.assertEqual(_clean_markdown(text), _reference_clean_markdown(text))
+
+
+class ParseCacheTests(SimpleTestCase):
+    """Voci della cache Docling: una nuova conversione sostituisce quelle precedenti dello stesso file."""
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        patcher = mock.patch.object(parse_cache, 'get_parse_cache_dir', return_value=self.cache_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.pdf = os.path.join(self.cache_dir, 'documento.pdf')
+        with open(self.pdf, 'wb') as f:
+            f.write(b'%PDF-1.4 documento')
+        self.file_hash = parse_cache.file_sha256(self.pdf)
+
+    def _entry(self, file_hash, version):
+        path = parse_cache.cache_path(file_hash, version)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, 'wb').close()
+        return path
+
+    @mock.patch.object(parse_cache, 'is_parse_cache_enabled', return_value=True)
+    def test_new_conversion_replaces_previous_entries(self, _):
+        previous = self._entry(self.file_hash, 'v1-precedente')
+        other_file = self._entry('f' * 64, 'v1-precedente')
+        doc = mock.Mock()
+        doc.export_to_dict.return_value = {'name': 'documento'}
+
+        with mock.patch.object(parse_cache, 'iter_pdf_docs', return_value=iter([doc])):
+            self.assertEqual(list(parse_cache.cached_pdf_docs(self.pdf, 'balanced')), [doc])
+
+        current = parse_cache.cache_path(self.file_hash, parse_cache.parse_version('balanced'))
+        self.assertFalse(os.path.exists(previous))
+        self.assertEqual(parse_cache._file_entries(self.file_hash), [current])
+        self.assertTrue(os.path.exists(other_file))
+
+    def test_deleted_document_entries_are_removed(self):
+        for version in ('v1-a', 'v1-b'):
+            self._entry(self.file_hash, version)
+
+        parse_cache.delete_cached_parses(self.pdf)
+
+        self.assertEqual(parse_cache._file_entries(self.file_hash), [])
+
+
+class TableSplitTests(SimpleTestCase):
+    """Tabelle oltre il budget divise in gruppi di righe con l'intestazione ripetuta."""
+
+    HEADER = ["| a | b |", "|---|---|"]
+
+    def _rows(self, count):
+        return [f"| {i} | x |" for i in range(1, count + 1)]
+
+    def test_split_table_rows(self):
+        groups = split_table_rows(self.HEADER, self._rows(5), max_chunk_size=45, max_tokens=0)
+
+        self.assertEqual([(first, last) for first, last, _, _ in groups], [(1, 2), (3, 4), (5, 5)])
+        for _, _, lines, _ in groups:
+            self.assertEqual(lines[:2], self.HEADER)
+
+    def test_oversized_row_forms_its_own_group(self):
+        rows = ["| 1 | x |", "| " + "y" * 40 + " |", "| 3 | z |"]
+        groups = split_table_rows(self.HEADER, rows, max_chunk_size=25, max_tokens=0)
+
+        self.assertEqual([(first, last) for first, last, _, _ in groups], [(1, 1), (2, 2), (3, 3)])
+
+    def test_split_markdown_table(self):
+        table = "\n".join(self.HEADER + self._rows(5))
+        parts = split_markdown_table(table, max_chunk_size=45, max_tokens=0)
+
+        self.assertEqual([metadata for _, metadata in parts], [
+            {"row_start": 1, "row_end": 2, "table_rows": 5},
+            {"row_start": 3, "row_end": 4, "table_rows": 5},
+            {"row_start": 5, "row_end": 5, "table_rows": 5},
+        ])
+        self.assertTrue(all(markdown.startswith("\n".join(self.HEADER) + "\n") for markdown, _ in parts))
+
+    def test_small_table_is_not_split(self):
+        table = "\n".join(self.HEADER + self._rows(2))
+
+        self.assertEqual(split_markdown_table(table, max_chunk_size=1000, max_tokens=0), [(table, {})])
+
+    @mock.patch.object(processing, 'num_special_tokens', return_value=2)
+    @mock.patch.object(processing, 'count_tokens_batch', side_effect=lambda texts: [len(text.split()) for text in texts])
+    @mock.patch.object(processing, 'count_tokens', side_effect=lambda text: len(text.split()))
+    def test_measured_tokens_are_not_recounted(self, count_tokens, *_):
+        parts = split_markdown_table("\n".join(self.HEADER + self._rows(2)), max_chunk_size=0, max_tokens=14)
+
+        self.assertEqual([metadata["token_count"] for _, metadata in parts], [13, 13])
+        count_tokens.assert_not_called()
+
+        chunks = list(processing._ocr_text_chunks("uno due tre", 1, "titolo", None, 500, 0, max_tokens=14))
+        self.assertEqual(chunks[0]["metadata"]["token_count"], 5)
+        count_tokens.assert_called_once()
+
+
+MB = 1024 * 1024
+
+
+@mock.patch.object(memory, '_models_rss_mb', 0.0)
+@mock.patch.object(memory, '_baseline_rss_mb', None)
+class MemoryMonitorTests(SimpleTestCase):
+    """Limite di memoria per documento, relativo al baseline del worker."""
+
+    def _monitor(self):
+        return memory.MemoryMonitor(max_document_mb=100, interval=60)
+
+    def test_limit_is_relative_to_baseline(self):
+        monitor = self._monitor()
+        listener = mock.Mock()
+        monitor.listeners.append(listener)
+        with mock.patch.object(memory, 'current_rss_mb', return_value=1000.0) as current_rss_mb:
+            memory.set_baseline()
+            with monitor:
+                current_rss_mb.return_value = 1090.0
+                monitor.check()
+                current_rss_mb.return_value = 1200.0
+                with self.assertRaises(memory.MemoryLimitExceeded):
+                    monitor.check()
+
+        listener.assert_called_once()
+        self.assertTrue(monitor.report()['limit_exceeded'])
+
+    def test_model_loaded_after_baseline_is_not_counted(self):
+        with mock.patch.object(memory, 'current_rss_mb', return_value=1000.0):
+            memory.set_baseline()
+        with mock.patch.object(memory, 'process_rss_mb', side_effect=[1000.0, 1500.0]), memory.model_loading():
+            pass
+
+        self.assertEqual(memory.get_baseline(), 1500.0)
+        with mock.patch.object(memory, 'current_rss_mb', return_value=1550.0):
+            self._monitor().check()
+
+    def test_child_model_footprint_is_excluded(self):
+        footprints = queue.SimpleQueue()
+        memory.track_child_footprints(footprints)
+        self.addCleanup(memory.track_child_footprints, None)
+        footprints.put((42, 300.0))
+        child = mock.Mock(pid=42)
+        child.memory_info.return_value.rss = 350 * MB
+        process = mock.Mock()
+        process.memory_info.return_value.rss = 1000 * MB
+        process.children.return_value = [child]
+
+        with mock.patch.object(memory.psutil, 'Process', return_value=process):
+            self.assertEqual(memory.current_rss_mb(), 1050.0)
+
+
+@override_settings(OCR_CALLBACK_SECRET='segreto', OCR_CALLBACK_MAX_SKEW=300)
+@mock.patch('doc_manager.views.apply_ocr_update', return_value=True)
+class OcrCallbackTests(TestCase):
+    """Firma HMAC e limite di dimensione del callback del server GPU."""
+
+    def _post(self, body, signed_body=None, timestamp=None):
+        timestamp = str(int(time.time()) if timestamp is None else timestamp)
+        signed = body if signed_body is None else signed_body
+        signature = hmac.new(b'segreto', f"{timestamp}.".encode() + signed, hashlib.sha256).hexdigest()
+        return self.client.post(
+            reverse('ocr_callback'), data=body, content_type='application/json',
+            HTTP_X_OCR_TIMESTAMP=timestamp, HTTP_X_OCR_SIGNATURE=f"sha256={signature}",
+        )
+
+    def _body(self, text=""):
+        return json.dumps({'document_id': 5, 'task_id': 't-1', 'status': 'completed', 'text': text}).encode()
+
+    def test_valid_signature(self, apply_ocr_update):
+        response = self._post(self._body("testo"))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'applied': True})
+        apply_ocr_update.assert_called_once_with(5, 't-1', json.loads(self._body("testo")))
+
+    def test_tampered_body_is_rejected(self, apply_ocr_update):
+        response = self._post(self._body("testo modificato"), signed_body=self._body("testo"))
+
+        self.assertEqual(response.status_code, 403)
+        apply_ocr_update.assert_not_called()
+
+    def test_expired_timestamp_is_rejected(self, apply_ocr_update):
+        response = self._post(self._body(), timestamp=int(time.time()) - 3600)
+
+        self.assertEqual(response.status_code, 403)
+        apply_ocr_update.assert_not_called()
+
+    @override_settings(DATA_UPLOAD_MAX_MEMORY_SIZE=1024)
+    def test_body_over_data_upload_limit_is_accepted(self, apply_ocr_update):
+        response = self._post(self._body("x" * 4096))
+
+        self.assertEqual(response.status_code, 200)
+        apply_ocr_update.assert_called_once()
+
+    @override_settings(OCR_CALLBACK_MAX_BYTES=1024)
+    def test_body_over_callback_limit_is_rejected(self, apply_ocr_update):
+        response = self._post(self._body("x" * 4096))
+
+        self.assertEqual(response.status_code, 413)
+        apply_ocr_update.assert_not_called()
+
+
+def _document(uploader, title, **fields):
+    return Document.objects.create(uploader=uploader, title=title, file=f"documents/{title}.pdf", **fields)
+
+
+@mock.patch.object(tasks, 'publish_documents')
+class ApplyOcrUpdateTests(TestCase):
+    """Aggiornamenti condizionali dello stato OCR: callback duplicati o fuori ordine non hanno effetto."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('uploader')
+        self.doc = _document(self.user, 'scansione', document_type='scanned',
+                             processing_state='ocr_processing', ocr_task_id='t-1')
+
+    def _refresh(self):
+        self.doc.refresh_from_db()
+        return self.doc
+
+    @mock.patch.object(tasks, 'queue_indexing')
+    def test_completed_is_applied_once(self, queue_indexing, _):
+        payload = {'status': 'completed', 'text': "testo OCR", 'page_count': 1}
+
+        self.assertTrue(tasks.apply_ocr_update(self.doc.pk, 't-1', payload))
+        self.assertFalse(tasks.apply_ocr_update(self.doc.pk, 't-1', payload))
+        queue_indexing.assert_called_once_with(self.doc.pk)
+        self.assertEqual(self._refresh().processing_state, 'ocr_completed')
+        self.assertEqual(self.doc.ocr_text, "testo OCR")
+
+    @mock.patch.object(tasks, 'queue_indexing')
+    def test_other_task_id_is_ignored(self, queue_indexing, _):
+        self.assertFalse(tasks.apply_ocr_update(self.doc.pk, 't-old', {'status': 'completed', 'text': "vecchio"}))
+        queue_indexing.assert_not_called()
+        self.assertEqual(self._refresh().processing_state, 'ocr_processing')
+
+    @mock.patch.object(tasks, 'queue_indexing')
+    def test_failed_after_completed_is_ignored(self, queue_indexing, _):
+        tasks.apply_ocr_update(self.doc.pk, 't-1', {'status': 'completed', 'text': "testo OCR"})
+
+        self.assertFalse(tasks.apply_ocr_update(self.doc.pk, 't-1', {'status': 'failed', 'error': "tardivo"}))
+        self.assertEqual(self._refresh().processing_state, 'ocr_completed')
+
+    def test_repeated_progress_is_not_applied(self, _):
+        payload = {'status': 'processing', 'progress': 40}
+
+        self.assertTrue(tasks.apply_ocr_update(self.doc.pk, 't-1', payload))
+        self.assertFalse(tasks.apply_ocr_update(self.doc.pk, 't-1', payload))
+        self.assertEqual(self._refresh().ocr_progress, 40)
+
+    @mock.patch.object(tasks, 'index_ocr_pages')
+    def test_progress_pages_are_indexed(self, index_ocr_pages, _):
+        pages = [{'page': 1, 'text': "prima pagina"}]
+
+        self.assertTrue(tasks.apply_ocr_update(self.doc.pk, 't-1', {'status': 'processing', 'progress': 10, 'pages': pages}))
+        index_ocr_pages.delay.assert_called_once_with(self.doc.pk, 't-1', pages)
+
+
+class GroupBySizeTests(SimpleTestCase):
+
+    def test_batches_follow_size_order_and_limits(self):
+        entries = [(10, 'a'), (50, 'b'), (20, 'c'), (30, 'd'), (200, 'e')]
+
+        self.assertEqual(tasks.group_by_size(entries, max_files=2, max_bytes=100), [['a', 'c'], ['d', 'b'], ['e']])
+
+    def test_byte_limit_splits_batches(self):
+        self.assertEqual(tasks.group_by_size([(60, 'a'), (60, 'b')], max_files=16, max_bytes=100), [['a'], ['b']])
+
+
+@mock.patch.object(tasks, 'publish_documents')
+class SubmitOcrBatchTests(TestCase):
+    """Presa in carico dei documenti in coda OCR e invio in batch multi-file."""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        user = User.objects.create_user('uploader')
+        self.docs = [_document(user, title, document_type='scanned', processing_state='ocr_queued') for title in ('uno', 'due')]
+        os.makedirs(os.path.join(self.media_root, 'documents'))
+        for doc in self.docs:
+            with open(doc.file.path, 'wb') as f:
+                f.write(b'%PDF-1.4 scansione')
+
+        self.client_mock = mock.Mock()
+        self.client_mock.breaker.retry_after.return_value = 0
+        patcher = mock.patch.object(tasks, 'get_ocr_client', return_value=self.client_mock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(tasks.submit_ocr_batch, 'apply_async')
+        self.apply_async = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _states(self):
+        return [(doc.processing_state, doc.ocr_task_id) for doc in Document.objects.order_by('pk')]
+
+    def test_documents_are_sent_in_one_request(self, _):
+        self.client_mock.submit_batch.return_value = SimpleNamespace(status_code=200, text='', json=lambda: {
+            'tasks': [{'document_id': doc.pk, 'task_id': f"gpu-{doc.pk}"} for doc in self.docs]
+        })
+        tasks.submit_ocr_batch()
+
+        self.client_mock.submit_batch.assert_called_once()
+        self.assertEqual(len(self.client_mock.submit_batch.call_args[0][0]), 2)
+        self.assertEqual(self._states(), [('ocr_processing', f"gpu-{doc.pk}") for doc in self.docs])
+        self.apply_async.assert_not_called()
+
+    def test_documents_claimed_by_another_run_are_skipped(self, _):
+        Document.objects.update(ocr_task_id=f"{tasks.OCR_CLAIM_PREFIX}altro")
+        tasks.submit_ocr_batch()
+
+        self.client_mock.submit_batch.assert_not_called()
+
+    def test_unanswered_request_is_not_resubmitted(self, _):
+        self.client_mock.submit_batch.side_effect = requests.ReadTimeout("read timeout")
+        tasks.submit_ocr_batch()
+
+        self.assertEqual(self._states(), [('ocr_failed', '')] * 2)
+        self.apply_async.assert_not_called()
+
+    def test_request_not_sent_is_deferred(self, _):
+        self.client_mock.submit_batch.side_effect = requests.ConnectTimeout("connect timeout")
+        tasks.submit_ocr_batch()
+
+        self.assertEqual(self._states(), [('ocr_queued', '')] * 2)
+        self.apply_async.assert_called_once_with(countdown=30)
+
+
+def _response(status_code, payload=None):
+    return mock.Mock(status_code=status_code, text="", json=mock.Mock(return_value=payload))
+
+
+class FakeUploadServer:
+    """Server GPU simulato per il protocollo di caricamento a blocchi."""
+
+    def __init__(self, data, offset=0, expirations=0):
+        self.digest = hashlib.sha256(data).hexdigest()
+        self.offset = offset
+        self.expirations = expirations
+        self.uploads = 0
+        self.chunk_offsets = []
+
+    def request(self, endpoint, method, path, **kwargs):
+        if endpoint == 'upload_status':
+            return _response(200, {'upload_id': 'u0', 'offset': self.offset, 'sha256': self.digest})
+        if endpoint == 'upload_create':
+            self.uploads += 1
+            self.offset = 0
+            return _response(200, {'upload_id': f'u{self.uploads}', 'offset': 0})
+        if endpoint == 'upload_chunk':
+            if self.expirations:
+                self.expirations -= 1
+                return _response(404)
+            self.chunk_offsets.append(int(kwargs['headers']['Upload-Offset']))
+            self.offset += len(kwargs['data'])
+            return _response(200, {'offset': self.offset})
+        return _response(200, {'task_id': 't-1'})
+
+
+@override_settings(OCR_UPLOAD_CHUNK_SIZE=4, OCR_HTTP_MAX_RETRIES=2)
+class ResumableUploadTests(SimpleTestCase):
+    """Caricamento a blocchi verso il server GPU: ripresa dall'offset confermato e caricamenti scaduti."""
+
+    DATA = b'%PDF-1.4 scansione'
+
+    def _upload(self, server, upload_id=None):
+        client = OcrClient(base_url='http://gpu')
+        progress = []
+        with mock.patch.object(client, 'request', side_effect=server.request):
+            task_id = client.upload_resumable(io.BytesIO(self.DATA), {'document_id': 1}, upload_id,
+                                              lambda upload_id, offset: progress.append((upload_id, offset)))
+        return task_id, progress
+
+    def test_upload_resumes_from_confirmed_offset(self):
+        server = FakeUploadServer(self.DATA, offset=8)
+
+        task_id, progress = self._upload(server, upload_id='u0')
+
+        self.assertEqual(task_id, 't-1')
+        self.assertEqual(server.uploads, 0)
+        self.assertEqual(server.chunk_offsets, [8, 12, 16])
+        self.assertEqual(progress[0], ('u0', 8))
+        self.assertEqual(progress[-1], ('u0', len(self.DATA)))
+
+    def test_changed_file_starts_a_new_upload(self):
+        server = FakeUploadServer(b'altro contenuto', offset=8)
+
+        self._upload(server, upload_id='u0')
+
+        self.assertEqual(server.uploads, 1)
+        self.assertEqual(server.chunk_offsets[0], 0)
+
+    def test_expired_upload_is_restarted_once(self):
+        self.assertEqual(self._upload(FakeUploadServer(self.DATA, expirations=1))[0], 't-1')
+
+        with self.assertRaises(OcrUploadError):
+            self._upload(FakeUploadServer(self.DATA, expirations=MAX_UPLOAD_RESTARTS + 1))
+
+
+@mock.patch.object(tasks, 'group')
+@mock.patch.object(tasks, 'publish_documents')
+@mock.patch.object(tasks, 'INGEST_MAX_PER_UPLOADER', 0)
+@mock.patch.object(tasks, 'INGEST_QUEUE_SLOTS', {'small': 4, 'medium': 2, 'large': 1})
+class ScheduleIndexingTests(TestCase):
+    """Posti delle code di indicizzazione per classe di dimensione, assegnati a turno tra gli utenti."""
+
+    def setUp(self):
+        self.alice = User.objects.create_user('alice')
+        self.bob = User.objects.create_user('bob')
+        self.arrival = timezone.now() - timedelta(minutes=10)
+
+    def _queued(self, uploader, count, page_count=5):
+        docs = []
+        for _ in range(count):
+            doc = _document(uploader, f"{uploader.username}-{Document.objects.count()}",
+                            processing_state='rag_queued', page_count=page_count)
+            # Ordine di arrivo esplicito: schedule_indexing ordina per updated_at
+            self.arrival += timedelta(seconds=1)
+            Document.objects.filter(pk=doc.pk).update(updated_at=self.arrival)
+            docs.append(doc)
+        return docs
+
+    def _started(self, docs):
+        return [doc.pk for doc in docs if Document.objects.get(pk=doc.pk).processing_state == 'rag_processing']
+
+    def test_free_slots_alternate_between_uploaders(self, *_):
+        alice_docs = self._queued(self.alice, 5)
+        bob_docs = self._queued(self.bob, 2)
+
+        self.assertEqual(tasks.schedule_indexing(), 4)
+        self.assertEqual(self._started(alice_docs), [doc.pk for doc in alice_docs[:2]])
+        self.assertEqual(self._started(bob_docs), [doc.pk for doc in bob_docs])
+
+    def test_max_per_uploader(self, *_):
+        alice_docs = self._queued(self.alice, 3)
+        bob_docs = self._queued(self.bob, 3)
+
+        with mock.patch.object(tasks, 'INGEST_MAX_PER_UPLOADER', 1):
+            self.assertEqual(tasks.schedule_indexing(), 2)
+        self.assertEqual(len(self._started(alice_docs)), 1)
+        self.assertEqual(len(self._started(bob_docs)), 1)
+
+    def test_large_documents_do_not_block_small_ones(self, *_):
+        _document(self.alice, 'manuale', processing_state='rag_processing', page_count=800)
+        large = self._queued(self.bob, 1, page_count=500)
+        small = self._queued(self.bob, 1)
+
+        self.assertEqual(tasks.schedule_indexing(), 1)
+        self.assertEqual(self._started(large), [])
+        self.assertEqual(self._started(small), [small[0].pk])
+
+    def test_interrupted_run_is_requeued_then_failed(self, *_):
+        doc = _document(self.alice, 'manuale', processing_state='rag_processing', page_count=800)
+        stale = timezone.now() - timedelta(seconds=tasks.INDEXING_STALE_AFTER + 60)
+
+        Document.objects.filter(pk=doc.pk).update(updated_at=stale)
+        self.assertEqual(tasks.schedule_indexing(), 1)
+        doc.refresh_from_db()
+        self.assertEqual(doc.processing_state, 'rag_processing')
+        self.assertEqual(doc.processing_stats['interrupted_runs'], 1)
+
+        Document.objects.filter(pk=doc.pk).update(updated_at=stale)
+        self.assertEqual(tasks.schedule_indexing(), 0)
+        doc.refresh_from_db()
+        self.assertEqual(doc.processing_state, 'failed')
+
+
+class FakeCollection:
+    """Collection ChromaDB in memoria: ID e metadati dei chunk, senza embedding."""
+
+    def __init__(self, ids=()):
+        self.items = {chunk_id: {"document_pk": chunk_id.split('-', 1)[0]} for chunk_id in ids}
+        self.deleted = []
+        # Chiamata con gli ID scritti dopo ogni add/upsert
+        self.on_write = None
+
+    def get(self, ids=None, where=None, include=None):
+        if ids is not None:
+            return {"ids": [chunk_id for chunk_id in ids if chunk_id in self.items]}
+        return {"ids": [chunk_id for chunk_id, meta in self.items.items() if meta["document_pk"] == where["document_pk"]]}
+
+    def upsert(self, documents, metadatas, embeddings, ids):
+        self.items.update(zip(ids, metadatas))
+        if self.on_write is not None:
+            self.on_write(ids)
+
+    add = upsert
+
+    def delete(self, ids):
+        self.deleted.extend(ids)
+        for chunk_id in ids:
+            self.items.pop(chunk_id, None)
+
+
+class FakeRedis:
+    """Sottoinsieme dei comandi Redis usati da DocumentLease."""
+
+    def __init__(self):
+        self.data = {}
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value.encode()
+        return True
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def getdel(self, key):
+        return self.data.pop(key, None)
+
+    def eval(self, script, numkeys, key, token):
+        if self.data.get(key) != token.encode():
+            return 0
+        del self.data[key]
+        return 1
+
+
+@mock.patch.object(leases, 'get_redis')
+class DocumentLeaseTests(SimpleTestCase):
+
+    def test_duplicate_with_same_content_is_discarded(self, get_redis):
+        get_redis.return_value = FakeRedis()
+        lease = leases.DocumentLease('index', 1, 'fp1')
+        duplicate = leases.DocumentLease('index', 1, 'fp1')
+
+        self.assertTrue(lease.acquire())
+        self.assertFalse(duplicate.acquire())
+        self.assertEqual(duplicate.holder, 'fp1')
+        self.assertFalse(lease.release())
+        self.assertTrue(duplicate.acquire())
+
+    def test_changed_content_is_coalesced_into_one_rerun(self, get_redis):
+        get_redis.return_value = FakeRedis()
+        lease = leases.DocumentLease('index', 1, 'fp1', coalesce=True)
+        self.assertTrue(lease.acquire())
+        for _ in range(2):
+            self.assertFalse(leases.DocumentLease('index', 1, 'fp2', coalesce=True).acquire())
+
+        self.assertTrue(lease.release())
+        rerun = leases.DocumentLease('index', 1, 'fp2', coalesce=True)
+        self.assertTrue(rerun.acquire())
+        self.assertFalse(rerun.release())
+
+    def test_release_keeps_a_lease_taken_over_by_another_task(self, get_redis):
+        redis_client = get_redis.return_value = FakeRedis()
+        lease = leases.DocumentLease('index', 1, 'fp1')
+        lease.acquire()
+        # Il lease è scaduto ed è stato preso da un'altra copia del task
+        redis_client.data[lease.key] = b'fp1:altro'
+
+        lease.release()
+        self.assertEqual(redis_client.data[lease.key], b'fp1:altro')
+
+    def test_redis_unavailable_runs_without_lease(self, get_redis):
+        get_redis.side_effect = leases.redis.RedisError("connessione rifiutata")
+
+        self.assertTrue(leases.DocumentLease('index', 1, 'fp1').acquire())
+
+
+
+class TaskLeaseTests(TestCase):
+    """Impronta del contenuto per i lease dei task e documenti eliminati prima dell'avvio."""
+
+    def setUp(self):
+        self.doc = _document(User.objects.create_user('uploader'), 'scansione', document_type='scanned')
+
+    def test_fingerprint_follows_content_not_state(self):
+        fingerprint = tasks._content_fingerprint(self.doc)
+        self.doc.processing_state = 'rag_processing'
+        self.doc.processing_output = "Indicizzazione in corso"
+        self.assertEqual(tasks._content_fingerprint(self.doc), fingerprint)
+
+        self.doc.ocr_text = "testo OCR"
+        self.assertNotEqual(tasks._content_fingerprint(self.doc), fingerprint)
+
+    @mock.patch.object(tasks, 'DocumentLease')
+    def test_deleted_document_is_skipped(self, document_lease):
+        document_pk = self.doc.pk
+        self.doc.delete()
+
+        self.assertIsNone(tasks.process_scanned_document(document_pk))
+        self.assertIsNone(tasks.index_document_rag(document_pk))
+        document_lease.assert_not_called()
+
+class ChunkIdTests(SimpleTestCase):
+    """ID deterministici dei chunk: scritture ripetute sovrascrivono, il rollback rimuove solo i nuovi."""
+
+    def test_chunk_ids(self):
+        self.assertEqual(native_chunk_id(7, 3), "7-c3")
+        self.assertEqual(ocr_chunk_id(7, 2, 0), "7-ocr-p2-0")
+
+    def test_ocr_ids_are_numbered_per_page(self):
+        chunks = [{"metadata": {"page": page}} for page in (1, 1, 2, 1)]
+
+        self.assertEqual([chunk["id"] for chunk in tasks._with_ocr_ids(7, chunks)],
+                         ["7-ocr-p1-0", "7-ocr-p1-1", "7-ocr-p2-0", "7-ocr-p1-2"])
+
+    def test_ocr_chunk_pages(self):
+        collection = FakeCollection(["7-ocr-p1-0", "7-ocr-p1-1", "7-ocr-p3-0", "7-c0", "8-ocr-p1-0"])
+
+        self.assertEqual(get_ocr_chunk_pages(collection, 7), {1: 2, 3: 1})
+
+    def test_add_chunks_reports_created_ids(self):
+        collection = FakeCollection(["7-c0"])
+        chunks = [{"id": native_chunk_id(7, i), "content": f"chunk {i}", "metadata": {"page": 1}} for i in range(2)]
+
+        self.assertEqual(add_chunks_to_db(collection, chunks, 7), (["7-c0", "7-c1"], ["7-c1"]))
+
+    def test_chunks_without_ids_get_uuids(self):
+        ids, created_ids = add_chunks_to_db(FakeCollection(), [{"content": "chunk", "metadata": {"page": 1}}], 7)
+
+        self.assertEqual(ids, created_ids)
+        self.assertEqual(len(ids), 1)
+
+    def test_failed_run_keeps_existing_chunks(self):
+        collection = FakeCollection(["7-c0"])
+        inserted = threading.Event()
+        collection.on_write = lambda ids: "7-c1" in ids and inserted.set()
+
+        def chunk_fn(unit):
+            if unit == 2:
+                inserted.wait(5)
+                raise RuntimeError("conversione fallita")
+            return [{"id": native_chunk_id(7, unit), "content": f"chunk {unit}", "metadata": {"page": unit + 1}}]
+
+        pipeline = IngestPipeline(collection, 7, chunk_fn, queue_size=1, embed_batch_size=1, insert_batch_size=1)
+        with mock.patch.object(ingest, 'embed_texts', side_effect=lambda texts: [[0.0]] * len(texts)), \
+                self.assertRaises(RuntimeError):
+            pipeline.run([0, 1, 2])
+
+        self.assertTrue(inserted.is_set())
+        self.assertEqual(collection.deleted, ["7-c1"])
+        self.assertEqual(list(collection.items), ["7-c0"])
+
+
+class FakePubSub:
+    """PubSub asincrono di redis con i messaggi già pubblicati sul canale."""
+
+    def __init__(self, messages):
+        self.messages = list(messages)
+        self.channels = []
+        self.closed = False
+
+    async def subscribe(self, name):
+        self.channels.append(name)
+
+    async def get_message(self, ignore_subscribe_messages=False, timeout=None):
+        return {'data': json.dumps(self.messages.pop(0))} if self.messages else None
+
+    async def aclose(self):
+        self.closed = True
+
+
+class ProgressEventsTests(TestCase):
+    """Avanzamento dei documenti pubblicato su Redis e inoltrato alla dashboard come SSE."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('uploader')
+        self.user.profile.is_uploader = True
+        self.user.profile.save()
+        self.doc = _document(self.user, 'manuale', processing_state='rag_processing')
+
+    @mock.patch.object(progress, 'get_redis')
+    def test_state_is_published_on_the_uploader_channel(self, get_redis):
+        progress.publish_documents(self.doc.pk, stage='index')
+
+        name, data = get_redis.return_value.publish.call_args.args
+        self.assertEqual(name, progress.channel(self.user.pk))
+        self.assertEqual(json.loads(data)['document'], self.doc.pk)
+        self.assertEqual(json.loads(data)['state'], 'rag_processing')
+        self.assertEqual(json.loads(data)['stage'], 'index')
+
+    @mock.patch.object(progress, 'get_redis')
+    def test_redis_errors_do_not_fail_the_task(self, get_redis):
+        get_redis.return_value.publish.side_effect = progress.redis.RedisError("connessione rifiutata")
+
+        progress.publish_documents(self.doc.pk)
+
+    def test_snapshot_covers_pending_and_recently_changed_documents(self):
+        done = _document(self.user, 'concluso', processing_state='completed', is_processed=True)
+        _document(User.objects.create_user('altro'), 'altrui')
+        since_ms = int(time.time() * 1000) - 60000
+
+        self.assertEqual([event['document'] for event in progress._snapshot(self.user.pk, None)], [self.doc.pk])
+        self.assertEqual(sorted(event['document'] for event in progress._snapshot(self.user.pk, since_ms)),
+                         [self.doc.pk, done.pk])
+
+    async def test_stream_sends_snapshot_then_published_events(self):
+        published = {'document': self.doc.pk, 'state': 'completed', 'ts': 2}
+        pubsub = FakePubSub([published])
+        client = mock.Mock(aclose=mock.AsyncMock(), pubsub=mock.Mock(return_value=pubsub))
+        snapshot = [{'document': self.doc.pk, 'state': 'rag_processing', 'ts': 1}]
+
+        with mock.patch.object(progress.aioredis.Redis, 'from_url', return_value=client), \
+                mock.patch.object(progress, '_snapshot', return_value=snapshot):
+            stream = progress.stream_events(self.user.pk)
+            lines = [await stream.__anext__() for _ in range(4)]
+            await stream.aclose()
+
+        self.assertEqual(pubsub.channels, [progress.channel(self.user.pk)])
+        self.assertTrue(lines[0].startswith("retry: "))
+        self.assertEqual(lines[1], progress._format_event(snapshot[0]))
+        self.assertEqual(lines[2], progress._format_event(published))
+        self.assertEqual(lines[3], ": keepalive\n\n")
+        self.assertTrue(pubsub.closed)
+
+    @mock.patch('doc_manager.views.stream_events', return_value=iter([]))
+    def test_events_view_resumes_from_last_event_id(self, stream_events):
+        self.client.force_login(self.user)
+
+        response = self.client.get(reverse('document_events'), HTTP_LAST_EVENT_ID='1700000000000')
+
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream_events.assert_called_once_with(self.user.pk, 1700000000000)
+
+    def test_events_view_requires_uploader(self):
+        self.client.force_login(User.objects.create_user('lettore'))
+
+        self.assertEqual(self.client.get(reverse('document_events')).status_code, 403)
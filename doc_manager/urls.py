@@ -8,7 +8,12 @@ urlpatterns = [
     path("process/<int:pk>/", views.DocumentProcessView.as_view(), name='document_process'),
     path("delete/<int:pk>/", views.DocumentDeleteView.as_view(), name='document_delete'),
     path('documents/rename/<int:pk>/', views.DocumentRenameView.as_view(), name='document_rename'),
+    path("bulk/upload/", views.BulkUploadView.as_view(), name='bulk_upload'),
+    path("bulk/<int:pk>/", views.BulkIngestJobDetailView.as_view(), name='bulk_job_detail'),
     path("dashboard/", views.UploaderDashboardView.as_view(), name='uploader_dashboard'),
+    path("dashboard/events/", views.document_events, name='document_events'),
+    path("dashboard/row/<int:pk>/", views.DocumentRowView.as_view(), name='document_row'),
     path("view/<int:pk>/", views.DocumentViewerView.as_view(), name='document_viewer'),
     path("file/<int:pk>/", views.serve_document_file, name='serve_document'),
+    path("ocr/callback/", views.ocr_callback, name='ocr_callback'),
 ]
\ No newline at end of file
@@ -1,5 +1,5 @@
-from django.http import Http404, FileResponse, HttpResponse
-from django.views.generic.edit import CreateView, UpdateView, DeleteView
+from django.http import Http404, FileResponse, HttpResponse, JsonResponse, HttpResponseForbidden, StreamingHttpResponse
+from django.views.generic.edit import CreateView, UpdateView, DeleteView, FormView
 from django.urls import reverse_lazy
 from django.views.generic import ListView, DetailView
 from django.shortcuts import get_object_or_404, redirect, render
@@ -7,15 +7,26 @@ from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django import forms
+from django.conf import settings
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from asgiref.sync import sync_to_async
+import hashlib
+import hmac
+import json
 import os
+import time
 from django.contrib import messages
 
-from .models import Document
+from .models import Document, BulkIngestJob
 from .mixins import SearcherRequiredMixin, UploaderRequiredMixin 
-from .tasks import index_document_rag, process_scanned_document
+from .tasks import queue_indexing, enqueue_ocr, apply_ocr_update, ingest_bulk_job, IN_PROGRESS_STATES
+from .bulk import staging_dir, refresh_job_progress
+from .progress import publish_documents, stream_events
 from .rag_pipeline.embedding import init_chromadb, delete_document_embeddings, add_chunks_to_db
+from .rag_pipeline.parse_cache import delete_cached_parses
 from .rag_pipeline.search import run_queries
-from .forms import DocumentUploadForm, DocumentRenameForm
+from .forms import DocumentUploadForm, DocumentRenameForm, BulkUploadForm
 from itertools import groupby
 from operator import itemgetter
 
@@ -40,6 +51,11 @@ class DocumentCreateView(UploaderRequiredMixin, CreateView):
                 self.request, 
                 f"Scanned document '{self.object.title}' uploaded. It will require OCR processing."
             )
+        elif doc_type == 'mixed':
+            messages.info(
+                self.request, 
+                f"Document '{self.object.title}' uploaded. {len(self.object.ocr_pages)} page(s) without text will require OCR processing."
+            )
         else:
             messages.success(
                 self.request, 
@@ -49,6 +65,69 @@ class DocumentCreateView(UploaderRequiredMixin, CreateView):
         return redirect(reverse_lazy('document_process', kwargs={'pk': self.object.pk}))    
 
 
+# View per il caricamento in blocco (più PDF o archivio ZIP)
+class BulkUploadView(UploaderRequiredMixin, FormView):
+    form_class = BulkUploadForm
+    template_name = 'doc_manager/bulk_upload_form.html'
+
+    def _stage(self, uploaded_file, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as destination:
+            for chunk in uploaded_file.chunks():
+                destination.write(chunk)
+
+    def form_valid(self, form):
+        files = form.cleaned_data['files']
+        archive = form.cleaned_data['archive']
+        job = BulkIngestJob.objects.create(
+            uploader=self.request.user,
+            name=archive.name if archive else f"{len(files)} files",
+            source='zip' if archive else 'upload',
+            document_type=form.cleaned_data['document_type'],
+            processing_profile=form.cleaned_data['processing_profile'],
+            auto_process=form.cleaned_data['process_now'],
+        )
+
+        # I file vengono parcheggiati su disco: i documenti li crea il worker
+        staging = staging_dir(job.pk)
+        if archive:
+            job.source_path = os.path.join(staging, 'archive.zip')
+            self._stage(archive, job.source_path)
+        else:
+            job.source_path = staging
+            # Una cartella per file, così due file con lo stesso nome non si sovrascrivono
+            for index, uploaded_file in enumerate(files):
+                self._stage(uploaded_file, os.path.join(staging, f"{index:05d}", os.path.basename(uploaded_file.name)))
+        job.save(update_fields=['source_path'])
+
+        ingest_bulk_job.delay(job.pk)
+        messages.info(self.request, f"Bulk upload '{job.name}' received. Documents are being created in background.")
+        return redirect('bulk_job_detail', pk=job.pk)
+
+
+# View per l'avanzamento di un caricamento in blocco
+class BulkIngestJobDetailView(UploaderRequiredMixin, DetailView):
+    model = BulkIngestJob
+    template_name = 'doc_manager/bulk_job_detail.html'
+    context_object_name = 'job'
+
+    def get_queryset(self):
+        return BulkIngestJob.objects.filter(uploader=self.request.user)
+
+    def get_object(self, queryset=None):
+        job = super().get_object(queryset)
+        if job.state == 'processing':
+            refresh_job_progress(job)
+        return job
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['failed_documents'] = self.object.documents.filter(
+            processing_state__in=['failed', 'ocr_failed']
+        ).order_by('title')
+        return context
+
+
 # View per la lista dei documenti
 class DocumentListView(SearcherRequiredMixin, ListView):
     model = Document
@@ -112,33 +191,47 @@ class DocumentProcessView(UpdateView):
 
     def form_valid(self, form):
         doc_instance = form.save(commit=False)
-    
-        if not Document.objects.get(pk=doc_instance.pk).is_processed:
-            
-            if doc_instance.document_type == 'scanned':
-                # Processing per PDF scansionati (con OCR)
-                process_scanned_document.delay(doc_instance.pk)
-                doc_instance.processing_state = 'ocr_queued'
-                doc_instance.processing_output = "Document sent for OCR processing on GPU server."
-                messages.info(
-                    self.request, 
-                    f"Scanned document '{doc_instance.title}' sent for OCR. This may take several minutes."
-                )
+        ocr = doc_instance.document_type in ['scanned', 'mixed']
+
+        # Presa in carico atomica: un doppio click o due richieste concorrenti avviano l'elaborazione una volta sola
+        claimed = Document.objects.filter(pk=doc_instance.pk, is_processed=False).exclude(
+            processing_state__in=IN_PROGRESS_STATES
+        ).update(processing_state='ocr_queued' if ocr else 'rag_queued')
+
+        if not claimed:
+            if Document.objects.filter(pk=doc_instance.pk, is_processed=True).exists():
+                messages.warning(self.request, f"Document '{doc_instance.title}' is already processed.")
             else:
-                # Processing per PDF nativi
-                index_document_rag.delay(doc_instance.pk)
-                doc_instance.processing_state = 'rag_processing'
-                doc_instance.processing_output = "Indexing started in background."
-                messages.info(
-                    self.request, 
-                    f"Processing of '{doc_instance.title}' started! Check the dashboard later for updates."
-                )
-            
-            doc_instance.is_processed = False
+                messages.warning(self.request, f"Document '{doc_instance.title}' is already being processed.")
+            return redirect(self.success_url)
+
+        if ocr:
+            # Processing per PDF scansionati o misti (OCR delle sole pagine senza testo)
+            doc_instance.processing_state = 'ocr_queued'
+            doc_instance.ocr_task_id = ''
+            doc_instance.processing_output = "Document sent for OCR processing on GPU server."
+            messages.info(
+                self.request, 
+                f"Scanned document '{doc_instance.title}' sent for OCR. This may take several minutes."
+            )
         else:
-            messages.warning(self.request, f"Document '{doc_instance.title}' is already processed.")
-            
+            # Processing per PDF nativi: parte quando si libera un posto nella coda della sua dimensione
+            doc_instance.processing_state = 'rag_queued'
+            doc_instance.processing_output = "Waiting for an indexing slot."
+            messages.info(
+                self.request, 
+                f"Processing of '{doc_instance.title}' started! Check the dashboard later for updates."
+            )
+        
+        doc_instance.is_processed = False
         doc_instance.save()
+
+        # Il task parte dopo il salvataggio, così trova il documento già in coda
+        if ocr:
+            publish_documents(doc_instance.pk)
+            enqueue_ocr(doc_instance.pk)
+        else:
+            queue_indexing(doc_instance.pk)
         return redirect(self.success_url)
     
 
@@ -199,6 +292,7 @@ class DocumentDeleteView(DeleteView):
         document_id = self.object.pk  
 
         if self.object.file and os.path.isfile(self.object.file.path):
+            delete_cached_parses(self.object.file.path)
             os.remove(self.object.file.path)
             print(f"[DELETE] File originale eliminato: {self.object.file.path}")
 
@@ -240,8 +334,8 @@ class UploaderDashboardView(UploaderRequiredMixin, ListView):
         
         context['ocr_processing_count'] = Document.objects.filter(
             uploader=self.request.user,
-            document_type='scanned',
-            processing_state__in=['ocr_queued', 'ocr_processing']
+            document_type__in=['scanned', 'mixed'],
+            processing_state__in=['ocr_queued', 'ocr_processing', 'partially_indexed']
         ).count()
         
         context['processed_documents'] = Document.objects.filter(
@@ -249,9 +343,48 @@ class UploaderDashboardView(UploaderRequiredMixin, ListView):
             is_processed=True
         ).order_by('-uploaded_at')
         
+        context['bulk_jobs'] = BulkIngestJob.objects.filter(uploader=self.request.user)[:5]
+        
+        # Istante del rendering: lo stream recupera gli eventi successivi
+        context['rendered_at'] = int(time.time() * 1000)
+        
         return context
 
 
+# Riga di un documento della dashboard, ricaricata quando ne cambia lo stato
+class DocumentRowView(UploaderRequiredMixin, DetailView):
+    model = Document
+    template_name = 'doc_manager/_document_row.html'
+    context_object_name = 'doc'
+
+    def get_queryset(self):
+        return Document.objects.filter(uploader=self.request.user)
+
+
+def _is_uploader(user):
+    return user.is_authenticated and user.profile.is_uploader
+
+
+# Stream SSE con l'avanzamento dei documenti dell'uploader (sostituisce il reload periodico della dashboard)
+async def document_events(request):
+    user = await request.auser()
+    if not await sync_to_async(_is_uploader)(user):
+        return HttpResponseForbidden()
+
+    # Alla riconnessione EventSource invia l'id dell'ultimo evento ricevuto
+    since = request.headers.get('Last-Event-ID') or request.GET.get('since')
+    try:
+        since = int(since)
+    except (TypeError, ValueError):
+        since = None
+
+    response = StreamingHttpResponse(stream_events(user.pk, since), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Nessun buffering nei reverse proxy (nginx)
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
 # View per visualizzare il documento PDF con PDF.js
 class DocumentViewerView(LoginRequiredMixin, DetailView):
     model = Document
@@ -303,4 +436,70 @@ def serve_document_file(request, pk):
     response = FileResponse(open(file_path, 'rb'), content_type='application/pdf')
     response['Content-Disposition'] = f'inline; filename="{filename}"'
     
-    return response
\ No newline at end of file
+    return response
+
+
+def _read_callback_body(request):
+    """
+    Corpo del callback OCR, letto direttamente dallo stream: il payload
+    'completed' contiene tutto il testo OCR e supera facilmente il limite
+    DATA_UPLOAD_MAX_MEMORY_SIZE (2.5 MB) che request.body applica ad ogni
+    richiesta. Qui il limite è OCR_CALLBACK_MAX_BYTES; ritorna None se il
+    corpo lo supera.
+    """
+    max_bytes = getattr(settings, 'OCR_CALLBACK_MAX_BYTES', 100 * 1024 * 1024)
+    try:
+        content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        content_length = 0
+    if content_length > max_bytes:
+        return None
+    body = request.read(max_bytes + 1)
+    return body if len(body) <= max_bytes else None
+
+
+def _valid_ocr_signature(request, body, secret):
+    """
+    Verifica la firma del server GPU: HMAC-SHA256, con il segreto condiviso,
+    di "<X-OCR-Timestamp>." seguito dal corpo della richiesta.
+    """
+    timestamp = request.headers.get('X-OCR-Timestamp', '')
+    signature = request.headers.get('X-OCR-Signature', '')
+    if signature.startswith('sha256='):
+        signature = signature[len('sha256='):]
+    try:
+        skew = abs(time.time() - int(timestamp))
+    except ValueError:
+        return False
+    if skew > getattr(settings, 'OCR_CALLBACK_MAX_SKEW', 300):
+        return False
+
+    expected = hmac.new(secret.encode('utf-8'), f"{timestamp}.".encode('utf-8') + body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+
+@csrf_exempt
+@require_POST
+def ocr_callback(request):
+    """
+    Riceve dal server GPU i progressi e il risultato di un task OCR, con lo
+    stesso payload di /api/ocr/status più document_id e task_id.
+    """
+    secret = getattr(settings, 'OCR_CALLBACK_SECRET', '')
+    if not secret:
+        raise Http404("OCR callback not configured.")
+    body = _read_callback_body(request)
+    if body is None:
+        return JsonResponse({'error': 'payload too large'}, status=413)
+    if not _valid_ocr_signature(request, body, secret):
+        return JsonResponse({'error': 'invalid signature'}, status=403)
+
+    try:
+        payload = json.loads(body)
+        document_pk = int(payload['document_id'])
+        task_id = str(payload['task_id'])
+    except (ValueError, TypeError, KeyError):
+        return JsonResponse({'error': 'invalid payload'}, status=400)
+
+    applied = apply_ocr_update(document_pk, task_id, payload)
+    return JsonResponse({'applied': applied})
@@ -1,5 +1,118 @@
-  if (ocrProcessingCount > 0 || pendingDocumentsCount > 0) {
-    setTimeout(function() {
-      location.reload();
-    }, 30000); // 30 secondi
-  }
\ No newline at end of file
+document.addEventListener('DOMContentLoaded', function () {
+  const dashboard = document.querySelector('.dashboard-container[data-events-url]');
+  if (!dashboard) {
+    return;
+  }
+
+  const pendingList = document.getElementById('pending-documents');
+  const processedSection = document.getElementById('processed-section');
+  const processedList = document.getElementById('processed-documents');
+  const OCR_STATES = ['ocr_queued', 'ocr_processing', 'partially_indexed'];
+  const ACTIVE_STATES = OCR_STATES.concat(['rag_queued', 'rag_processing']);
+
+  function reloadLater() {
+    const active = Array.from(pendingList.querySelectorAll('li[data-document-pk]'))
+      .some(row => ACTIVE_STATES.includes(row.dataset.state));
+    if (active) {
+      setTimeout(function () {
+        location.reload();
+      }, 30000); // 30 secondi
+    }
+  }
+
+  // Browser senza EventSource: reload periodico come prima
+  if (!window.EventSource) {
+    reloadLater();
+    return;
+  }
+
+  function findRow(pk) {
+    return document.querySelector(`li[data-document-pk="${pk}"]`);
+  }
+
+  function updateCounters() {
+    const pendingRows = Array.from(pendingList.querySelectorAll('li[data-document-pk]'));
+    const processedRows = processedList.querySelectorAll('li[data-document-pk]');
+
+    document.getElementById('pending-count').textContent = pendingRows.length;
+    document.getElementById('ocr-processing-count').textContent =
+      pendingRows.filter(row => OCR_STATES.includes(row.dataset.state)).length;
+    document.getElementById('processed-count').textContent = processedRows.length;
+
+    pendingList.classList.toggle('d-none', pendingRows.length === 0);
+    processedSection.classList.toggle('d-none', processedRows.length === 0);
+    if (pendingRows.length > 0) {
+      document.querySelectorAll('.js-empty-state').forEach(alert => alert.classList.add('d-none'));
+    }
+  }
+
+  // pk -> true se durante il caricamento è arrivato un altro cambio di stato
+  const loading = new Map();
+
+  function refreshRow(pk) {
+    if (loading.has(pk)) {
+      loading.set(pk, true);
+      return;
+    }
+    loading.set(pk, false);
+
+    fetch(dashboard.dataset.rowUrl.replace(/0\/$/, `${pk}/`))
+      .then(response => (response.ok ? response.text() : null))
+      .then(function (html) {
+        const current = findRow(pk);
+        // Documento eliminato nel frattempo
+        if (html === null) {
+          if (current) {
+            current.remove();
+          }
+          return;
+        }
+
+        const template = document.createElement('template');
+        template.innerHTML = html.trim();
+        const row = template.content.firstElementChild;
+        const list = row.dataset.processed ? processedList : pendingList;
+        if (current && current.parentElement === list) {
+          current.replaceWith(row);
+        } else {
+          if (current) {
+            current.remove();
+          }
+          list.prepend(row);
+        }
+      })
+      .catch(() => {})
+      .finally(function () {
+        updateCounters();
+        const changedAgain = loading.get(pk);
+        loading.delete(pk);
+        if (changedAgain) {
+          refreshRow(pk);
+        }
+      });
+  }
+
+  function onDocumentEvent(event) {
+    const data = JSON.parse(event.data);
+    const row = findRow(data.document);
+
+    // Stesso stato: aggiorniamo solo il testo di avanzamento, senza ricaricare la riga
+    if (row && row.dataset.state === data.state && Boolean(row.dataset.processed) === data.is_processed) {
+      const output = row.querySelector('.js-processing-output');
+      if (output && data.output) {
+        output.textContent = data.output;
+      }
+      return;
+    }
+    refreshRow(data.document);
+  }
+
+  const source = new EventSource(`${dashboard.dataset.eventsUrl}?since=${dashboard.dataset.renderedAt}`);
+  source.addEventListener('document', onDocumentEvent);
+
+  // Redis non disponibile sul server: si torna al reload periodico
+  source.addEventListener('unavailable', function () {
+    source.close();
+    reloadLater();
+  });
+});